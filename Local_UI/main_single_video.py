@@ -70,17 +70,21 @@ if __name__ == "__main__":
     video_path = '/Users/josephallyndree/Dropbox/Joseph/A-PhD/20250224 - Benchmark Tracking/Code/video-tracking-benchmark/data/videos/20241018151929_D06_cut_5.mp4'
     
     device = select_device()
-    set_cuda_parameters(device)
+    tracking_context = set_cuda_parameters(device)
     
     sam2_checkpoint = "checkpoints/sam2.1_hiera_large.pt"
     model_cfg = "configs/sam2.1/sam2.1_hiera_l.yaml"
     video_dir = "video_frames"
 
-    predictor = build_sam2_video_predictor(model_cfg, sam2_checkpoint, device=device)
+    predictor = build_sam2_video_predictor(model_cfg, sam2_checkpoint, device=device,
+                                           cpu_optimized=device.type == "cpu")
     
     # extract_frames_from_video(video_path, video_dir)
     
     all_frames = scan_dir_for_frames(video_dir, 8)
     print(len(all_frames))
     
-    sys.exit(main(video_path))
\ No newline at end of file
+    # (the GUI tracks in the main thread, within the autocast on CPU)
+    with tracking_context:
+        exit_code = main(video_path)
+    sys.exit(exit_code)
\ No newline at end of file
@@ -1,3 +1,4 @@
+import contextlib
 import os
 import sys
 import numpy as np
@@ -10,11 +11,17 @@ os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..','..',"sam2")))
 
 
-def select_device():
+def select_device(device_name=None):
     """
     Selects the device for computation based on availability of CUDA or MPS.
+    Args:
+        device_name (str, optional): device to use instead (e.g. "cpu" on CPU-only
+            tracking nodes, or with the SAM2_DEVICE environment variable).
     """
-    if torch.cuda.is_available():
+    device_name = device_name or os.environ.get("SAM2_DEVICE")
+    if device_name is not None:
+        device = torch.device(device_name)
+    elif torch.cuda.is_available():
         device = torch.device("cuda")
     elif torch.backends.mps.is_available():
         device = torch.device("mps")
@@ -25,9 +32,12 @@ def select_device():
 
 def set_cuda_parameters (device) :
     """
-    Set CUDA parameters for the device.
+    Set CUDA parameters for the device (or the CPU inference profile on CPU).
     Args:
-        device: The device to set parameters for (CUDA or MPS).
+        device: The device to set parameters for (CUDA, MPS or CPU).
+    Returns:
+        The context to run the tracking in (the CPU autocast on CPU, which only
+        applies to the thread entering it), e.g. `with set_cuda_parameters(device):`.
     """
     if device.type == "cuda":
         # use bfloat16 for the entire notebook
@@ -42,6 +52,13 @@ def set_cuda_parameters (device) :
             "give numerically different outputs and sometimes degraded performance on MPS. \n"
             "See e.g. https://github.com/pytorch/pytorch/issues/84936 for a discussion."
         )
+    elif device.type == "cpu":
+        from sam2.utils.cpu_inference import configure_cpu_threads, cpu_autocast
+        # one thread per physical core, and bfloat16 if the CPU supports it natively
+        # (the predictor should be built with `cpu_optimized=True` to match)
+        configure_cpu_threads()
+        return cpu_autocast()
+    return contextlib.nullcontext()
 
 
 def show_mask(mask, ax, obj_id=None, random_color=False):
@@ -20,6 +20,8 @@ from data.store import set_videos
 from flask import Flask, make_response, Request, request, Response, send_from_directory
 from flask_cors import CORS
 from inference.data_types import PropagateDataResponse, PropagateInVideoRequest
+from inference.mask_delta import MASK_TYPE_DELTA, MASK_TYPE_RLE
+from inference.metrics import REGISTRY
 from inference.multipart import MultipartResponseBuilder
 from inference.predictor import InferenceAPI
 from strawberry.flask.views import GraphQLView
@@ -40,6 +42,12 @@ def healthy() -> Response:
     return make_response("OK", 200)
 
 
+@app.route("/metrics")
+def metrics() -> Response:
+    inference_api.update_metrics()
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route(f"/{GALLERY_PREFIX}/<path:path>", methods=["GET"])
 def send_gallery_video(path: str) -> Response:
     try:
@@ -80,6 +88,9 @@ def propagate_in_video() -> Response:
     args = {
         "session_id": data["session_id"],
         "start_frame_index": data.get("start_frame_index", 0),
+        # Clients can opt into the compact binary delta format via the
+        # `Mask-Type` header; default to JSON-encoded RLE masks.
+        "mask_type": request.headers.get("Mask-Type", MASK_TYPE_RLE),
     }
 
     boundary = "frame"
@@ -91,6 +102,7 @@ def gen_track_with_mask_stream(
     boundary: str,
     session_id: str,
     start_frame_index: int,
+    mask_type: str = MASK_TYPE_RLE,
 ) -> Generator[bytes, None, None]:
     with inference_api.autocast_context():
         request = PropagateInVideoRequest(
@@ -99,6 +111,21 @@ def gen_track_with_mask_stream(
             start_frame_index=start_frame_index,
         )
 
+        if mask_type == MASK_TYPE_DELTA:
+            for chunk in inference_api.propagate_in_video_delta(request=request):
+                yield MultipartResponseBuilder.build(
+                    boundary=boundary,
+                    headers={
+                        "Content-Type": "application/octet-stream",
+                        "Frame-Current": "-1",
+                        # Total frames minus the reference frame
+                        "Frame-Total": "-1",
+                        "Mask-Type": MASK_TYPE_DELTA,
+                    },
+                    body=chunk,
+                ).get_message()
+            return
+
         for chunk in inference_api.propagate_in_video(request=request):
             yield MultipartResponseBuilder.build(
                 boundary=boundary,
@@ -107,7 +134,7 @@ def gen_track_with_mask_stream(
                     "Frame-Current": "-1",
                     # Total frames minus the reference frame
                     "Frame-Total": "-1",
-                    "Mask-Type": "RLE[]",
+                    "Mask-Type": MASK_TYPE_RLE,
                 },
                 body=chunk.to_json().encode("UTF-8"),
             ).get_message()
@@ -19,6 +19,9 @@ logger.info(f"using model size {MODEL_SIZE}")
 
 FFMPEG_NUM_THREADS = int(os.getenv("FFMPEG_NUM_THREADS", "1"))
 
+# If set, per-request trace spans are logged as JSON lines
+TRACE_ENABLED = os.getenv("SAM2_DEMO_TRACE", "0") == "1"
+
 # Path for all data used in API
 DATA_PATH = Path(os.getenv("DATA_PATH", "/data"))
 
@@ -48,8 +51,20 @@ POSTERS_PREFIX = "posters"
 # Path where all posters are stored
 POSTERS_PATH = DATA_PATH / POSTERS_PREFIX
 
+# Path where the transcode cache index is stored. Each entry maps a key derived
+# from the content hash and trim parameters of an upload to its transcoded video
+TRANSCODE_CACHE_PATH = DATA_PATH / "transcode_cache"
+
+# Manifest caching gallery video metadata (size, mtime, dimensions, poster) so
+# that posters are only regenerated for new or changed videos on startup
+GALLERY_MANIFEST_PATH = DATA_PATH / "gallery_manifest.json"
+
+# Number of worker processes used to generate posters for gallery videos
+PRELOAD_NUM_WORKERS = int(os.getenv("PRELOAD_NUM_WORKERS", str(os.cpu_count() or 1)))
+
 # Make sure any of those paths exist
 os.makedirs(DATA_PATH, exist_ok=True)
 os.makedirs(GALLERY_PATH, exist_ok=True)
 os.makedirs(UPLOADS_PATH, exist_ok=True)
 os.makedirs(POSTERS_PATH, exist_ok=True)
+os.makedirs(TRANSCODE_CACHE_PATH, exist_ok=True)
@@ -3,22 +3,41 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
+import json
+import logging
 import os
 import shutil
 import subprocess
+from concurrent.futures import ProcessPoolExecutor
 from glob import glob
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Any, Dict, Optional
 
 import imagesize
-from app_conf import GALLERY_PATH, POSTERS_PATH, POSTERS_PREFIX
+from app_conf import (
+    GALLERY_MANIFEST_PATH,
+    GALLERY_PATH,
+    POSTERS_PATH,
+    POSTERS_PREFIX,
+    PRELOAD_NUM_WORKERS,
+)
 from data.data_types import Video
 from tqdm import tqdm
 
+logger = logging.getLogger(__name__)
+
+# Bump this when the layout of manifest entries changes to invalidate old manifests
+MANIFEST_VERSION = 1
+
 
 def preload_data() -> Dict[str, Video]:
     """
     Preload data including gallery videos and their posters.
+
+    Video metadata is persisted in a manifest keyed by video path. Posters are only
+    regenerated (in parallel across a process pool) for videos that are new or whose
+    size or modification time changed since the manifest was written, so startup
+    cost does not grow with the size of an unchanged gallery.
     """
     # Dictionaries for videos and datasets on the backend.
     # Note that since Python 3.7, dictionaries preserve their insert order, so
@@ -29,13 +48,144 @@ def preload_data() -> Dict[str, Video]:
     video_path_pattern = os.path.join(GALLERY_PATH, "**/*.mp4")
     video_paths = glob(video_path_pattern, recursive=True)
 
-    for p in tqdm(video_paths):
-        video = get_video(p, GALLERY_PATH)
+    manifest = load_manifest()
+    entries = {}
+    stale_paths = []
+    for p in video_paths:
+        entry = manifest.get(p)
+        if entry is not None and is_manifest_entry_valid(entry, p):
+            entries[p] = entry
+        else:
+            stale_paths.append(p)
+
+    if len(stale_paths) > 0:
+        logger.info(
+            f"generating posters for {len(stale_paths)} of {len(video_paths)} gallery videos"
+        )
+        num_workers = max(1, min(PRELOAD_NUM_WORKERS, len(stale_paths)))
+        with ProcessPoolExecutor(max_workers=num_workers) as pool:
+            new_entries = pool.map(get_manifest_entry, stale_paths)
+            for p, entry in zip(
+                stale_paths, tqdm(new_entries, total=len(stale_paths))
+            ):
+                entries[p] = entry
+        save_manifest(entries)
+
+    for p in video_paths:
+        entry = entries[p]
+        video = get_video(
+            p,
+            GALLERY_PATH,
+            generate_poster=False,
+            width=entry["width"],
+            height=entry["height"],
+        )
+        video.poster_path = entry["poster_path"]
         all_videos[video.code] = video
 
     return all_videos
 
 
+def load_manifest() -> Dict[str, Dict[str, Any]]:
+    """
+    Load the gallery manifest, returning an empty manifest if it is missing,
+    unreadable or was written by an incompatible version.
+    """
+    try:
+        with open(GALLERY_MANIFEST_PATH, "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest.get("videos", {})
+
+
+def save_manifest(entries: Dict[str, Dict[str, Any]]) -> None:
+    """
+    Atomically write the gallery manifest.
+    """
+    tmp_path = f"{GALLERY_MANIFEST_PATH}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "videos": entries}, f)
+        os.replace(tmp_path, GALLERY_MANIFEST_PATH)
+    except OSError as e:
+        logger.warning(f"failed to write gallery manifest: {e}")
+
+
+def is_manifest_entry_valid(entry: Dict[str, Any], filepath: str) -> bool:
+    """
+    Check that a manifest entry still matches the video file and its poster exists.
+    """
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return False
+    return (
+        entry.get("mtime") == stat.st_mtime
+        and entry.get("size") == stat.st_size
+        and os.path.exists(os.path.join(POSTERS_PATH, entry["poster_filename"]))
+    )
+
+
+def get_manifest_entry(filepath: str) -> Dict[str, Any]:
+    """
+    Generate the poster of a gallery video and return its manifest entry. This runs
+    in worker processes, so it only returns plain (picklable) data.
+    """
+    stat = os.stat(filepath)
+    poster_filename = get_poster_filename(filepath)
+    poster_output_path = os.path.join(POSTERS_PATH, poster_filename)
+    extract_poster(filepath, poster_output_path)
+    # Extract video width and height from poster. This is important to optimize
+    # rendering previews in the mosaic video preview.
+    width, height = imagesize.get(poster_output_path)
+    return {
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+        "width": width,
+        "height": height,
+        "poster_filename": poster_filename,
+        "poster_path": f"{POSTERS_PREFIX}/{poster_filename}",
+    }
+
+
+def get_poster_filename(filepath: os.PathLike) -> str:
+    poster_id = os.path.splitext(os.path.basename(filepath))[0]
+    return f"{str(poster_id)}.jpg"
+
+
+def extract_poster(
+    filepath: os.PathLike,
+    poster_output_path: os.PathLike,
+    verbose: Optional[bool] = False,
+) -> None:
+    """
+    Extract the first frame from video.
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    subprocess.call(
+        [
+            ffmpeg,
+            "-y",
+            "-i",
+            str(filepath),
+            "-pix_fmt",
+            "yuv420p",
+            "-frames:v",
+            "1",
+            "-update",
+            "1",
+            "-strict",
+            "unofficial",
+            str(poster_output_path),
+        ],
+        stdout=None if verbose else subprocess.DEVNULL,
+        stderr=None if verbose else subprocess.DEVNULL,
+    )
+
+
 def get_video(
     filepath: os.PathLike,
     absolute_path: Path,
@@ -52,32 +202,12 @@ def get_video(
     video_path = os.path.relpath(filepath, absolute_path.parent)
     poster_path = None
     if generate_poster:
-        poster_id = os.path.splitext(os.path.basename(filepath))[0]
-        poster_filename = f"{str(poster_id)}.jpg"
+        poster_filename = get_poster_filename(filepath)
         poster_path = f"{POSTERS_PREFIX}/{poster_filename}"
 
         # Extract the first frame from video
         poster_output_path = os.path.join(POSTERS_PATH, poster_filename)
-        ffmpeg = shutil.which("ffmpeg")
-        subprocess.call(
-            [
-                ffmpeg,
-                "-y",
-                "-i",
-                str(filepath),
-                "-pix_fmt",
-                "yuv420p",
-                "-frames:v",
-                "1",
-                "-update",
-                "1",
-                "-strict",
-                "unofficial",
-                str(poster_output_path),
-            ],
-            stdout=None if verbose else subprocess.DEVNULL,
-            stderr=None if verbose else subprocess.DEVNULL,
-        )
+        extract_poster(filepath, poster_output_path, verbose=verbose)
 
         # Extract video width and height from poster. This is important to optimize
         # rendering previews in the mosaic video preview.
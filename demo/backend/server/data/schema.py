@@ -4,6 +4,7 @@
 # LICENSE file in the root directory of this source tree.
 
 import hashlib
+import json
 import os
 import shutil
 import tempfile
@@ -16,6 +17,7 @@ from app_conf import (
     DATA_PATH,
     DEFAULT_VIDEO_PATH,
     MAX_UPLOAD_VIDEO_DURATION,
+    TRANSCODE_CACHE_PATH,
     UPLOADS_PATH,
     UPLOADS_PREFIX,
 )
@@ -38,7 +40,12 @@ from data.data_types import (
 )
 from data.loader import get_video
 from data.store import get_videos
-from data.transcoder import get_video_metadata, transcode, VideoMetadata
+from data.transcoder import (
+    get_transcode_cache_key,
+    get_video_metadata,
+    transcode,
+    VideoMetadata,
+)
 from inference.data_types import (
     AddPointsRequest,
     CancelPropagateInVideoRequest,
@@ -256,14 +263,69 @@ class Mutation:
         return CancelPropagateInVideo(success=response.success)
 
 
+# Chunk size used when streaming uploads to disk and hashing files
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
 def get_file_hash(video_path_or_file) -> str:
+    hasher = hashlib.sha256()
     if isinstance(video_path_or_file, str):
         with open(video_path_or_file, "rb") as in_f:
-            result = hashlib.sha256(in_f.read()).hexdigest()
+            for chunk in iter(lambda: in_f.read(HASH_CHUNK_SIZE), b""):
+                hasher.update(chunk)
     else:
         video_path_or_file.seek(0)
-        result = hashlib.sha256(video_path_or_file.read()).hexdigest()
-    return result
+        for chunk in iter(lambda: video_path_or_file.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _write_file_and_hash(file: Upload, out_path: str) -> str:
+    """
+    Stream the upload to `out_path` and return the sha256 of its content, reading
+    the upload only once.
+    """
+    hasher = hashlib.sha256()
+    with open(out_path, "wb") as out_f:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+            out_f.write(chunk)
+    return hasher.hexdigest()
+
+
+def _get_cached_transcode(cache_key: str) -> Optional[Tuple[str, str, VideoMetadata]]:
+    """
+    Return the filepath, file key and video metadata of a previous transcode with
+    the same cache key, or None if there is none or its output no longer exists.
+    """
+    cache_entry_path = os.path.join(TRANSCODE_CACHE_PATH, f"{cache_key}.json")
+    try:
+        with open(cache_entry_path, "r") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    filepath = os.path.join(UPLOADS_PATH, entry["filename"])
+    if not os.path.exists(filepath):
+        return None
+    file_key = UPLOADS_PREFIX + "/" + entry["filename"]
+    return filepath, file_key, VideoMetadata.from_dict(entry["metadata"])
+
+
+def _set_cached_transcode(
+    cache_key: str, filepath: str, video_metadata: VideoMetadata
+) -> None:
+    cache_entry_path = os.path.join(TRANSCODE_CACHE_PATH, f"{cache_key}.json")
+    tmp_path = f"{cache_entry_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(
+            {
+                "filename": os.path.basename(filepath),
+                "metadata": video_metadata.to_dict(),
+            },
+            f,
+        )
+    os.replace(tmp_path, cache_entry_path)
 
 
 def _get_start_sec_duration_sec(
@@ -293,11 +355,27 @@ def process_video(
 
     Returns the filepath, s3_file_key, hash & video metaedata as a tuple.
     """
+    start_time_sec, duration_time_sec = _get_start_sec_duration_sec(
+        max_time=max_time,
+        start_time_sec=start_time_sec,
+        duration_time_sec=duration_time_sec,
+    )
+
     with tempfile.TemporaryDirectory() as tempdir:
         in_path = f"{tempdir}/in.mp4"
         out_path = f"{tempdir}/out.mp4"
-        with open(in_path, "wb") as in_f:
-            in_f.write(file.read())
+        content_hash = _write_file_and_hash(file, in_path)
+
+        # Return the previously transcoded video if the same content was already
+        # uploaded with the same trim parameters.
+        cache_key = get_transcode_cache_key(
+            content_hash,
+            seek_t=start_time_sec,
+            duration_time_sec=duration_time_sec,
+        )
+        cached = _get_cached_transcode(cache_key)
+        if cached is not None:
+            return cached
 
         try:
             video_metadata = get_video_metadata(in_path)
@@ -312,12 +390,6 @@ def process_video(
         if video_metadata.duration_sec in (None, 0):
             raise Exception("video container does time duration metadata")
 
-        start_time_sec, duration_time_sec = _get_start_sec_duration_sec(
-            max_time=max_time,
-            start_time_sec=start_time_sec,
-            duration_time_sec=duration_time_sec,
-        )
-
         # Transcode video to make sure videos returned to the app are all in
         # the same format, duration, resolution, fps.
         transcode(
@@ -347,6 +419,7 @@ def process_video(
 
         assert filepath is not None and file_key is not None
         shutil.move(out_path, filepath)
+        _set_cached_transcode(cache_key, filepath, out_video_metadata)
 
         return filepath, file_key, out_video_metadata
 
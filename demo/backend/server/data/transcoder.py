@@ -4,12 +4,14 @@
 # LICENSE file in the root directory of this source tree.
 
 import ast
+import hashlib
+import json
 import math
 import os
 import shutil
 import subprocess
 from dataclasses import dataclass
-from typing import Optional
+from typing import Any, Dict, Optional
 
 import av
 from app_conf import FFMPEG_NUM_THREADS
@@ -32,6 +34,37 @@ class VideoMetadata:
     video_start_time: float
 
 
+def get_encode_settings() -> Dict[str, Any]:
+    return {
+        "codec": os.environ.get("VIDEO_ENCODE_CODEC", "libx264"),
+        "crf": int(os.environ.get("VIDEO_ENCODE_CRF", "23")),
+        "fps": int(os.environ.get("VIDEO_ENCODE_FPS", "24")),
+        "max_w": int(os.environ.get("VIDEO_ENCODE_MAX_WIDTH", "1280")),
+        "max_h": int(os.environ.get("VIDEO_ENCODE_MAX_HEIGHT", "720")),
+    }
+
+
+def get_transcode_cache_key(
+    content_hash: str,
+    seek_t: float,
+    duration_time_sec: float,
+) -> str:
+    """
+    Return a key identifying the output of `transcode` for an input with the given
+    content hash and trim parameters. Trim times are rounded the same way they are
+    passed to ffmpeg, and the key covers the encode settings and TRANSCODE_VERSION
+    so that changing any of them invalidates previously cached outputs.
+    """
+    key = {
+        "version": TRANSCODE_VERSION,
+        "content_hash": content_hash,
+        "seek_t": f"{seek_t:.2f}",
+        "duration_time_sec": f"{duration_time_sec:.2f}",
+        **get_encode_settings(),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
 def transcode(
     in_path: str,
     out_path: str,
@@ -39,24 +72,20 @@ def transcode(
     seek_t: float,
     duration_time_sec: float,
 ):
-    codec = os.environ.get("VIDEO_ENCODE_CODEC", "libx264")
-    crf = int(os.environ.get("VIDEO_ENCODE_CRF", "23"))
-    fps = int(os.environ.get("VIDEO_ENCODE_FPS", "24"))
-    max_w = int(os.environ.get("VIDEO_ENCODE_MAX_WIDTH", "1280"))
-    max_h = int(os.environ.get("VIDEO_ENCODE_MAX_HEIGHT", "720"))
+    settings = get_encode_settings()
     verbose = ast.literal_eval(os.environ.get("VIDEO_ENCODE_VERBOSE", "False"))
 
     normalize_video(
         in_path=in_path,
         out_path=out_path,
-        max_w=max_w,
-        max_h=max_h,
+        max_w=settings["max_w"],
+        max_h=settings["max_h"],
         seek_t=seek_t,
         max_time=duration_time_sec,
         in_metadata=in_metadata,
-        codec=codec,
-        crf=crf,
-        fps=fps,
+        codec=settings["codec"],
+        crf=settings["crf"],
+        fps=settings["fps"],
         verbose=verbose,
     )
 
@@ -0,0 +1,122 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Compact binary encoding of per-frame object masks for the propagation stream.
+
+Clients opt into this format by sending `Mask-Type: DELTA[]` on the
+`/propagate_in_video` request. Each multipart part then carries one frame,
+encoded as little-endian binary:
+
+    frame header:  uint32 frame_index, uint32 num_objects
+    per object:    int32  object_id
+                   uint8  kind (0 = keyframe, 1 = XOR delta, 2 = unchanged)
+                   uint32 height, width
+                   uint32 x0, y0, x1, y1   (crop box, exclusive end; empty if x1 <= x0)
+                   uint32 num_counts
+                   uint32 counts[num_counts]
+
+The counts are an uncompressed run-length encoding of the cropped region in
+row-major order, starting with a run of zeros. For a keyframe, the decoded crop
+is the mask itself (pixels outside the crop are 0). For an XOR delta, the
+decoded crop is XOR-ed into the previous mask of the same object in this stream
+(pixels outside the crop are unchanged). The encoder picks whichever of the two
+is smaller, so frame jumps (e.g. when propagation switches from forward to
+backward) and newly added objects degrade gracefully to keyframes.
+"""
+
+import struct
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+MASK_TYPE_RLE = "RLE[]"
+MASK_TYPE_DELTA = "DELTA[]"
+
+KIND_KEYFRAME = 0
+KIND_DELTA = 1
+KIND_UNCHANGED = 2
+
+_FRAME_HEADER = struct.Struct("<II")
+_OBJECT_HEADER = struct.Struct("<iBIIIIIII")
+
+Box = Tuple[int, int, int, int]
+
+
+def _bbox(mask: np.ndarray) -> Optional[Box]:
+    """Return the (x0, y0, x1, y1) box with exclusive end, or None if empty."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+
+def _crop_rle(mask: np.ndarray, box: Optional[Box]) -> np.ndarray:
+    """Uncompressed row-major RLE of `mask` cropped to `box`, starting with zeros."""
+    if box is None:
+        return np.zeros((0,), dtype=np.uint32)
+    x0, y0, x1, y1 = box
+    flat = mask[y0:y1, x0:x1].reshape(-1)
+    change_indices = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    boundaries = np.concatenate(([0], change_indices, [flat.size]))
+    counts = np.diff(boundaries)
+    if flat[0]:
+        # counts always start with a (possibly empty) run of zeros
+        counts = np.concatenate(([0], counts))
+    return counts.astype(np.uint32)
+
+
+class MaskDeltaEncoder:
+    """
+    Stateful encoder for one propagation stream. It remembers the last mask sent
+    for each object so that subsequent frames can be sent as XOR deltas.
+    """
+
+    def __init__(self) -> None:
+        self.previous_masks: Dict[int, np.ndarray] = {}
+
+    def encode(
+        self, frame_index: int, object_ids: List[int], masks: np.ndarray
+    ) -> bytes:
+        """
+        Encode the binary masks ([N, H, W] bool) of one frame into a binary part.
+        """
+        parts = [_FRAME_HEADER.pack(frame_index, len(object_ids))]
+        for object_id, mask in zip(object_ids, masks):
+            parts.append(self.__encode_object(object_id, np.asarray(mask, dtype=bool)))
+        # Forget objects that are no longer part of the stream (e.g. removed)
+        for object_id in list(self.previous_masks):
+            if object_id not in object_ids:
+                del self.previous_masks[object_id]
+        return b"".join(parts)
+
+    def __encode_object(self, object_id: int, mask: np.ndarray) -> bytes:
+        height, width = mask.shape
+        previous = self.previous_masks.get(object_id)
+        self.previous_masks[object_id] = mask
+
+        keyframe_box = _bbox(mask)
+        kind, box, counts = KIND_KEYFRAME, keyframe_box, None
+        if previous is not None and previous.shape == mask.shape:
+            delta = np.logical_xor(mask, previous)
+            delta_box = _bbox(delta)
+            if delta_box is None:
+                kind, box, counts = KIND_UNCHANGED, None, _crop_rle(delta, None)
+            else:
+                delta_counts = _crop_rle(delta, delta_box)
+                keyframe_counts = _crop_rle(mask, keyframe_box)
+                if delta_counts.size < keyframe_counts.size:
+                    kind, box, counts = KIND_DELTA, delta_box, delta_counts
+                else:
+                    counts = keyframe_counts
+        if counts is None:
+            counts = _crop_rle(mask, keyframe_box)
+
+        x0, y0, x1, y1 = box if box is not None else (0, 0, 0, 0)
+        header = _OBJECT_HEADER.pack(
+            object_id, kind, height, width, x0, y0, x1, y1, counts.size
+        )
+        return header + counts.astype("<u4").tobytes()
@@ -0,0 +1,340 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Minimal metrics registry exporting the Prometheus text exposition format, plus
+optional per-request trace spans (enabled with SAM2_DEMO_TRACE=1) that are logged
+as JSON lines.
+"""
+
+import contextlib
+import contextvars
+import json
+import logging
+import math
+import time
+import uuid
+from threading import Lock
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from app_conf import TRACE_ENABLED
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+FPS_BUCKETS = (1.0, 2.0, 5.0, 10.0, 15.0, 20.0, 30.0, 45.0, 60.0, 90.0, 120.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: Sequence[str], labelvalues: LabelValues) -> str:
+    if len(labelnames) == 0:
+        return ""
+    pairs = [
+        f'{name}="{_escape_label_value(value)}"'
+        for name, value in zip(labelnames, labelvalues)
+    ]
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        with self.lock:
+            lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def _render_samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}"
+            for k, v in self.values.items()
+        ]
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.values.clear()
+
+    def _render_samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}"
+            for k, v in self.values.items()
+        ]
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # per label values: (bucket counts, sum, count)
+        self.values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self.lock:
+            bucket_counts, total, count = self.values.get(
+                key, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for i, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    bucket_counts[i] += 1
+            self.values[key] = (bucket_counts, total + value, count + 1)
+
+    def _render_samples(self) -> List[str]:
+        lines = []
+        bucket_labelnames = self.labelnames + ("le",)
+        for key, (bucket_counts, total, count) in self.values.items():
+            for upper_bound, bucket_count in zip(self.buckets, bucket_counts):
+                labels = _format_labels(
+                    bucket_labelnames, key + (_format_value(upper_bound),)
+                )
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+OPERATION_LATENCY = REGISTRY.register(
+    Histogram(
+        "sam2_operation_latency_seconds",
+        "Latency of inference API operations.",
+        labelnames=("operation",),
+    )
+)
+OPERATION_ERRORS = REGISTRY.register(
+    Counter(
+        "sam2_operation_errors_total",
+        "Number of inference API operations that raised an error.",
+        labelnames=("operation",),
+    )
+)
+PROPAGATE_FRAMES = REGISTRY.register(
+    Counter(
+        "sam2_propagate_frames_total",
+        "Number of frames produced by propagate_in_video.",
+    )
+)
+PROPAGATE_FRAME_LATENCY = REGISTRY.register(
+    Histogram(
+        "sam2_propagate_frame_latency_seconds",
+        "Time to produce one frame in propagate_in_video.",
+    )
+)
+PROPAGATE_FPS = REGISTRY.register(
+    Histogram(
+        "sam2_propagate_frames_per_second",
+        "Throughput of each propagate_in_video call in frames per second.",
+        buckets=FPS_BUCKETS,
+    )
+)
+MASK_ENCODE_LATENCY = REGISTRY.register(
+    Histogram(
+        "sam2_mask_encode_seconds",
+        "Time to encode the masks of one frame for the response.",
+        labelnames=("mask_type",),
+    )
+)
+QUEUE_DEPTH = REGISTRY.register(
+    Gauge(
+        "sam2_inference_queue_depth",
+        "Number of requests waiting for the inference lock.",
+    )
+)
+LIVE_SESSIONS = REGISTRY.register(
+    Gauge("sam2_live_sessions", "Number of live inference sessions.")
+)
+SESSION_MEMORY = REGISTRY.register(
+    Gauge(
+        "sam2_session_memory_bytes",
+        "Bytes held by tensors in the inference state of each session.",
+        labelnames=("session_id", "device"),
+    )
+)
+FEATURE_CACHE_REQUESTS = REGISTRY.register(
+    Counter(
+        "sam2_feature_cache_requests_total",
+        "Image feature cache lookups in the video predictor.",
+        labelnames=("result",),
+    )
+)
+DEVICE_MEMORY = REGISTRY.register(
+    Gauge(
+        "sam2_device_memory_bytes",
+        "Memory allocated and reserved by the torch CUDA caching allocator.",
+        labelnames=("kind",),
+    )
+)
+
+_current_trace_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "sam2_trace_id", default=None
+)
+
+
+@contextlib.contextmanager
+def trace_span(name: str, **attributes) -> Iterator[None]:
+    """
+    Record a span of work. Spans nested in the same request share a trace id. If
+    tracing is disabled, this is a no-op.
+    """
+    if not TRACE_ENABLED:
+        yield
+        return
+
+    trace_id = _current_trace_id.get()
+    token = None
+    if trace_id is None:
+        trace_id = uuid.uuid4().hex
+        token = _current_trace_id.set(trace_id)
+    start_time = time.time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        logger.info(
+            json.dumps(
+                {
+                    "trace_id": trace_id,
+                    "span": name,
+                    "start_time": start_time,
+                    "duration_sec": time.perf_counter() - start,
+                    **attributes,
+                }
+            )
+        )
+        if token is not None:
+            _current_trace_id.reset(token)
+
+
+@contextlib.contextmanager
+def track_operation(operation: str, **attributes) -> Iterator[None]:
+    """
+    Observe the latency (and errors) of an inference API operation and record a
+    trace span for it.
+    """
+    start = time.perf_counter()
+    try:
+        with trace_span(operation, **attributes):
+            yield
+    except Exception:
+        OPERATION_ERRORS.inc(operation=operation)
+        raise
+    finally:
+        OPERATION_LATENCY.observe(time.perf_counter() - start, operation=operation)
+
+
+@contextlib.contextmanager
+def queued(lock: Lock) -> Iterator[None]:
+    """
+    Acquire `lock` while counting the requests waiting for it in QUEUE_DEPTH.
+    """
+    QUEUE_DEPTH.inc()
+    try:
+        lock.acquire()
+    finally:
+        QUEUE_DEPTH.dec()
+    try:
+        yield
+    finally:
+        lock.release()
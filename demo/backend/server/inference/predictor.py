@@ -6,10 +6,11 @@
 import contextlib
 import logging
 import os
+import time
 import uuid
 from pathlib import Path
 from threading import Lock
-from typing import Any, Dict, Generator, List
+from typing import Any, Dict, Generator, List, Tuple
 
 import numpy as np
 import torch
@@ -33,6 +34,19 @@ from inference.data_types import (
     StartSessionRequest,
     StartSessionResponse,
 )
+from inference.mask_delta import MASK_TYPE_DELTA, MASK_TYPE_RLE, MaskDeltaEncoder
+from inference.metrics import (
+    DEVICE_MEMORY,
+    FEATURE_CACHE_REQUESTS,
+    LIVE_SESSIONS,
+    MASK_ENCODE_LATENCY,
+    PROPAGATE_FPS,
+    PROPAGATE_FRAME_LATENCY,
+    PROPAGATE_FRAMES,
+    queued,
+    SESSION_MEMORY,
+    track_operation,
+)
 from pycocotools.mask import decode as decode_masks, encode as encode_masks
 from sam2.build_sam import build_sam2_video_predictor
 
@@ -85,9 +99,17 @@ class InferenceAPI:
                 "See e.g. https://github.com/pytorch/pytorch/issues/84936 for a discussion."
             )
 
+        # with several workers on CPU, share the weights between their processes
+        shared_weights_dir = os.environ.get("SAM2_DEMO_SHARED_WEIGHTS_DIR")
+        if shared_weights_dir:
+            logger.info(f"sharing the model weights in {shared_weights_dir}")
+
         self.device = device
         self.predictor = build_sam2_video_predictor(
-            model_cfg, checkpoint, device=device
+            model_cfg,
+            checkpoint,
+            device=device,
+            shared_weights_dir=shared_weights_dir or None,
         )
         self.inference_lock = Lock()
 
@@ -97,8 +119,18 @@ class InferenceAPI:
         else:
             return contextlib.nullcontext()
 
+    @contextlib.contextmanager
+    def __inference_context(self, operation: str, **attributes):
+        """
+        Run an operation under autocast and the inference lock, recording its
+        latency, the time spent waiting for the lock and an optional trace span.
+        """
+        with track_operation(operation, **attributes), self.autocast_context():
+            with queued(self.inference_lock):
+                yield
+
     def start_session(self, request: StartSessionRequest) -> StartSessionResponse:
-        with self.autocast_context(), self.inference_lock:
+        with self.__inference_context("start_session"):
             session_id = str(uuid.uuid4())
             # for MPS devices, we offload the video frames to CPU by default to avoid
             # memory fragmentation in MPS (which sometimes crashes the entire process)
@@ -120,7 +152,7 @@ class InferenceAPI:
     def add_points(
         self, request: AddPointsRequest, test: str = ""
     ) -> PropagateDataResponse:
-        with self.autocast_context(), self.inference_lock:
+        with self.__inference_context("add_points"):
             session = self.__get_session(request.session_id)
             inference_state = session["state"]
 
@@ -158,7 +190,7 @@ class InferenceAPI:
         - mask is a numpy array of shape [H_im, W_im] (containing 1 for foreground and 0 for background).
         Note: providing an input mask would overwrite any previous input points on this frame.
         """
-        with self.autocast_context(), self.inference_lock:
+        with self.__inference_context("add_mask"):
             session_id = request.session_id
             frame_idx = request.frame_index
             obj_id = request.object_id
@@ -198,7 +230,7 @@ class InferenceAPI:
         """
         Remove all input points in a specific frame.
         """
-        with self.autocast_context(), self.inference_lock:
+        with self.__inference_context("clear_points_in_frame"):
             session_id = request.session_id
             frame_idx = request.frame_index
             obj_id = request.object_id
@@ -230,7 +262,7 @@ class InferenceAPI:
         """
         Remove all input points in all frames throughout the video.
         """
-        with self.autocast_context(), self.inference_lock:
+        with self.__inference_context("clear_points_in_video"):
             session_id = request.session_id
             logger.info(f"clear all inputs across the video in session {session_id}")
             session = self.__get_session(session_id)
@@ -242,7 +274,7 @@ class InferenceAPI:
         """
         Remove an object id from the tracking state.
         """
-        with self.autocast_context(), self.inference_lock:
+        with self.__inference_context("remove_object"):
             session_id = request.session_id
             obj_id = request.object_id
             logger.info(f"remove object in session {session_id}: {obj_id=}")
@@ -270,27 +302,61 @@ class InferenceAPI:
     def propagate_in_video(
         self, request: PropagateInVideoRequest
     ) -> Generator[PropagateDataResponse, None, None]:
+        """
+        Propagate existing input points in all frames to track the object across
+        video, yielding one response with RLE masks per frame.
+        """
+        for frame_idx, obj_ids, masks_binary in self.__propagate_masks(request):
+            rle_mask_list = self.__get_rle_mask_list(
+                object_ids=obj_ids, masks=masks_binary
+            )
+
+            yield PropagateDataResponse(
+                frame_index=frame_idx,
+                results=rle_mask_list,
+            )
+
+    def propagate_in_video_delta(
+        self, request: PropagateInVideoRequest
+    ) -> Generator[bytes, None, None]:
+        """
+        Same as `propagate_in_video`, but yields frames in the compact binary
+        delta format (see `inference.mask_delta`), where each object mask is sent
+        as a cropped keyframe or as an XOR delta against its previous mask.
+        """
+        encoder = MaskDeltaEncoder()
+        for frame_idx, obj_ids, masks_binary in self.__propagate_masks(request):
+            encode_start = time.perf_counter()
+            chunk = encoder.encode(
+                frame_index=frame_idx, object_ids=obj_ids, masks=masks_binary
+            )
+            MASK_ENCODE_LATENCY.observe(
+                time.perf_counter() - encode_start, mask_type=MASK_TYPE_DELTA
+            )
+            yield chunk
+
+    def __propagate_masks(
+        self, request: PropagateInVideoRequest
+    ) -> Generator[Tuple[int, List[int], np.ndarray], None, None]:
         session_id = request.session_id
         start_frame_idx = request.start_frame_index
         propagation_direction = "both"
         max_frame_num_to_track = None
 
-        """
-        Propagate existing input points in all frames to track the object across video.
-        """
-
         # Note that as this method is a generator, we also need to use autocast_context
         # in caller to this method to ensure that it's called under the correct context
         # (we've added `autocast_context` to `gen_track_with_mask_stream` in app.py).
-        with self.autocast_context(), self.inference_lock:
+        with self.__inference_context("propagate_in_video", session_id=session_id):
             logger.info(
                 f"propagate in video in session {session_id}: "
                 f"{propagation_direction=}, {start_frame_idx=}, {max_frame_num_to_track=}"
             )
 
+            num_frames_propagated = 0
             try:
                 session = self.__get_session(session_id)
                 session["canceled"] = False
+                propagate_start = time.perf_counter()
 
                 inference_state = session["state"]
                 if propagation_direction not in ["both", "forward", "backward"]:
@@ -298,6 +364,7 @@ class InferenceAPI:
                         f"invalid propagation direction: {propagation_direction}"
                     )
 
+                frame_start = propagate_start
                 # First doing the forward propagation
                 if propagation_direction in ["both", "forward"]:
                     for outputs in self.predictor.propagate_in_video(
@@ -313,15 +380,10 @@ class InferenceAPI:
                         masks_binary = (
                             (video_res_masks > self.score_thresh)[:, 0].cpu().numpy()
                         )
-
-                        rle_mask_list = self.__get_rle_mask_list(
-                            object_ids=obj_ids, masks=masks_binary
-                        )
-
-                        yield PropagateDataResponse(
-                            frame_index=frame_idx,
-                            results=rle_mask_list,
-                        )
+                        num_frames_propagated += 1
+                        self.__record_propagated_frame(frame_start)
+                        yield frame_idx, obj_ids, masks_binary
+                        frame_start = time.perf_counter()
 
                 # Then doing the backward propagation (reverse in time)
                 if propagation_direction in ["both", "backward"]:
@@ -338,16 +400,15 @@ class InferenceAPI:
                         masks_binary = (
                             (video_res_masks > self.score_thresh)[:, 0].cpu().numpy()
                         )
-
-                        rle_mask_list = self.__get_rle_mask_list(
-                            object_ids=obj_ids, masks=masks_binary
-                        )
-
-                        yield PropagateDataResponse(
-                            frame_index=frame_idx,
-                            results=rle_mask_list,
-                        )
+                        num_frames_propagated += 1
+                        self.__record_propagated_frame(frame_start)
+                        yield frame_idx, obj_ids, masks_binary
+                        frame_start = time.perf_counter()
             finally:
+                if num_frames_propagated > 0:
+                    propagate_time = time.perf_counter() - propagate_start
+                    PROPAGATE_FPS.observe(num_frames_propagated / propagate_time)
+                self.__record_feature_cache_stats(session_id)
                 # Log upon completion (so that e.g. we can see if two propagations happen in parallel).
                 # Using `finally` here to log even when the tracking is aborted with GeneratorExit.
                 logger.info(
@@ -367,10 +428,15 @@ class InferenceAPI:
         """
         Return a list of data values, i.e. list of object/mask combos.
         """
-        return [
+        encode_start = time.perf_counter()
+        rle_mask_list = [
             self.__get_mask_for_object(object_id=object_id, mask=mask)
             for object_id, mask in zip(object_ids, masks)
         ]
+        MASK_ENCODE_LATENCY.observe(
+            time.perf_counter() - encode_start, mask_type=MASK_TYPE_RLE
+        )
+        return rle_mask_list
 
     def __get_mask_for_object(
         self, object_id: int, mask: np.ndarray
@@ -388,6 +454,72 @@ class InferenceAPI:
             ),
         )
 
+    def update_metrics(self) -> None:
+        """
+        Refresh the gauges that are sampled at scrape time (live sessions, memory
+        held by each session and device memory).
+        """
+        sessions = list(self.session_states.items())
+        LIVE_SESSIONS.set(len(sessions))
+        SESSION_MEMORY.clear()
+        for session_id, session in sessions:
+            self.__record_feature_cache_stats(session_id)
+            for device_type, num_bytes in self.__get_session_memory(
+                session["state"]
+            ).items():
+                SESSION_MEMORY.set(num_bytes, session_id=session_id, device=device_type)
+        if torch.cuda.is_available():
+            DEVICE_MEMORY.set(torch.cuda.memory_allocated(), kind="allocated")
+            DEVICE_MEMORY.set(torch.cuda.memory_reserved(), kind="reserved")
+
+    def __get_session_memory(self, inference_state: Dict[str, Any]) -> Dict[str, int]:
+        """
+        Sum the bytes of all tensor storages held by an inference state per device
+        type, counting storages shared between tensors (e.g. expanded views) once.
+        """
+        seen_storages = set()
+        memory_per_device: Dict[str, int] = {}
+        stack = [inference_state]
+        while len(stack) > 0:
+            value = stack.pop()
+            if isinstance(value, torch.Tensor):
+                storage = value.untyped_storage()
+                key = (value.device.type, storage.data_ptr())
+                if key in seen_storages:
+                    continue
+                seen_storages.add(key)
+                memory_per_device[value.device.type] = (
+                    memory_per_device.get(value.device.type, 0) + storage.nbytes()
+                )
+            elif isinstance(value, dict):
+                # copy to avoid failing if inference mutates the state concurrently
+                stack.extend(list(value.values()))
+            elif isinstance(value, (list, tuple)):
+                stack.extend(value)
+        return memory_per_device
+
+    def __record_propagated_frame(self, frame_start: float) -> None:
+        PROPAGATE_FRAMES.inc()
+        PROPAGATE_FRAME_LATENCY.observe(time.perf_counter() - frame_start)
+
+    def __record_feature_cache_stats(self, session_id: str) -> None:
+        """
+        Add the feature cache lookups of a session since the last call to the
+        feature cache counters.
+        """
+        session = self.session_states.get(session_id, None)
+        if session is None:
+            return
+        stats = session["state"].get("feature_cache_stats")
+        if stats is None:
+            return
+        recorded = session.setdefault("recorded_feature_cache_stats", {})
+        for result in ("hit", "miss"):
+            delta = stats[result] - recorded.get(result, 0)
+            if delta > 0:
+                FEATURE_CACHE_REQUESTS.inc(delta, result=result)
+            recorded[result] = stats[result]
+
     def __get_session(self, session_id: str):
         session = self.session_states.get(session_id, None)
         if session is None:
@@ -4,8 +4,15 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
-from hydra import initialize_config_module
-from hydra.core.global_hydra import GlobalHydra
 
-if not GlobalHydra.instance().is_initialized():
-    initialize_config_module("sam2", version_base="1.2")
+def initialize_hydra():
+    """
+    Initialize Hydra with the configs of the sam2 package (if not done yet), to
+    compose them with `hydra.compose`. This is done when importing `sam2.build_sam`
+    rather than sam2 itself, so that the modeling code can be imported without Hydra.
+    """
+    from hydra import initialize_config_module
+    from hydra.core.global_hydra import GlobalHydra
+
+    if not GlobalHydra.instance().is_initialized():
+        initialize_config_module("sam2", version_base="1.2")
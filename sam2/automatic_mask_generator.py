@@ -5,6 +5,7 @@
 # LICENSE file in the root directory of this source tree.
 
 # Adapted from https://github.com/facebookresearch/segment-anything/blob/main/segment_anything/automatic_mask_generator.py
+import math
 from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
@@ -16,16 +17,21 @@ from sam2.sam2_image_predictor import SAM2ImagePredictor
 from sam2.utils.amg import (
     area_from_rle,
     batch_iterator,
+    batched_cropped_mask_to_box,
     batched_mask_to_box,
+    box_from_rle,
     box_xyxy_to_xywh,
     build_all_layer_point_grids,
     calculate_stability_score,
     coco_encode_rle,
+    cropped_mask_to_rle_pytorch,
     generate_crop_boxes,
+    get_small_regions_crop,
     is_box_near_crop_edge,
     mask_to_rle_pytorch,
     MaskData,
-    remove_small_regions,
+    remove_small_regions_batched,
+    rle_to_cropped_mask,
     rle_to_mask,
     uncrop_boxes_xyxy,
     uncrop_masks,
@@ -53,6 +59,9 @@ class SAM2AutomaticMaskGenerator:
         output_mode: str = "binary_mask",
         use_m2m: bool = False,
         multimask_output: bool = True,
+        roi_mask_upsampling: bool = False,
+        low_res_filtering: bool = False,
+        low_res_stability_margin: float = 0.05,
         **kwargs,
     ) -> None:
         """
@@ -101,6 +110,21 @@ class SAM2AutomaticMaskGenerator:
             memory.
           use_m2m (bool): Whether to add a one step refinement using previous mask predictions.
           multimask_output (bool): Whether to output multimask at each point of the grid.
+          roi_mask_upsampling (bool): If true, masks are only upsampled to the crop
+            resolution inside a box around their low resolution logits, instead
+            of over the whole crop. This gives the same masks while using much
+            less memory for high resolution images.
+          low_res_filtering (bool): If true, masks are filtered by predicted IoU,
+            by (a lower bound of) their stability score and by their approximate
+            box at the edge of crops on the low resolution logits, and only the
+            remaining masks are upsampled to the crop resolution. The exact
+            stability score and box filters are then applied to the upsampled
+            masks, so the output is the same as without this option, as long as
+            the stability score of the low resolution logits is within
+            low_res_stability_margin of the one of the upsampled masks.
+          low_res_stability_margin (float): The margin below stability_score_thresh
+            under which masks are discarded based on the stability score of their
+            low resolution logits, when low_res_filtering is true.
         """
 
         assert (points_per_side is None) != (
@@ -148,6 +172,9 @@ class SAM2AutomaticMaskGenerator:
         self.output_mode = output_mode
         self.use_m2m = use_m2m
         self.multimask_output = multimask_output
+        self.roi_mask_upsampling = roi_mask_upsampling
+        self.low_res_filtering = low_res_filtering
+        self.low_res_stability_margin = low_res_stability_margin
 
     @classmethod
     def from_pretrained(cls, model_id: str, **kwargs) -> "SAM2AutomaticMaskGenerator":
@@ -316,15 +343,17 @@ class SAM2AutomaticMaskGenerator:
             in_labels[:, None],
             multimask_output=self.multimask_output,
             return_logits=True,
+            mask_roi_threshold=self._get_mask_roi_threshold(),
+            upsample_masks=not self.low_res_filtering,
         )
 
         # Serialize predictions and store in MaskData
         data = MaskData(
-            masks=masks.flatten(0, 1),
             iou_preds=iou_preds.flatten(0, 1),
-            points=points.repeat_interleave(masks.shape[1], dim=0),
+            points=points.repeat_interleave(iou_preds.shape[1], dim=0),
             low_res_masks=low_res_masks.flatten(0, 1),
         )
+        self._store_masks(data, masks)
         del masks
 
         if not self.use_m2m:
@@ -333,10 +362,11 @@ class SAM2AutomaticMaskGenerator:
                 keep_mask = data["iou_preds"] > self.pred_iou_thresh
                 data.filter(keep_mask)
 
+            if self.low_res_filtering:
+                self._filter_and_upsample_low_res(data, im_size, crop_box, orig_size)
+
             # Calculate and filter by stability score
-            data["stability_score"] = calculate_stability_score(
-                data["masks"], self.mask_threshold, self.stability_score_offset
-            )
+            data["stability_score"] = self._calculate_stability_score(data["masks"])
             if self.stability_score_thresh > 0.0:
                 keep_mask = data["stability_score"] >= self.stability_score_thresh
                 data.filter(keep_mask)
@@ -351,23 +381,30 @@ class SAM2AutomaticMaskGenerator:
             masks, ious = self.refine_with_m2m(
                 in_points, labels, data["low_res_masks"], self.points_per_batch
             )
-            data["masks"] = masks.squeeze(1)
+            self._store_masks(data, masks)
             data["iou_preds"] = ious.squeeze(1)
 
             if self.pred_iou_thresh > 0.0:
                 keep_mask = data["iou_preds"] > self.pred_iou_thresh
                 data.filter(keep_mask)
 
-            data["stability_score"] = calculate_stability_score(
-                data["masks"], self.mask_threshold, self.stability_score_offset
-            )
+            if self.low_res_filtering:
+                self._filter_and_upsample_low_res(data, im_size, crop_box, orig_size)
+
+            data["stability_score"] = self._calculate_stability_score(data["masks"])
             if self.stability_score_thresh > 0.0:
                 keep_mask = data["stability_score"] >= self.stability_score_thresh
                 data.filter(keep_mask)
 
         # Threshold masks and calculate boxes
-        data["masks"] = data["masks"] > self.mask_threshold
-        data["boxes"] = batched_mask_to_box(data["masks"])
+        if self.roi_mask_upsampling:
+            data["masks"] = [mask > self.mask_threshold for mask in data["masks"]]
+            data["boxes"] = batched_cropped_mask_to_box(
+                data["masks"], data["mask_boxes"]
+            )
+        else:
+            data["masks"] = data["masks"] > self.mask_threshold
+            data["boxes"] = batched_mask_to_box(data["masks"])
 
         # Filter boxes that touch crop boundaries
         keep_mask = ~is_box_near_crop_edge(
@@ -377,15 +414,110 @@ class SAM2AutomaticMaskGenerator:
             data.filter(keep_mask)
 
         # Compress to RLE
-        data["masks"] = uncrop_masks(data["masks"], crop_box, orig_h, orig_w)
-        data["rles"] = mask_to_rle_pytorch(data["masks"])
+        if self.roi_mask_upsampling:
+            mask_boxes = uncrop_boxes_xyxy(data["mask_boxes"], crop_box)
+            data["rles"] = cropped_mask_to_rle_pytorch(
+                data["masks"], mask_boxes, orig_h, orig_w
+            )
+            del data["mask_boxes"]
+        else:
+            data["masks"] = uncrop_masks(data["masks"], crop_box, orig_h, orig_w)
+            data["rles"] = mask_to_rle_pytorch(data["masks"])
         del data["masks"]
 
         return data
 
+    def _store_masks(self, data: MaskData, masks) -> None:
+        # Store the masks predicted for a batch of prompts (with C masks each)
+        if self.low_res_filtering:
+            data["low_res_logits"] = masks.flatten(0, 1)
+        elif self.roi_mask_upsampling:
+            data["masks"], data["mask_boxes"] = masks
+        else:
+            data["masks"] = masks.flatten(0, 1)
+
+    def _filter_and_upsample_low_res(
+        self,
+        data: MaskData,
+        im_size: Tuple[int, ...],
+        crop_box: List[int],
+        orig_size: Tuple[int, ...],
+    ) -> None:
+        orig_h, orig_w = orig_size
+        low_res_h, low_res_w = data["low_res_logits"].shape[-2:]
+        scale_x, scale_y = im_size[1] / low_res_w, im_size[0] / low_res_h
+
+        # Filter by the stability score of the low res logits, with a margin
+        if self.stability_score_thresh > 0.0:
+            stability_score = calculate_stability_score(
+                data["low_res_logits"], self.mask_threshold, self.stability_score_offset
+            )
+            keep_mask = stability_score >= (
+                self.stability_score_thresh - self.low_res_stability_margin
+            )
+            data.filter(keep_mask)
+
+        # Filter approximate boxes that certainly touch crop boundaries. Bilinear
+        # upsampling moves the mask boundary by less than one low res pixel.
+        low_res_binary = data["low_res_logits"] > self.mask_threshold
+        is_empty = ~low_res_binary.flatten(1).any(dim=1)
+        boxes = batched_mask_to_box(low_res_binary).float()
+        boxes[:, 2:] += 1
+        scale = torch.tensor([scale_x, scale_y, scale_x, scale_y], device=boxes.device)
+        boxes = (boxes * scale).round().int() * (~is_empty).unsqueeze(-1)
+        keep_mask = ~is_box_near_crop_edge(
+            boxes,
+            crop_box,
+            [0, 0, orig_w, orig_h],
+            box_error=math.ceil(max(scale_x, scale_y)) + 1,
+        )
+        if not torch.all(keep_mask):
+            data.filter(keep_mask)
+
+        # Upsample the remaining masks
+        low_res_logits = data["low_res_logits"][:, None]
+        if self.roi_mask_upsampling:
+            data["masks"], data["mask_boxes"] = (
+                self.predictor._transforms.upsample_masks_cropped(
+                    low_res_logits, im_size, roi_threshold=self._get_mask_roi_threshold()
+                )
+            )
+        else:
+            data["masks"] = self.predictor._transforms.upsample_masks(
+                low_res_logits, im_size
+            ).flatten(0, 1)
+        del data["low_res_logits"]
+
+    def _get_mask_roi_threshold(self) -> Optional[float]:
+        if not self.roi_mask_upsampling:
+            return None
+        # The box must contain all the pixels used by the stability score
+        return self.mask_threshold - abs(self.stability_score_offset)
+
+    def _calculate_stability_score(self, masks) -> torch.Tensor:
+        if not isinstance(masks, list):
+            return calculate_stability_score(
+                masks, self.mask_threshold, self.stability_score_offset
+            )
+        if len(masks) == 0:
+            return torch.zeros(0, device=self.predictor.device)
+        return torch.stack(
+            [
+                calculate_stability_score(
+                    mask, self.mask_threshold, self.stability_score_offset
+                )
+                for mask in masks
+            ],
+            dim=0,
+        )
+
     @staticmethod
     def postprocess_small_regions(
-        mask_data: MaskData, min_area: int, nms_thresh: float
+        mask_data: MaskData,
+        min_area: int,
+        nms_thresh: float,
+        device: Optional[torch.device] = None,
+        num_workers: Optional[int] = None,
     ) -> MaskData:
         """
         Removes small disconnected regions and holes in masks, then reruns
@@ -393,30 +525,41 @@ class SAM2AutomaticMaskGenerator:
 
         Edits mask_data in place.
 
+        The masks are processed together on crops around their boxes, on `device`
+        if it is a CUDA device and the `sam2._C` extension is available, or else
+        with opencv in a thread pool of `num_workers` threads.
+
         Requires open-cv as a dependency.
         """
         if len(mask_data["rles"]) == 0:
             return mask_data
 
-        # Filter small disconnected regions and holes
-        new_masks = []
-        scores = []
+        # Decode the masks on crops around their boxes
+        h, w = mask_data["rles"][0]["size"]
+        crop_boxes, masks, outsides = [], [], []
         for rle in mask_data["rles"]:
-            mask = rle_to_mask(rle)
+            if area_from_rle(rle) == 0:
+                crop_box, outside = [0, 0, 0, 0], None
+            else:
+                crop_box, outside = get_small_regions_crop(
+                    box_from_rle(rle), h, w, min_area
+                )
+            crop_boxes.append(crop_box)
+            masks.append(rle_to_cropped_mask(rle, crop_box))
+            outsides.append(outside)
 
-            mask, changed = remove_small_regions(mask, min_area, mode="holes")
-            unchanged = not changed
-            mask, changed = remove_small_regions(mask, min_area, mode="islands")
-            unchanged = unchanged and not changed
-
-            new_masks.append(torch.as_tensor(mask).unsqueeze(0))
-            # Give score=0 to changed masks and score=1 to unchanged masks
-            # so NMS will prefer ones that didn't need postprocessing
-            scores.append(float(unchanged))
+        # Filter small disconnected regions and holes
+        masks, changed = remove_small_regions_batched(
+            masks, min_area, outsides, device=device, num_workers=num_workers
+        )
+        # Give score=0 to changed masks and score=1 to unchanged masks
+        # so NMS will prefer ones that didn't need postprocessing
+        scores = [float(not c) for c in changed]
 
         # Recalculate boxes and remove any new duplicates
-        masks = torch.cat(new_masks, dim=0)
-        boxes = batched_mask_to_box(masks)
+        masks = [torch.as_tensor(mask) for mask in masks]
+        crop_boxes = torch.as_tensor(crop_boxes, dtype=torch.int64)
+        boxes = batched_cropped_mask_to_box(masks, crop_boxes)
         keep_by_nms = batched_nms(
             boxes.float(),
             torch.as_tensor(scores),
@@ -427,8 +570,9 @@ class SAM2AutomaticMaskGenerator:
         # Only recalculate RLEs for masks that have changed
         for i_mask in keep_by_nms:
             if scores[i_mask] == 0.0:
-                mask_torch = masks[i_mask].unsqueeze(0)
-                mask_data["rles"][i_mask] = mask_to_rle_pytorch(mask_torch)[0]
+                mask_data["rles"][i_mask] = cropped_mask_to_rle_pytorch(
+                    [masks[i_mask]], crop_boxes[i_mask][None], h, w
+                )[0]
                 mask_data["boxes"][i_mask] = boxes[i_mask]  # update res directly
         mask_data.filter(keep_by_nms)
 
@@ -436,6 +580,7 @@ class SAM2AutomaticMaskGenerator:
 
     def refine_with_m2m(self, points, point_labels, low_res_masks, points_per_batch):
         new_masks = []
+        new_mask_boxes = []
         new_iou_preds = []
 
         for cur_points, cur_point_labels, low_res_mask in batch_iterator(
@@ -447,8 +592,17 @@ class SAM2AutomaticMaskGenerator:
                 mask_input=low_res_mask[:, None, :],
                 multimask_output=False,
                 return_logits=True,
+                mask_roi_threshold=self._get_mask_roi_threshold(),
+                upsample_masks=not self.low_res_filtering,
             )
-            new_masks.append(best_masks)
+            if self.roi_mask_upsampling and not self.low_res_filtering:
+                new_masks.extend(best_masks[0])
+                new_mask_boxes.append(best_masks[1])
+            else:
+                new_masks.append(best_masks)
             new_iou_preds.append(best_iou_preds)
-        masks = torch.cat(new_masks, dim=0)
+        if self.roi_mask_upsampling and not self.low_res_filtering:
+            masks = (new_masks, torch.cat(new_mask_boxes, dim=0))
+        else:
+            masks = torch.cat(new_masks, dim=0)
         return masks, torch.cat(new_iou_preds, dim=0)
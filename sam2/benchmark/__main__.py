@@ -0,0 +1,562 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Benchmark video tracking with SAM 2 on CPU or GPU, over a sweep of model sizes,
+input resolutions, numbers of objects and video lengths. For each configuration,
+it reports the throughput, the latency per frame of each tracking stage and the
+peak memory, and writes them to a JSON file that can be compared to a baseline:
+
+    python -m sam2.benchmark --models tiny base-plus --num_objects 1 4 \
+        --output results.json
+    python -m sam2.benchmark --models tiny base-plus --num_objects 1 4 \
+        --baseline results.json
+"""
+
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import torch
+from PIL import Image
+
+from sam2.benchmark.stages import StageTimer, STAGES, synchronize
+from sam2.benchmark.videos import write_synthetic_video
+from sam2.build_sam import (
+    build_sam2_video_predictor,
+    HF_MODEL_ID_TO_FILENAMES,
+    RESOLUTION_PROFILES,
+)
+from sam2.utils.cpu_inference import get_cpu_autocast_dtype, optimize_for_cpu
+from sam2.utils.misc import get_jpg_frame_paths
+from sam2.utils.profiling import TrackingProfiler
+
+MODEL_SIZES = ["tiny", "small", "base-plus", "large"]
+# the keys identifying a configuration in the results
+CONFIG_KEYS = ["model", "resolution", "num_objects", "num_frames"]
+
+
+def get_device(device=None):
+    if device is not None:
+        return torch.device(device)
+    if torch.cuda.is_available():
+        return torch.device("cuda")
+    elif torch.backends.mps.is_available():
+        return torch.device("mps")
+    return torch.device("cpu")
+
+
+def get_environment(device, args):
+    env = {
+        "device": device.type,
+        "torch": torch.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "dtype": str(get_dtype(device, args.dtype)),
+        "vos_optimized": args.vos_optimized,
+        "cpu_optimized": args.cpu_optimized,
+        "cpu_compile": args.cpu_compile,
+        "roi_tracking": args.roi_tracking,
+        "num_threads": torch.get_num_threads(),
+    }
+    if device.type == "cuda":
+        env["device_name"] = torch.cuda.get_device_name(device)
+    else:
+        env["device_name"] = platform.processor() or platform.machine()
+    return env
+
+
+def get_dtype(device, dtype):
+    """The dtype to track in, "auto" being bfloat16 except on CPUs without it."""
+    if dtype == "auto":
+        return get_cpu_autocast_dtype() if device.type == "cpu" else torch.bfloat16
+    return getattr(torch, dtype)
+
+
+def get_autocast(device, dtype):
+    if dtype == torch.float32:
+        return contextlib.nullcontext()
+    return torch.autocast(device.type, dtype=dtype)
+
+
+def reset_peak_memory(device):
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+
+
+def get_peak_memory_mb(device):
+    """
+    Peak memory in MB: the peak allocated CUDA memory since the last reset on GPU,
+    the memory allocated by the Metal driver on MPS, and the peak resident memory
+    of the process on CPU (which cannot be reset, so it only grows over a sweep).
+    """
+    if device.type == "cuda":
+        return torch.cuda.max_memory_allocated(device) / 1024**2
+    if device.type == "mps":
+        return torch.mps.driver_allocated_memory() / 1024**2
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kB on Linux
+    return max_rss / 1024**2 if sys.platform == "darwin" else max_rss / 1024
+
+
+def build_predictor(model_size, resolution, args, device, dtype, reference=False):
+    """
+    Build the predictor to benchmark with the optimizations in `args`, or the
+    `reference` predictor (without optimizations, in float32) to compare its masks
+    with.
+    """
+    config, checkpoint = HF_MODEL_ID_TO_FILENAMES[f"facebook/sam2.1-hiera-{model_size}"]
+    checkpoint = os.path.join(args.checkpoint_dir, checkpoint)
+    if not os.path.exists(checkpoint):
+        # the timings do not depend on the weights (only the masks do)
+        warnings.warn(f"{checkpoint} not found, using randomly initialized weights")
+        checkpoint = None
+    torch.manual_seed(0)  # same random weights for the reference predictor
+    predictor = build_sam2_video_predictor(
+        config,
+        checkpoint,
+        device=device,
+        vos_optimized=args.vos_optimized and not reference,
+        resolution=None if resolution == "default" else resolution,
+    )
+    if not reference and args.cpu_optimized:
+        # (whatever the dtype, e.g. float32 on CPUs without fast bfloat16)
+        optimize_for_cpu(
+            predictor,
+            dtype,
+            compile=args.cpu_compile,
+            num_threads=args.num_threads,
+            numa_node=args.numa_node,
+        )
+    elif reference or dtype == torch.float32:
+        predictor.maskmem_dtype = torch.float32
+    return predictor, checkpoint is None
+
+
+def init_tracking(predictor, video_dir, points, roi_tracking=False):
+    inference_state = predictor.init_state(
+        video_path=video_dir, roi_tracking=roi_tracking
+    )
+    for obj_id, point in enumerate(points, start=1):
+        predictor.add_new_points_or_box(
+            inference_state=inference_state,
+            frame_idx=0,
+            obj_id=obj_id,
+            points=np.array([point], dtype=np.float32),
+            labels=np.array([1], np.int32),
+        )
+    return inference_state
+
+
+def track_masks(predictor, inference_state, num_frames):
+    """Track the objects over `num_frames` frames, returning their binary masks."""
+    masks = {}
+    for frame_idx, _, mask_logits in predictor.propagate_in_video(
+        inference_state, max_frame_num_to_track=num_frames - 1
+    ):
+        masks[frame_idx] = (mask_logits[:, 0] > 0.0).cpu().numpy()
+    return masks
+
+
+def get_mean_iou(masks, ref_masks):
+    """The mean IoU (J) of the masks of each object on each frame with reference."""
+    ious = []
+    for frame_idx, ref_frame_masks in ref_masks.items():
+        for mask, ref_mask in zip(masks[frame_idx], ref_frame_masks):
+            union = np.logical_or(mask, ref_mask).sum()
+            intersection = np.logical_and(mask, ref_mask).sum()
+            ious.append(intersection / union if union > 0 else 1.0)
+    return float(np.mean(ious))
+
+
+def benchmark_tracking(
+    predictor,
+    video_dir,
+    points,
+    num_frames,
+    warmup,
+    runs,
+    trace_path=None,
+    return_masks=False,
+    roi_tracking=False,
+):
+    """
+    Track objects from clicks on the first frame of a video for `num_frames` frames
+    (after `warmup` untimed runs), and return the results of the timed `runs`. With
+    `trace_path` or `return_masks`, an additional run is made to write a Chrome
+    trace of its steps to `trace_path` or to return its masks (otherwise None).
+    With `roi_tracking`, the objects are tracked in crops around them (see
+    `SAM2VideoPredictor.init_state`).
+    """
+    device = predictor.device
+    inference_state = init_tracking(predictor, video_dir, points, roi_tracking)
+
+    def propagate():
+        for _ in predictor.propagate_in_video(
+            inference_state, max_frame_num_to_track=num_frames - 1
+        ):
+            pass
+
+    for _ in range(warmup):
+        propagate()
+
+    # end-to-end throughput without the stage synchronizations
+    reset_peak_memory(device)
+    synchronize(device)
+    start = time.perf_counter()
+    for _ in range(runs):
+        propagate()
+    synchronize(device)
+    total_time = time.perf_counter() - start
+    peak_memory_mb = get_peak_memory_mb(device)
+
+    # per-stage latency
+    with StageTimer(predictor) as timer:
+        for _ in range(runs):
+            propagate()
+    num_tracked_frames = runs * num_frames
+    masks = None
+    if trace_path is not None or return_masks:
+        profiler = TrackingProfiler() if trace_path is not None else None
+        with profiler or contextlib.nullcontext():
+            masks = track_masks(predictor, inference_state, num_frames)
+        if profiler is not None:
+            profiler.export_chrome_trace(trace_path)
+    latency_ms = {
+        stage: timer.times[stage] * 1000 / num_tracked_frames for stage in STAGES
+    }
+    latency_ms["total"] = total_time * 1000 / num_tracked_frames
+    latency_ms["other"] = max(
+        latency_ms["total"] - sum(latency_ms[stage] for stage in STAGES), 0.0
+    )
+    fps = num_tracked_frames / total_time
+    result = {
+        "fps": fps,
+        "object_fps": fps * len(points),
+        "latency_ms": latency_ms,
+        "peak_memory_mb": peak_memory_mb,
+    }
+    return result, masks
+
+
+def get_videos(args, tmp_dir):
+    """
+    Get the JPEG folder of the video to track for each video length, and the (x, y)
+    clicks on the objects to track on its first frame (at most `max(num_objects)`).
+    """
+    max_num_objects = max(args.num_objects)
+    videos = {}
+    for num_frames in args.num_frames:
+        if args.video_dir is None:
+            video_dir = os.path.join(tmp_dir, f"synthetic_{num_frames}")
+            points = write_synthetic_video(video_dir, num_frames, max_num_objects)
+        else:
+            video_dir = args.video_dir
+            available_frames = len(get_jpg_frame_paths(video_dir))
+            if num_frames > available_frames:
+                warnings.warn(
+                    f"skipping {num_frames} frames, {video_dir} only has "
+                    f"{available_frames} frames"
+                )
+                continue
+            if args.points is not None:
+                points = np.array(args.points, dtype=np.float32).reshape(-1, 2)
+            else:
+                # clicks evenly spaced on the middle row of the first frame
+                width, height = Image.open(get_jpg_frame_paths(video_dir)[0]).size
+                xs = np.linspace(0, width, max_num_objects + 2)[1:-1]
+                points = np.stack([xs, np.full_like(xs, height / 2)], axis=1)
+        videos[num_frames] = (video_dir, points)
+    return videos
+
+
+def get_config_key(result):
+    return tuple(result[k] for k in CONFIG_KEYS)
+
+
+def format_change(value, ref_value):
+    if value is None or ref_value is None or ref_value == 0:
+        return "-"
+    return f"{(value - ref_value) / ref_value * 100:+.1f}%"
+
+
+def print_results(results, baseline_results=None):
+    """Print the results as a markdown table, with the changes from a baseline."""
+    baseline = {get_config_key(r): r for r in baseline_results or []}
+    stages = list(STAGES) + ["other"]
+    header = CONFIG_KEYS + ["FPS"] + [f"{s} (ms)" for s in stages] + ["peak MB"]
+    with_iou = any("j_vs_reference" in r for r in results)
+    if with_iou:
+        header += ["J vs reference"]
+    if baseline_results is not None:
+        header += ["FPS vs baseline", "total ms vs baseline"]
+    print("| " + " | ".join(header) + " |")
+    print("|" + "---|" * len(header))
+    for result in results:
+        latency_ms = result["latency_ms"]
+        peak_memory_mb = result["peak_memory_mb"]
+        row = [str(result[k]) for k in CONFIG_KEYS] + [f"{result['fps']:.2f}"]
+        row += [f"{latency_ms[s]:.1f}" for s in stages]
+        row += ["-" if peak_memory_mb is None else f"{peak_memory_mb:.0f}"]
+        if with_iou:
+            row += [f"{result['j_vs_reference']:.4f}"]
+        if baseline_results is not None:
+            ref = baseline.get(get_config_key(result))
+            if ref is None:
+                row += ["-", "-"]
+            else:
+                row += [
+                    format_change(result["fps"], ref["fps"]),
+                    format_change(latency_ms["total"], ref["latency_ms"]["total"]),
+                ]
+        print("| " + " | ".join(row) + " |")
+
+
+def get_regressions(results, baseline_results, max_regression):
+    """Get the configurations whose FPS dropped by more than `max_regression`."""
+    baseline = {get_config_key(r): r for r in baseline_results}
+    regressions = []
+    for result in results:
+        ref = baseline.get(get_config_key(result))
+        if ref is not None and result["fps"] < ref["fps"] * (1 - max_regression):
+            regressions.append(get_config_key(result))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark SAM 2 video tracking over a sweep of model sizes, "
+        "input resolutions, numbers of objects and video lengths."
+    )
+    parser.add_argument(
+        "--models",
+        type=str,
+        nargs="+",
+        default=["base-plus"],
+        choices=MODEL_SIZES,
+        help="SAM 2.1 model sizes to benchmark",
+    )
+    parser.add_argument(
+        "--checkpoint_dir",
+        type=str,
+        default="./checkpoints",
+        help="directory of the SAM 2.1 checkpoints (randomly initialized weights "
+        "are used for the missing ones, which gives the same timings)",
+    )
+    parser.add_argument(
+        "--resolutions",
+        type=str,
+        nargs="+",
+        default=["default"],
+        choices=["default"] + list(RESOLUTION_PROFILES),
+        help="input resolutions to benchmark (default: that of the model config)",
+    )
+    parser.add_argument(
+        "--num_objects",
+        type=int,
+        nargs="+",
+        default=[1],
+        help="numbers of objects to track",
+    )
+    parser.add_argument(
+        "--num_frames",
+        type=int,
+        nargs="+",
+        default=[50],
+        help="numbers of frames to track",
+    )
+    parser.add_argument(
+        "--video_dir",
+        type=str,
+        default=None,
+        help="directory of JPEG frames of a video to track objects in (default: "
+        "synthetic videos of moving ellipses)",
+    )
+    parser.add_argument(
+        "--points",
+        type=float,
+        nargs="+",
+        default=None,
+        help="x y coordinates of a click on each object on the first frame of "
+        "--video_dir (default: clicks evenly spaced on the middle row)",
+    )
+    parser.add_argument(
+        "--device", type=str, default=None, help="device (default: cuda, mps or cpu)"
+    )
+    parser.add_argument(
+        "--dtype",
+        type=str,
+        default="auto",
+        choices=["auto", "bfloat16", "float16", "float32"],
+        help="autocast dtype (auto: bfloat16, or float32 on CPUs without native "
+        "bfloat16 support)",
+    )
+    parser.add_argument(
+        "--vos_optimized",
+        action="store_true",
+        help="whether to use the compiled SAM2VideoPredictorVOS",
+    )
+    parser.add_argument(
+        "--roi_tracking",
+        action="store_true",
+        help="whether to track the objects in crops around them (ROI tracking, see "
+        "SAM2VideoPredictor.init_state); check its accuracy with --check_accuracy",
+    )
+    parser.add_argument(
+        "--cpu_optimized",
+        action="store_true",
+        help="whether to apply the CPU inference profile (see "
+        "sam2/utils/cpu_inference.py)",
+    )
+    parser.add_argument(
+        "--cpu_compile",
+        action="store_true",
+        help="whether to also compile the model for CPU in the CPU inference profile",
+    )
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        default=None,
+        help="number of threads in the CPU inference profile (default: one per "
+        "physical core)",
+    )
+    parser.add_argument(
+        "--numa_node",
+        type=int,
+        default=None,
+        help="NUMA node to pin the process to in the CPU inference profile",
+    )
+    parser.add_argument(
+        "--check_accuracy",
+        action="store_true",
+        help="also track with the predictor in float32 without optimizations, and "
+        "report the mean IoU (J) of the masks with its masks",
+    )
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs")
+    parser.add_argument("--runs", type=int, default=3, help="timed runs")
+    parser.add_argument(
+        "--output", type=str, default=None, help="JSON file to write the results to"
+    )
+    parser.add_argument(
+        "--trace_dir",
+        type=str,
+        default=None,
+        help="directory to write a Chrome trace of the tracking steps of each "
+        "configuration to (see sam2/utils/profiling.py)",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=None,
+        help="JSON file of results of a previous run to compare with",
+    )
+    parser.add_argument(
+        "--max_regression",
+        type=float,
+        default=None,
+        help="exit with an error if the FPS of a configuration is lower than in "
+        "--baseline by more than this fraction (e.g. 0.05)",
+    )
+    args = parser.parse_args()
+
+    device = get_device(args.device)
+    if device.type == "cuda" and torch.cuda.get_device_properties(0).major >= 8:
+        # turn on tfloat32 for Ampere GPUs (https://pytorch.org/docs/stable/notes/cuda.html#tensorfloat-32-tf32-on-ampere-devices)
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+    dtype = get_dtype(device, args.dtype)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        videos = get_videos(args, tmp_dir)
+        for model_size, resolution in itertools.product(args.models, args.resolutions):
+            predictor, random_weights = build_predictor(
+                model_size, resolution, args, device, dtype
+            )
+            ref_predictor = None
+            if args.check_accuracy:
+                ref_predictor, _ = build_predictor(
+                    model_size, resolution, args, device, dtype, reference=True
+                )
+            for num_objects, num_frames in itertools.product(
+                args.num_objects, sorted(videos)
+            ):
+                video_dir, points = videos[num_frames]
+                result = {
+                    "model": model_size,
+                    "resolution": resolution,
+                    "num_objects": num_objects,
+                    "num_frames": num_frames,
+                    "random_weights": random_weights,
+                }
+                trace_path = None
+                if args.trace_dir is not None:
+                    os.makedirs(args.trace_dir, exist_ok=True)
+                    trace_path = os.path.join(
+                        args.trace_dir,
+                        "_".join(str(result[k]) for k in CONFIG_KEYS) + ".json",
+                    )
+                with get_autocast(device, dtype):
+                    timings, masks = benchmark_tracking(
+                        predictor,
+                        video_dir,
+                        points[:num_objects],
+                        num_frames,
+                        args.warmup,
+                        args.runs,
+                        trace_path,
+                        return_masks=ref_predictor is not None,
+                        roi_tracking=args.roi_tracking,
+                    )
+                result.update(timings)
+                if ref_predictor is not None:
+                    inference_state = init_tracking(
+                        ref_predictor, video_dir, points[:num_objects]
+                    )
+                    ref_masks = track_masks(ref_predictor, inference_state, num_frames)
+                    result["j_vs_reference"] = get_mean_iou(masks, ref_masks)
+                results.append(result)
+                print(json.dumps(result), flush=True)
+            del predictor, ref_predictor
+            if device.type == "cuda":
+                torch.cuda.empty_cache()
+
+    baseline_results = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline_results = json.load(f)["results"]
+    print_results(results, baseline_results)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(
+                {"environment": get_environment(device, args), "results": results},
+                f,
+                indent=2,
+            )
+        print(f"results written to {args.output}")
+
+    if baseline_results is not None and args.max_regression is not None:
+        regressions = get_regressions(results, baseline_results, args.max_regression)
+        if len(regressions) > 0:
+            print(f"FPS regressions over {args.max_regression:.0%}: {regressions}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
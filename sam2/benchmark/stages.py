@@ -0,0 +1,119 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import time
+from collections import defaultdict
+
+import torch
+
+import sam2.sam2_video_predictor as sam2_video_predictor
+
+# The stages of video tracking timed by `StageTimer`, as the name of their module in
+# `SAM2Base` (or None for the post-processing, i.e. hole filling and the resizing of
+# the masks to the video resolution)
+STAGES = {
+    "image_encoder": "image_encoder",
+    "memory_attention": "memory_attention",
+    "prompt_encoder": "sam_prompt_encoder",
+    "mask_decoder": "sam_mask_decoder",
+    "memory_encoder": "memory_encoder",
+    "post_processing": None,
+}
+_POST_PROCESSING_METHODS = [
+    "_get_tracked_frame_output",
+    "_get_interpolated_frame_output",
+]
+
+
+def synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    elif device.type == "mps":
+        torch.mps.synchronize()
+
+
+class StageTimer:
+    """
+    Accumulate the wall-clock time spent in each stage of `STAGES` while tracking
+    with a video predictor, through forward hooks on the model components and
+    wrappers of the post-processing functions. The device is synchronized at the
+    start and end of each stage so that asynchronous (GPU) work is attributed to
+    the right stage, which slightly slows down tracking.
+
+    Use as a context manager:
+        with StageTimer(predictor) as timer:
+            for _ in predictor.propagate_in_video(inference_state):
+                pass
+        print(timer.times)
+    """
+
+    def __init__(self, predictor):
+        self.predictor = predictor
+        self.device = predictor.device
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self._starts = {}
+        self._handles = []
+        self._patched = []
+
+    def reset(self):
+        self.times.clear()
+        self.calls.clear()
+
+    def _start(self, stage):
+        synchronize(self.device)
+        self._starts[stage] = time.perf_counter()
+
+    def _stop(self, stage):
+        synchronize(self.device)
+        self.times[stage] += time.perf_counter() - self._starts.pop(stage)
+        self.calls[stage] += 1
+
+    def _timed(self, stage, fn):
+        def wrapper(*args, **kwargs):
+            self._start(stage)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._stop(stage)
+
+        return wrapper
+
+    def __enter__(self):
+        for stage, module_name in STAGES.items():
+            if module_name is None:
+                continue
+            module = getattr(self.predictor, module_name)
+            self._handles.append(
+                module.register_forward_pre_hook(lambda *_, s=stage: self._start(s))
+            )
+            self._handles.append(
+                module.register_forward_hook(lambda *_, s=stage: self._stop(s))
+            )
+        # post-processing: wrap the predictor output methods (on the instance) and
+        # the hole filling function (in the predictor module)
+        for name in _POST_PROCESSING_METHODS:
+            fn = getattr(self.predictor, name)
+            setattr(self.predictor, name, self._timed("post_processing", fn))
+            self._patched.append((self.predictor, name, None))
+        fn = sam2_video_predictor.fill_holes_in_mask_scores
+        sam2_video_predictor.fill_holes_in_mask_scores = self._timed(
+            "post_processing", fn
+        )
+        self._patched.append((sam2_video_predictor, "fill_holes_in_mask_scores", fn))
+        return self
+
+    def __exit__(self, *args):
+        for handle in self._handles:
+            handle.remove()
+        for obj, name, fn in self._patched:
+            if fn is None:
+                delattr(obj, name)  # back to the class method
+            else:
+                setattr(obj, name, fn)
+        self._handles.clear()
+        self._patched.clear()
+        self._starts.clear()
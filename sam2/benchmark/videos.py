@@ -0,0 +1,41 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+
+import numpy as np
+from PIL import Image
+
+
+def write_synthetic_video(
+    video_dir, num_frames, num_objects, height=540, width=960, seed=0
+):
+    """
+    Write a synthetic video as JPEG frames in `video_dir`, with `num_objects`
+    ellipses of random colors and sizes moving over a textured background, and
+    return the (x, y) centers of the objects on the first frame (to click on them).
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(video_dir, exist_ok=True)
+    background = rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+    background = np.array(Image.fromarray(background).resize((width, height)))
+
+    radii = rng.uniform(0.04, 0.1, (num_objects, 2)) * min(height, width)
+    colors = rng.integers(0, 256, (num_objects, 3))
+    starts = rng.uniform(0.2, 0.8, (num_objects, 2)) * (width, height)
+    # each object moves back and forth along a random direction
+    amplitudes = rng.uniform(-0.15, 0.15, (num_objects, 2)) * (width, height)
+    periods = rng.uniform(30, 90, num_objects)
+
+    ys, xs = np.mgrid[:height, :width]
+    for t in range(num_frames):
+        frame = background.copy()
+        centers = starts + amplitudes * np.sin(2 * np.pi * t / periods)[:, None]
+        for (cx, cy), (rx, ry), color in zip(centers, radii, colors):
+            inside = ((xs - cx) / rx) ** 2 + ((ys - cy) / ry) ** 2 <= 1
+            frame[inside] = color
+        Image.fromarray(frame).save(os.path.join(video_dir, f"{t:05d}.jpg"))
+    return starts
@@ -8,11 +8,10 @@ import logging
 import os
 
 import torch
-from hydra import compose
 from hydra.utils import instantiate
-from omegaconf import OmegaConf
 
 import sam2
+from sam2.utils.fast_load import empty_init, load_checkpoint_file, load_config
 
 # Check if the user is running Python from the parent directory of the sam2 repo
 # (i.e. the directory where this repo is cloned into) -- this is not supported since
@@ -31,6 +30,8 @@ if os.path.isdir(os.path.join(sam2.__path__[0], "sam2")):
         "rather than its parent dir, or from your home directory) after installing SAM 2."
     )
 
+sam2.initialize_hydra()
+
 
 HF_MODEL_ID_TO_FILENAMES = {
     "facebook/sam2-hiera-tiny": (
@@ -67,6 +68,59 @@ HF_MODEL_ID_TO_FILENAMES = {
     ),
 }
 
+# Named input resolutions as (height, width). The keys follow the usual WIDTHxHEIGHT
+# naming of video resolutions; the square ones trade accuracy for speed, and the
+# wide ones avoid stretching (and wasting encoder tokens on) 16:9 videos. Input
+# resolutions must be multiples of 32 (for the Hiera windowed positional embedding
+# and the feature pyramid).
+RESOLUTION_PROFILES = {
+    "1024": (1024, 1024),  # the resolution the SAM 2 models are trained at
+    "768": (768, 768),
+    "512": (512, 512),
+    "1024x576": (576, 1024),
+    "768x448": (448, 768),
+    "512x288": (288, 512),
+}
+
+
+def get_resolution_hw(resolution):
+    """
+    Get the input (height, width) of a resolution given as a name in
+    `RESOLUTION_PROFILES`, an int (for a square resolution) or a (height, width) pair.
+    """
+    from sam2.utils.misc import get_image_hw
+
+    if isinstance(resolution, str):
+        if resolution not in RESOLUTION_PROFILES:
+            raise ValueError(
+                f"Unknown resolution profile {resolution}, expected one of "
+                f"{list(RESOLUTION_PROFILES)}"
+            )
+        resolution = RESOLUTION_PROFILES[resolution]
+    height, width = get_image_hw(resolution)
+    if height % 32 != 0 or width % 32 != 0:
+        raise ValueError(
+            f"The input resolution must be a multiple of 32, got {height}x{width}"
+        )
+    return height, width
+
+
+def _resolution_overrides(resolution):
+    if resolution is None:
+        return []
+    height, width = get_resolution_hw(resolution)
+    image_size = height if height == width else f"[{height},{width}]"
+    return [f"++model.image_size={image_size}"]
+
+
+# Skip precomputing the position encodings of the image and memory features on GPU
+# when building the model (they are computed at the first forward pass instead);
+# the precomputation only helps `torch.compile` and slows down startup.
+_NO_POSITION_ENCODING_WARMUP_OVERRIDES = [
+    "++model.image_encoder.neck.position_encoding.warmup_cache=false",
+    "++model.memory_encoder.position_encoding.warmup_cache=false",
+]
+
 
 def build_sam2(
     config_file,
@@ -75,9 +129,30 @@ def build_sam2(
     mode="eval",
     hydra_overrides_extra=[],
     apply_postprocessing=True,
+    resolution=None,
+    fast_load=False,
+    config_cache_dir=None,
+    shared_weights_dir=None,
     **kwargs,
 ):
+    """
+    Build a SAM 2 model from a config file and an optional checkpoint. The input
+    resolution of the config can be changed with `resolution`, given as a name in
+    `RESOLUTION_PROFILES`, an int or a (height, width) pair.
 
+    With `fast_load`, the model is built for a fast startup: its parameters are not
+    initialized but assigned the weights of the checkpoint, which is memory-mapped
+    (a `torch.save` file or a `.safetensors` file) and loaded directly on `device`.
+    With `config_cache_dir`, the resolved config is cached in it (see `load_config`
+    in `sam2/utils/fast_load.py`).
+
+    With `shared_weights_dir` (e.g. "/dev/shm/sam2" for shared memory), the weights
+    of the checkpoint are written once to a file in it, which is memory-mapped with
+    `fast_load` (see `share_checkpoint` in `sam2/utils/shared_weights.py`). Models
+    built this way in several processes on CPU share the pages of their weights.
+    """
+    fast_load = fast_load or shared_weights_dir is not None
+    hydra_overrides_extra = hydra_overrides_extra + _resolution_overrides(resolution)
     if apply_postprocessing:
         hydra_overrides_extra = hydra_overrides_extra.copy()
         hydra_overrides_extra += [
@@ -86,15 +161,20 @@ def build_sam2(
             "++model.sam_mask_decoder_extra_args.dynamic_multimask_stability_delta=0.05",
             "++model.sam_mask_decoder_extra_args.dynamic_multimask_stability_thresh=0.98",
         ]
-    # Read config and init model
-    cfg = compose(config_name=config_file, overrides=hydra_overrides_extra)
-    OmegaConf.resolve(cfg)
-    model = instantiate(cfg.model, _recursive_=True)
-    _load_checkpoint(model, ckpt_path)
-    model = model.to(device)
-    if mode == "eval":
-        model.eval()
-    return model
+    if fast_load:
+        hydra_overrides_extra = (
+            hydra_overrides_extra + _NO_POSITION_ENCODING_WARMUP_OVERRIDES
+        )
+    return _build_model(
+        config_file,
+        hydra_overrides_extra,
+        ckpt_path,
+        device,
+        mode,
+        fast_load=fast_load,
+        config_cache_dir=config_cache_dir,
+        shared_weights_dir=shared_weights_dir,
+    )
 
 
 def build_sam2_video_predictor(
@@ -105,8 +185,32 @@ def build_sam2_video_predictor(
     hydra_overrides_extra=[],
     apply_postprocessing=True,
     vos_optimized=False,
+    resolution=None,
+    cpu_optimized=False,
+    compile_cache_dir=None,
+    fast_load=False,
+    config_cache_dir=None,
+    shared_weights_dir=None,
     **kwargs,
 ):
+    """
+    Build a SAM 2 video predictor from a config file and an optional checkpoint, see
+    `build_sam2` for the `resolution` argument. With `cpu_optimized`, the CPU
+    inference profile is applied with its default settings, see `optimize_for_cpu`
+    in `sam2/utils/cpu_inference.py` (the tracking should then be run in
+    `cpu_autocast()`). With `compile_cache_dir`, the compilation caches of the
+    model prebuilt by `tools/build_compile_cache.py` are loaded from it (if any),
+    so that `vos_optimized` predictors start without compiling from scratch. See
+    `build_sam2` for the `fast_load`, `config_cache_dir` and `shared_weights_dir`
+    arguments.
+    """
+    fast_load = fast_load or shared_weights_dir is not None
+    if cpu_optimized and vos_optimized:
+        raise ValueError(
+            "vos_optimized compiles the model for GPU, use "
+            "optimize_for_cpu(predictor, compile=True) to compile it for CPU instead"
+        )
+    hydra_overrides_extra = hydra_overrides_extra + _resolution_overrides(resolution)
     hydra_overrides = [
         "++model._target_=sam2.sam2_video_predictor.SAM2VideoPredictor",
     ]
@@ -129,15 +233,27 @@ def build_sam2_video_predictor(
             "++model.fill_hole_area=8",
         ]
     hydra_overrides.extend(hydra_overrides_extra)
+    if fast_load and not vos_optimized:
+        hydra_overrides.extend(_NO_POSITION_ENCODING_WARMUP_OVERRIDES)
 
-    # Read config and init model
-    cfg = compose(config_name=config_file, overrides=hydra_overrides)
-    OmegaConf.resolve(cfg)
-    model = instantiate(cfg.model, _recursive_=True)
-    _load_checkpoint(model, ckpt_path)
-    model = model.to(device)
-    if mode == "eval":
-        model.eval()
+    model = _build_model(
+        config_file,
+        hydra_overrides,
+        ckpt_path,
+        device,
+        mode,
+        fast_load=fast_load,
+        config_cache_dir=config_cache_dir,
+        shared_weights_dir=shared_weights_dir,
+    )
+    if cpu_optimized:
+        from sam2.utils.cpu_inference import optimize_for_cpu
+
+        optimize_for_cpu(model)
+    if compile_cache_dir is not None:
+        from sam2.utils.compile_cache import load_compile_cache
+
+        load_compile_cache(model, compile_cache_dir)
     return model
 
 
@@ -161,14 +277,65 @@ def build_sam2_video_predictor_hf(model_id, **kwargs):
     )
 
 
-def _load_checkpoint(model, ckpt_path):
+def _build_model(
+    config_file,
+    hydra_overrides,
+    ckpt_path,
+    device,
+    mode,
+    fast_load=False,
+    config_cache_dir=None,
+    shared_weights_dir=None,
+):
+    # Read config and init model
+    cfg = load_config(config_file, hydra_overrides, config_cache_dir)
+    if shared_weights_dir is not None and ckpt_path is not None:
+        from sam2.utils.shared_weights import share_checkpoint
+
+        ckpt_path = share_checkpoint(ckpt_path, shared_weights_dir)
+    ckpt = None
     if ckpt_path is not None:
-        sd = torch.load(ckpt_path, map_location="cpu", weights_only=True)["model"]
-        missing_keys, unexpected_keys = model.load_state_dict(sd)
-        if missing_keys:
-            logging.error(missing_keys)
-            raise RuntimeError()
-        if unexpected_keys:
-            logging.error(unexpected_keys)
-            raise RuntimeError()
-        logging.info("Loaded checkpoint sucessfully")
+        if fast_load:
+            ckpt = load_checkpoint_file(ckpt_path, device)
+        else:
+            ckpt = load_checkpoint_file(ckpt_path, "cpu", mmap=False)
+    if fast_load and ckpt is not None and "quantization" not in ckpt:
+        # quantized layers are converted from initialized float layers, so only the
+        # float models are built without initializing their parameters
+        with empty_init():
+            model = instantiate(cfg.model, _recursive_=True)
+        _load_checkpoint(model, ckpt, assign=True)
+    else:
+        model = instantiate(cfg.model, _recursive_=True)
+        if ckpt is not None:
+            _load_checkpoint(model, ckpt)
+    _check_quantized_model_device(model, device)
+    model = model.to(device)
+    if mode == "eval":
+        model.eval()
+    return model
+
+
+def _load_checkpoint(model, ckpt, assign=False):
+    sd = ckpt["model"]
+    if "quantization" in ckpt:
+        # int8 checkpoint from `tools/quantize_sam2.py`
+        from sam2.utils.quantization import apply_quantization
+
+        apply_quantization(model, ckpt["quantization"])
+    missing_keys, unexpected_keys = model.load_state_dict(sd, assign=assign)
+    if missing_keys:
+        logging.error(missing_keys)
+        raise RuntimeError()
+    if unexpected_keys:
+        logging.error(unexpected_keys)
+        raise RuntimeError()
+    logging.info("Loaded checkpoint sucessfully")
+
+
+def _check_quantized_model_device(model, device):
+    if getattr(model, "quantization", None) is not None:
+        if torch.device(device).type != "cpu":
+            raise ValueError(
+                f"Quantized SAM 2 checkpoints only run on CPU, got device {device}"
+            )
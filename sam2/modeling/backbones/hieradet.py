@@ -224,6 +224,9 @@ class Hiera(nn.Module):
         self.pos_embed_window = nn.Parameter(
             torch.zeros(1, embed_dim, self.window_spec[0], self.window_spec[0])
         )
+        # Positional embeddings interpolated to the feature map sizes seen at
+        # inference (one per input resolution), see `_get_pos_embed`
+        self._pos_embed_cache = {}
 
         dpr = [
             x.item() for x in torch.linspace(0, drop_path_rate, depth)
@@ -272,12 +275,26 @@ class Hiera(nn.Module):
 
     def _get_pos_embed(self, hw: Tuple[int, int]) -> torch.Tensor:
         h, w = hw
+        # Without gradients, reuse the embedding computed for the same feature map
+        # size, as long as the parameters were not modified (or moved) since then
+        use_cache = not torch.is_grad_enabled() and not torch.compiler.is_compiling()
+        if use_cache:
+            params_key = tuple(
+                (p._version, p.device, p.dtype)
+                for p in (self.pos_embed, self.pos_embed_window)
+            )
+            cached = self._pos_embed_cache.get((h, w))
+            if cached is not None and cached[0] == params_key:
+                return cached[1]
+
         window_embed = self.pos_embed_window
         pos_embed = F.interpolate(self.pos_embed, size=(h, w), mode="bicubic")
         pos_embed = pos_embed + window_embed.tile(
             [x // y for x, y in zip(pos_embed.shape, window_embed.shape)]
         )
         pos_embed = pos_embed.permute(0, 2, 3, 1)
+        if use_cache:
+            self._pos_embed_cache[(h, w)] = (params_key, pos_embed)
         return pos_embed
 
     def forward(self, x: torch.Tensor) -> List[torch.Tensor]:
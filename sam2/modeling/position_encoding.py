@@ -5,7 +5,7 @@
 # LICENSE file in the root directory of this source tree.
 
 import math
-from typing import Any, Optional, Tuple
+from typing import Any, Optional, Tuple, Union
 
 import numpy as np
 
@@ -28,7 +28,7 @@ class PositionEmbeddingSine(nn.Module):
         # Following settings only relevant
         # for warmping up cache for compilation
         warmup_cache: bool = True,
-        image_size: int = 1024,
+        image_size: Union[int, Tuple[int, int]] = 1024,  # int or (height, width)
         strides: Tuple[int] = (4, 8, 16, 32),
     ):
         super().__init__()
@@ -45,10 +45,19 @@ class PositionEmbeddingSine(nn.Module):
         self.cache = {}
         if warmup_cache and torch.cuda.is_available():
             # Warmup cache for cuda, to help with compilation
-            device = torch.device("cuda")
-            for stride in strides:
-                cache_key = (image_size // stride, image_size // stride)
-                self._pe(1, device, *cache_key)
+            self.warmup_cache(image_size, strides, torch.device("cuda"))
+
+    def warmup_cache(self, image_size, strides=(4, 8, 16, 32), device=None):
+        """
+        Precompute the position encodings of the feature maps at the given strides
+        for an input resolution `image_size` (an int or a (height, width) pair).
+        """
+        if isinstance(image_size, int):
+            image_size = (image_size, image_size)
+        height, width = image_size
+        for stride in strides:
+            cache_key = (height // stride, width // stride)
+            self._pe(1, device, *cache_key)
 
     def _encode_xy(self, x, y):
         # The positions are expected to be normalized
@@ -266,12 +266,28 @@ class RoPEAttention(Attention):
         self.compute_cis = partial(
             compute_axial_cis, dim=self.internal_dim // self.num_heads, theta=rope_theta
         )
-        freqs_cis = self.compute_cis(end_x=feat_sizes[0], end_y=feat_sizes[1])
-        self.freqs_cis = (
-            freqs_cis.to("cuda") if torch.cuda.is_available() else freqs_cis
-        )
+        # precomputed rotary encodings per feature map size
+        self._freqs_cis_tables = {}
+        self.set_feat_sizes(feat_sizes)
         self.rope_k_repeat = rope_k_repeat
 
+    def set_feat_sizes(self, feat_sizes):
+        """
+        Set the [w, h] size of the feature maps that the attention is applied to
+        (e.g. for a non-square input resolution), precomputing its rotary encoding.
+        """
+        self.feat_sizes = (int(feat_sizes[0]), int(feat_sizes[1]))
+        self.freqs_cis = self._get_freqs_cis(*self.feat_sizes)
+        if torch.cuda.is_available():
+            self.freqs_cis = self.freqs_cis.to("cuda")
+
+    def _get_freqs_cis(self, w, h):
+        freqs_cis = self._freqs_cis_tables.get((w, h))
+        if freqs_cis is None:
+            freqs_cis = self.compute_cis(end_x=w, end_y=h)
+            self._freqs_cis_tables[(w, h)] = freqs_cis
+        return freqs_cis
+
     def forward(
         self, q: Tensor, k: Tensor, v: Tensor, num_k_exclude_rope: int = 0
     ) -> Tensor:
@@ -286,10 +302,14 @@ class RoPEAttention(Attention):
         v = self._separate_heads(v, self.num_heads)
 
         # Apply rotary position encoding
-        w = h = math.sqrt(q.shape[-2])
         self.freqs_cis = self.freqs_cis.to(q.device)
         if self.freqs_cis.shape[0] != q.shape[-2]:
-            self.freqs_cis = self.compute_cis(end_x=w, end_y=h).to(q.device)
+            w, h = self.feat_sizes
+            if w * h != q.shape[-2]:
+                # feature maps of another size than the one set in `set_feat_sizes`
+                # are assumed to be square
+                w = h = int(math.sqrt(q.shape[-2]))
+            self.freqs_cis = self._get_freqs_cis(w, h).to(q.device)
         if q.shape[-2] != k.shape[-2]:
             assert self.rope_k_repeat
 
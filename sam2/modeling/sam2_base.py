@@ -10,10 +10,13 @@ import torch.nn.functional as F
 
 from torch.nn.init import trunc_normal_
 
+from sam2.modeling.position_encoding import PositionEmbeddingSine
 from sam2.modeling.sam.mask_decoder import MaskDecoder
 from sam2.modeling.sam.prompt_encoder import PromptEncoder
-from sam2.modeling.sam.transformer import TwoWayTransformer
+from sam2.modeling.sam.transformer import RoPEAttention, TwoWayTransformer
 from sam2.modeling.sam2_utils import get_1d_sine_pe, MLP, select_closest_cond_frames
+from sam2.utils.misc import get_image_hw
+from sam2.utils.profiling import profile_stage
 
 # a large negative value as a placeholder score for missing objects
 NO_OBJ_SCORE = -1024.0
@@ -26,7 +29,7 @@ class SAM2Base(torch.nn.Module):
         memory_attention,
         memory_encoder,
         num_maskmem=7,  # default 1 input frame + 6 previous frames
-        image_size=512,
+        image_size=512,  # input resolution, an int or a (height, width) pair
         backbone_stride=16,  # stride of the image backbone output
         sigmoid_scale_for_mem_enc=1.0,  # scale factor for mask sigmoid prob
         sigmoid_bias_for_mem_enc=0.0,  # bias factor for mask sigmoid prob
@@ -159,7 +162,9 @@ class SAM2Base(torch.nn.Module):
 
         # Part 4: SAM-style prompt encoder (for both mask and point inputs)
         # and SAM-style mask decoder for the final mask output
-        self.image_size = image_size
+        self.image_hw = get_image_hw(image_size)
+        # an int for square input resolutions, or a (height, width) pair
+        self.image_size = image_size if isinstance(image_size, int) else self.image_hw
         self.backbone_stride = backbone_stride
         self.sam_mask_decoder_extra_args = sam_mask_decoder_extra_args
         self.pred_obj_scores = pred_obj_scores
@@ -179,6 +184,7 @@ class SAM2Base(torch.nn.Module):
             trunc_normal_(self.no_obj_embed_spatial, std=0.02)
 
         self._build_sam_heads()
+        self._precompute_resolution_tables()
         self.max_cond_frames_in_attn = max_cond_frames_in_attn
 
         # Model compilation
@@ -207,17 +213,23 @@ class SAM2Base(torch.nn.Module):
     def _build_sam_heads(self):
         """Build SAM-style prompt encoder and mask decoder."""
         self.sam_prompt_embed_dim = self.hidden_dim
-        self.sam_image_embedding_size = self.image_size // self.backbone_stride
+        self.sam_image_embedding_hw = (
+            self.image_hw[0] // self.backbone_stride,
+            self.image_hw[1] // self.backbone_stride,
+        )
+        # an int for square input resolutions, as `image_size`
+        self.sam_image_embedding_size = (
+            self.sam_image_embedding_hw[0]
+            if isinstance(self.image_size, int)
+            else self.sam_image_embedding_hw
+        )
 
         # build PromptEncoder and MaskDecoder from SAM
         # (their hyperparameters like `mask_in_chans=16` are from SAM code)
         self.sam_prompt_encoder = PromptEncoder(
             embed_dim=self.sam_prompt_embed_dim,
-            image_embedding_size=(
-                self.sam_image_embedding_size,
-                self.sam_image_embedding_size,
-            ),
-            input_image_size=(self.image_size, self.image_size),
+            image_embedding_size=self.sam_image_embedding_hw,
+            input_image_size=self.image_hw,
             mask_in_chans=16,
         )
         self.sam_mask_decoder = MaskDecoder(
@@ -254,6 +266,25 @@ class SAM2Base(torch.nn.Module):
         else:
             self.obj_ptr_tpos_proj = torch.nn.Identity()
 
+    def _precompute_resolution_tables(self):
+        """
+        Precompute the positional encoding tables for the input resolution (which can
+        be non-square): the rotary encodings in the memory attention (on the stride 16
+        feature map) and, if warmed up, the sine encodings in the image encoder neck.
+        """
+        h, w = self.sam_image_embedding_hw
+        for module in self.memory_attention.modules():
+            if isinstance(module, RoPEAttention):
+                module.set_feat_sizes((w, h))  # RoPE feature sizes are [w, h]
+
+        position_encoding = getattr(self.image_encoder.neck, "position_encoding", None)
+        if (
+            isinstance(position_encoding, PositionEmbeddingSine)
+            and len(position_encoding.cache) > 0  # the cache is warmed up on CUDA
+            and torch.cuda.is_available()
+        ):
+            position_encoding.warmup_cache(self.image_hw, device=torch.device("cuda"))
+
     def _forward_sam_heads(
         self,
         backbone_features,
@@ -304,8 +335,7 @@ class SAM2Base(torch.nn.Module):
         B = backbone_features.size(0)
         device = backbone_features.device
         assert backbone_features.size(1) == self.sam_prompt_embed_dim
-        assert backbone_features.size(2) == self.sam_image_embedding_size
-        assert backbone_features.size(3) == self.sam_image_embedding_size
+        assert backbone_features.shape[2:] == self.sam_image_embedding_hw
 
         # a) Handle point prompts
         if point_inputs is not None:
@@ -372,7 +402,7 @@ class SAM2Base(torch.nn.Module):
         low_res_multimasks = low_res_multimasks.float()
         high_res_multimasks = F.interpolate(
             low_res_multimasks,
-            size=(self.image_size, self.image_size),
+            size=self.image_hw,
             mode="bilinear",
             align_corners=False,
         )
@@ -753,21 +783,23 @@ class SAM2Base(torch.nn.Module):
             # (see it as a GT mask) without using a SAM prompt encoder + mask decoder.
             pix_feat = current_vision_feats[-1].permute(1, 2, 0)
             pix_feat = pix_feat.view(-1, self.hidden_dim, *feat_sizes[-1])
-            sam_outputs = self._use_mask_as_output(
-                pix_feat, high_res_features, mask_inputs
-            )
+            with profile_stage("use_mask_as_output", frame_idx):
+                sam_outputs = self._use_mask_as_output(
+                    pix_feat, high_res_features, mask_inputs
+                )
         else:
             # fused the visual feature with previous memory features in the memory bank
-            pix_feat = self._prepare_memory_conditioned_features(
-                frame_idx=frame_idx,
-                is_init_cond_frame=is_init_cond_frame,
-                current_vision_feats=current_vision_feats[-1:],
-                current_vision_pos_embeds=current_vision_pos_embeds[-1:],
-                feat_sizes=feat_sizes[-1:],
-                output_dict=output_dict,
-                num_frames=num_frames,
-                track_in_reverse=track_in_reverse,
-            )
+            with profile_stage("prepare_memory_conditioned_features", frame_idx):
+                pix_feat = self._prepare_memory_conditioned_features(
+                    frame_idx=frame_idx,
+                    is_init_cond_frame=is_init_cond_frame,
+                    current_vision_feats=current_vision_feats[-1:],
+                    current_vision_pos_embeds=current_vision_pos_embeds[-1:],
+                    feat_sizes=feat_sizes[-1:],
+                    output_dict=output_dict,
+                    num_frames=num_frames,
+                    track_in_reverse=track_in_reverse,
+                )
             # apply SAM-style segmentation head
             # here we might feed previously predicted low-res SAM mask logits into the SAM mask decoder,
             # e.g. in demo where such logits come from earlier interaction instead of correction sampling
@@ -776,13 +808,14 @@ class SAM2Base(torch.nn.Module):
                 assert point_inputs is not None and mask_inputs is None
                 mask_inputs = prev_sam_mask_logits
             multimask_output = self._use_multimask(is_init_cond_frame, point_inputs)
-            sam_outputs = self._forward_sam_heads(
-                backbone_features=pix_feat,
-                point_inputs=point_inputs,
-                mask_inputs=mask_inputs,
-                high_res_features=high_res_features,
-                multimask_output=multimask_output,
-            )
+            with profile_stage("forward_sam_heads", frame_idx):
+                sam_outputs = self._forward_sam_heads(
+                    backbone_features=pix_feat,
+                    point_inputs=point_inputs,
+                    mask_inputs=mask_inputs,
+                    high_res_features=high_res_features,
+                    multimask_output=multimask_output,
+                )
 
         return current_out, sam_outputs, high_res_features, pix_feat
 
@@ -798,13 +831,14 @@ class SAM2Base(torch.nn.Module):
     ):
         if run_mem_encoder and self.num_maskmem > 0:
             high_res_masks_for_mem_enc = high_res_masks
-            maskmem_features, maskmem_pos_enc = self._encode_new_memory(
-                current_vision_feats=current_vision_feats,
-                feat_sizes=feat_sizes,
-                pred_masks_high_res=high_res_masks_for_mem_enc,
-                object_score_logits=object_score_logits,
-                is_mask_from_pts=(point_inputs is not None),
-            )
+            with profile_stage("encode_new_memory"):
+                maskmem_features, maskmem_pos_enc = self._encode_new_memory(
+                    current_vision_feats=current_vision_feats,
+                    feat_sizes=feat_sizes,
+                    pred_masks_high_res=high_res_masks_for_mem_enc,
+                    object_score_logits=object_score_logits,
+                    is_mask_from_pts=(point_inputs is not None),
+                )
             current_out["maskmem_features"] = maskmem_features
             current_out["maskmem_pos_enc"] = maskmem_pos_enc
         else:
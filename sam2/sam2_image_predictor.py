@@ -10,9 +10,15 @@ from typing import List, Optional, Tuple, Union
 
 import numpy as np
 import torch
+import torch.nn.functional as F
 from PIL.Image import Image
 
 from sam2.modeling.sam2_base import SAM2Base
+from sam2.utils.embedding_cache import (
+    compute_image_hash,
+    compute_weights_fingerprint,
+    EmbeddingCache,
+)
 
 from sam2.utils.transforms import SAM2Transforms
 
@@ -24,6 +30,8 @@ class SAM2ImagePredictor:
         mask_threshold=0.0,
         max_hole_area=0.0,
         max_sprinkle_area=0.0,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        embedding_cache_namespace: Optional[str] = None,
         **kwargs,
     ) -> None:
         """
@@ -38,6 +46,13 @@ class SAM2ImagePredictor:
             the maximum area of max_hole_area in low_res_masks.
           max_sprinkle_area (int): If max_sprinkle_area > 0, we remove small sprinkles up to
             the maximum area of max_sprinkle_area in low_res_masks.
+          embedding_cache (EmbeddingCache or None): If set, image embeddings are looked
+            up in (and added to) this cache by image content hash, so that setting the
+            same image again does not recompute the image encoder.
+          embedding_cache_namespace (str or None): Identifies the model in the cache
+            keys. It defaults to the model class, resolution and parameter count, and
+            a fingerprint of the weights (so that different checkpoints of the same
+            architecture don't share embeddings).
         """
         super().__init__()
         self.model = sam_model
@@ -58,11 +73,18 @@ class SAM2ImagePredictor:
         # Predictor config
         self.mask_threshold = mask_threshold
 
-        # Spatial dim for backbone feature maps
+        # Optional cache of image embeddings
+        self.embedding_cache = embedding_cache
+        # (the default namespace reads all the weights, so it's only computed when
+        # it's needed, see `_get_embedding_cache_namespace`)
+        self.embedding_cache_namespace = embedding_cache_namespace
+        if embedding_cache is not None:
+            self._get_embedding_cache_namespace()
+
+        # Spatial dim for backbone feature maps (at strides 4, 8 and 16)
+        image_h, image_w = self.model.image_hw
         self._bb_feat_sizes = [
-            (256, 256),
-            (128, 128),
-            (64, 64),
+            (image_h // stride, image_w // stride) for stride in (4, 8, 16)
         ]
 
     @classmethod
@@ -107,8 +129,16 @@ class SAM2ImagePredictor:
         else:
             raise NotImplementedError("Image format not supported")
 
-        input_image = self._transforms(image)
-        input_image = input_image[None, ...].to(self.device)
+        if self.embedding_cache is not None:
+            cache_key = compute_image_hash(image, self.embedding_cache_namespace)
+            entry = self.embedding_cache.get(cache_key, device=self.device)
+            if entry is not None:
+                logging.info("Using cached image embeddings.")
+                self._features = entry["features"]
+                self._is_image_set = True
+                return
+
+        input_image = self._transforms.forward_batch_on_device([image], self.device)
 
         assert (
             len(input_image.shape) == 4 and input_image.shape[1] == 3
@@ -126,6 +156,8 @@ class SAM2ImagePredictor:
         ][::-1]
         self._features = {"image_embed": feats[-1], "high_res_feats": feats[:-1]}
         self._is_image_set = True
+        if self.embedding_cache is not None:
+            self.embedding_cache.put(cache_key, self._features, self._orig_hw)
         logging.info("Image embeddings computed.")
 
     @torch.no_grad()
@@ -149,9 +181,36 @@ class SAM2ImagePredictor:
                 image, np.ndarray
             ), "Images are expected to be an np.ndarray in RGB format, and of shape  HWC"
             self._orig_hw.append(image.shape[:2])
+
+        if self.embedding_cache is not None:
+            # Only reuse cached embeddings if all images of the batch are cached
+            cache_keys = [
+                compute_image_hash(image, self.embedding_cache_namespace)
+                for image in image_list
+            ]
+            entries = []
+            for cache_key in cache_keys:
+                entry = self.embedding_cache.get(cache_key, device=self.device)
+                if entry is None:
+                    break
+                entries.append(entry)
+            if len(entries) == len(image_list):
+                logging.info("Using cached image embeddings.")
+                self._features = {
+                    "image_embed": torch.cat(
+                        [e["features"]["image_embed"] for e in entries], dim=0
+                    ),
+                    "high_res_feats": [
+                        torch.cat([e["features"]["high_res_feats"][i] for e in entries])
+                        for i in range(len(entries[0]["features"]["high_res_feats"]))
+                    ],
+                }
+                self._is_image_set = True
+                self._is_batch = True
+                return
+
         # Transform the image to the form expected by the model
-        img_batch = self._transforms.forward_batch(image_list)
-        img_batch = img_batch.to(self.device)
+        img_batch = self._transforms.forward_batch_on_device(image_list, self.device)
         batch_size = img_batch.shape[0]
         assert (
             len(img_batch.shape) == 4 and img_batch.shape[1] == 3
@@ -170,8 +229,78 @@ class SAM2ImagePredictor:
         self._features = {"image_embed": feats[-1], "high_res_feats": feats[:-1]}
         self._is_image_set = True
         self._is_batch = True
+        if self.embedding_cache is not None:
+            for img_idx, cache_key in enumerate(cache_keys):
+                # clone the slices so that each cache entry holds only its own image
+                image_features = {
+                    "image_embed": self._features["image_embed"][
+                        img_idx : img_idx + 1
+                    ].clone(),
+                    "high_res_feats": [
+                        feat[img_idx : img_idx + 1].clone()
+                        for feat in self._features["high_res_feats"]
+                    ],
+                }
+                self.embedding_cache.put(
+                    cache_key, image_features, [self._orig_hw[img_idx]]
+                )
         logging.info("Image embeddings computed.")
 
+    def _get_embedding_cache_namespace(self) -> str:
+        if self.embedding_cache_namespace is None:
+            num_params = sum(p.numel() for p in self.model.parameters())
+            self.embedding_cache_namespace = (
+                f"{type(self.model).__name__}-{self.model.image_size}-{num_params}-"
+                f"{compute_weights_fingerprint(self.model)}"
+            )
+        return self.embedding_cache_namespace
+
+    def export_embedding(self, path: str) -> None:
+        """
+        Save the embeddings of the currently set image(s) to `path`, so that they can
+        be served later (e.g. computed offline by a batch job) with `import_embedding`.
+        """
+        if not self._is_image_set:
+            raise RuntimeError(
+                "An image must be set with .set_image(...) before exporting embeddings."
+            )
+        torch.save(
+            {
+                "features": {
+                    "image_embed": self._features["image_embed"].cpu(),
+                    "high_res_feats": [
+                        feat.cpu() for feat in self._features["high_res_feats"]
+                    ],
+                },
+                "orig_hw": [tuple(hw) for hw in self._orig_hw],
+                "is_batch": self._is_batch,
+                "namespace": self._get_embedding_cache_namespace(),
+            },
+            path,
+        )
+
+    def import_embedding(self, path: str) -> None:
+        """
+        Set the image embeddings saved with `export_embedding`, allowing masks to be
+        predicted without running the image encoder.
+        """
+        state = torch.load(path, map_location="cpu", weights_only=True)
+        namespace = self._get_embedding_cache_namespace()
+        if state["namespace"] != namespace:
+            logging.warning(
+                f"Importing embeddings computed with {state['namespace']} into a "
+                f"predictor using {namespace}."
+            )
+        self.reset_predictor()
+        features = state["features"]
+        self._features = {
+            "image_embed": features["image_embed"].to(self.device),
+            "high_res_feats": [f.to(self.device) for f in features["high_res_feats"]],
+        }
+        self._orig_hw = [tuple(hw) for hw in state["orig_hw"]]
+        self._is_batch = state["is_batch"]
+        self._is_image_set = True
+
     def predict_batch(
         self,
         point_coords_batch: List[np.ndarray] = None,
@@ -184,6 +313,12 @@ class SAM2ImagePredictor:
     ) -> Tuple[List[np.ndarray], List[np.ndarray], List[np.ndarray]]:
         """This function is very similar to predict(...), however it is used for batched mode, when the model is expected to generate predictions on multiple images.
         It returns a tuple of lists of masks, ious, and low_res_masks_logits.
+
+        The prompts of all images are encoded and decoded together in a single batch.
+        Point prompts (with any box prompt merged in as its first two points) are padded
+        to a common length with "not a point" entries of label -1, which the prompt
+        encoder already uses for padding. The outputs of all images are copied to the
+        host in a single transfer.
         """
         assert self._is_batch, "This function should only be used when in batched mode"
         if not self._is_image_set:
@@ -191,9 +326,7 @@ class SAM2ImagePredictor:
                 "An image must be set with .set_image_batch(...) before mask prediction."
             )
         num_images = len(self._features["image_embed"])
-        all_masks = []
-        all_ious = []
-        all_low_res_masks = []
+        coords_list, labels_list, mask_input_list, num_objs_list = [], [], [], []
         for img_idx in range(num_images):
             # Transform input prompts
             point_coords = (
@@ -214,23 +347,69 @@ class SAM2ImagePredictor:
                 normalize_coords,
                 img_idx=img_idx,
             )
-            masks, iou_predictions, low_res_masks = self._predict(
-                unnorm_coords,
-                labels,
-                unnorm_box,
-                mask_input,
-                multimask_output,
-                return_logits=return_logits,
-                img_idx=img_idx,
+            concat_points = self._concat_box_and_points(
+                unnorm_coords, labels, unnorm_box
             )
-            masks_np = masks.squeeze(0).float().detach().cpu().numpy()
-            iou_predictions_np = (
-                iou_predictions.squeeze(0).float().detach().cpu().numpy()
+            if concat_points is not None:
+                num_objs = concat_points[0].size(0)
+            elif mask_input is not None:
+                num_objs = mask_input.size(0)
+            else:
+                num_objs = 1
+            if concat_points is None:
+                concat_points = (
+                    torch.zeros(num_objs, 0, 2, device=self.device),
+                    torch.zeros(num_objs, 0, dtype=torch.int, device=self.device),
+                )
+            if mask_input is not None:
+                mask_input = mask_input.expand(num_objs, -1, -1, -1)
+            coords_list.append(concat_points[0])
+            labels_list.append(concat_points[1])
+            mask_input_list.append(mask_input)
+            num_objs_list.append(num_objs)
+
+        masks_list, iou_predictions, low_res_masks = self._predict_batch(
+            coords_list,
+            labels_list,
+            mask_input_list,
+            num_objs_list,
+            multimask_output,
+            return_logits=return_logits,
+        )
+
+        # Pack all outputs to copy them to the host at once
+        outputs = masks_list + [iou_predictions, low_res_masks]
+        flat_outputs_np = (
+            torch.cat([x.float().flatten() for x in outputs]).detach().cpu().numpy()
+        )
+        outputs_np = []
+        offset = 0
+        for x in outputs:
+            outputs_np.append(
+                flat_outputs_np[offset : offset + x.numel()].reshape(x.shape)
             )
-            low_res_masks_np = low_res_masks.squeeze(0).float().detach().cpu().numpy()
+            offset += x.numel()
+        masks_np_list = outputs_np[:-2]
+        iou_predictions_np, low_res_masks_np = outputs_np[-2:]
+
+        all_masks = []
+        all_ious = []
+        all_low_res_masks = []
+        obj_start = 0
+        for img_idx, num_objs in enumerate(num_objs_list):
+            obj_end = obj_start + num_objs
+            masks_np = masks_np_list[img_idx]
+            iou_predictions_np_i = iou_predictions_np[obj_start:obj_end]
+            low_res_masks_np_i = low_res_masks_np[obj_start:obj_end]
+            # Match `predict`, which squeezes the object dimension for a single object
+            if num_objs == 1:
+                masks_np = masks_np.squeeze(0)
+                iou_predictions_np_i = iou_predictions_np_i.squeeze(0)
+                low_res_masks_np_i = low_res_masks_np_i.squeeze(0)
             all_masks.append(masks_np)
-            all_ious.append(iou_predictions_np)
-            all_low_res_masks.append(low_res_masks_np)
+            all_ious.append(iou_predictions_np_i)
+            all_low_res_masks.append(low_res_masks_np_i)
+            obj_start = obj_end
 
         return all_masks, all_ious, all_low_res_masks
 
@@ -343,6 +522,8 @@ class SAM2ImagePredictor:
         multimask_output: bool = True,
         return_logits: bool = False,
         img_idx: int = -1,
+        mask_roi_threshold: Optional[float] = None,
+        upsample_masks: bool = True,
     ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
         """
         Predict masks for the given input prompts, using the currently set image.
@@ -369,6 +550,14 @@ class SAM2ImagePredictor:
             input prompts, multimask_output=False can give better results.
           return_logits (bool): If true, returns un-thresholded masks logits
             instead of a binary mask.
+          mask_roi_threshold (float or None): If set, the masks are only upsampled
+            inside a box around the low res logits above this threshold (see
+            `SAM2Transforms.postprocess_masks_cropped`), and are returned as a
+            tuple of a list of the B*C cropped masks and a (B*C)x4 tensor of
+            their boxes in the original image.
+          upsample_masks (bool): If false, the output masks are kept at low
+            resolution (BxCx256x256), after hole filling and sprinkle removal.
+            Unlike the low res logits below, they are not clamped.
 
         Returns:
           (torch.Tensor): The output masks in BxCxHxW format, where C is the
@@ -384,25 +573,8 @@ class SAM2ImagePredictor:
                 "An image must be set with .set_image(...) before mask prediction."
             )
 
-        if point_coords is not None:
-            concat_points = (point_coords, point_labels)
-        else:
-            concat_points = None
-
         # Embed prompts
-        if boxes is not None:
-            box_coords = boxes.reshape(-1, 2, 2)
-            box_labels = torch.tensor([[2, 3]], dtype=torch.int, device=boxes.device)
-            box_labels = box_labels.repeat(boxes.size(0), 1)
-            # we merge "boxes" and "points" into a single "concat_points" input (where
-            # boxes are added at the beginning) to sam_prompt_encoder
-            if concat_points is not None:
-                concat_coords = torch.cat([box_coords, concat_points[0]], dim=1)
-                concat_labels = torch.cat([box_labels, concat_points[1]], dim=1)
-                concat_points = (concat_coords, concat_labels)
-            else:
-                concat_points = (box_coords, box_labels)
-
+        concat_points = self._concat_box_and_points(point_coords, point_labels, boxes)
         sparse_embeddings, dense_embeddings = self.model.sam_prompt_encoder(
             points=concat_points,
             boxes=None,
@@ -428,15 +600,159 @@ class SAM2ImagePredictor:
         )
 
         # Upscale the masks to the original image resolution
-        masks = self._transforms.postprocess_masks(
-            low_res_masks, self._orig_hw[img_idx]
-        )
+        if not upsample_masks:
+            masks = self._transforms.postprocess_masks(low_res_masks, None)
+            if not return_logits:
+                masks = masks > self.mask_threshold
+        elif mask_roi_threshold is not None:
+            mask_crops, mask_boxes = self._transforms.postprocess_masks_cropped(
+                low_res_masks, self._orig_hw[img_idx], roi_threshold=mask_roi_threshold
+            )
+            if not return_logits:
+                mask_crops = [m > self.mask_threshold for m in mask_crops]
+            masks = (mask_crops, mask_boxes)
+        else:
+            masks = self._transforms.postprocess_masks(
+                low_res_masks, self._orig_hw[img_idx]
+            )
+            if not return_logits:
+                masks = masks > self.mask_threshold
         low_res_masks = torch.clamp(low_res_masks, -32.0, 32.0)
-        if not return_logits:
-            masks = masks > self.mask_threshold
 
         return masks, iou_predictions, low_res_masks
 
+    @torch.no_grad()
+    def _predict_batch(
+        self,
+        point_coords_list: List[torch.Tensor],
+        point_labels_list: List[torch.Tensor],
+        mask_input_list: List[Optional[torch.Tensor]],
+        num_objs_list: List[int],
+        multimask_output: bool = True,
+        return_logits: bool = False,
+    ) -> Tuple[List[torch.Tensor], torch.Tensor, torch.Tensor]:
+        """
+        Predict masks for the prompts of all images of the batch in a single pass of
+        the prompt encoder and mask decoder. The inputs are per-image lists of
+        already transformed prompts, with `num_objs_list[i]` objects on image i.
+
+        Returns:
+          (List[torch.Tensor]): The output masks of each image in BxCxHxW format,
+            where (H, W) is the original size of that image.
+          (torch.Tensor): The predicted mask qualities of all objects, concatenated
+            over the images.
+          (torch.Tensor): The low resolution mask logits of all objects,
+            concatenated over the images.
+        """
+        num_images = len(num_objs_list)
+        total_num_objs = sum(num_objs_list)
+        max_num_points = max(coords.size(1) for coords in point_coords_list)
+
+        # Pad point prompts to a common length with "not a point" (label -1) entries
+        if max_num_points > 0:
+            point_coords = torch.cat(
+                [
+                    F.pad(coords, (0, 0, 0, max_num_points - coords.size(1)))
+                    for coords in point_coords_list
+                ],
+                dim=0,
+            )
+            point_labels = torch.cat(
+                [
+                    F.pad(labels, (0, max_num_points - labels.size(1)), value=-1)
+                    for labels in point_labels_list
+                ],
+                dim=0,
+            )
+            concat_points = (point_coords, point_labels)
+        else:
+            concat_points = None
+
+        sparse_embeddings, dense_embeddings = self.model.sam_prompt_encoder(
+            points=concat_points,
+            boxes=None,
+            masks=None,
+        )
+        sparse_embeddings = sparse_embeddings.expand(total_num_objs, -1, -1)
+        dense_embeddings = dense_embeddings.expand(total_num_objs, -1, -1, -1)
+
+        # Replace the "no mask" dense embeddings of objects with a mask input
+        mask_obj_inds = []
+        mask_inputs = []
+        obj_start = 0
+        for mask_input, num_objs in zip(mask_input_list, num_objs_list):
+            if mask_input is not None:
+                mask_obj_inds.extend(range(obj_start, obj_start + num_objs))
+                mask_inputs.append(mask_input)
+            obj_start += num_objs
+        if len(mask_inputs) > 0:
+            dense_embeddings = dense_embeddings.clone()
+            dense_embeddings[mask_obj_inds] = self.model.sam_prompt_encoder._embed_masks(
+                torch.cat(mask_inputs, dim=0)
+            )
+
+        # Gather the image features of each object
+        img_inds = torch.repeat_interleave(
+            torch.arange(num_images, device=self.device),
+            torch.tensor(num_objs_list, device=self.device),
+        )
+        high_res_features = [
+            feat_level[img_inds] for feat_level in self._features["high_res_feats"]
+        ]
+        low_res_masks, iou_predictions, _, _ = self.model.sam_mask_decoder(
+            image_embeddings=self._features["image_embed"][img_inds],
+            image_pe=self.model.sam_prompt_encoder.get_dense_pe(),
+            sparse_prompt_embeddings=sparse_embeddings,
+            dense_prompt_embeddings=dense_embeddings,
+            multimask_output=multimask_output,
+            repeat_image=False,
+            high_res_features=high_res_features,
+        )
+
+        # Upscale the masks to the original resolution of each image
+        masks_list = []
+        obj_start = 0
+        for img_idx, num_objs in enumerate(num_objs_list):
+            masks = self._transforms.postprocess_masks(
+                low_res_masks[obj_start : obj_start + num_objs], self._orig_hw[img_idx]
+            )
+            if not return_logits:
+                masks = masks > self.mask_threshold
+            masks_list.append(masks)
+            obj_start += num_objs
+        low_res_masks = torch.clamp(low_res_masks, -32.0, 32.0)
+
+        return masks_list, iou_predictions, low_res_masks
+
+    def _concat_box_and_points(
+        self,
+        point_coords: Optional[torch.Tensor],
+        point_labels: Optional[torch.Tensor],
+        boxes: Optional[torch.Tensor],
+    ) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+        """
+        Merge box prompts into the point prompts, as two points with labels 2 and 3
+        added at the beginning (consistent with how SAM 2 is trained).
+        """
+        if point_coords is not None:
+            concat_points = (point_coords, point_labels)
+        else:
+            concat_points = None
+
+        if boxes is not None:
+            box_coords = boxes.reshape(-1, 2, 2)
+            box_labels = torch.tensor([[2, 3]], dtype=torch.int, device=boxes.device)
+            box_labels = box_labels.repeat(boxes.size(0), 1)
+            # we merge "boxes" and "points" into a single "concat_points" input (where
+            # boxes are added at the beginning) to sam_prompt_encoder
+            if concat_points is not None:
+                concat_coords = torch.cat([box_coords, concat_points[0]], dim=1)
+                concat_labels = torch.cat([box_labels, concat_points[1]], dim=1)
+                concat_points = (concat_coords, concat_labels)
+            else:
+                concat_points = (box_coords, box_labels)
+        return concat_points
+
     def get_image_embedding(self) -> torch.Tensor:
         """
         Returns the image embeddings for the currently set image, with
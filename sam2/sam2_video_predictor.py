@@ -4,6 +4,7 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
+import os
 import warnings
 from collections import OrderedDict
 
@@ -13,7 +14,16 @@ import torch.nn.functional as F
 from tqdm import tqdm
 
 from sam2.modeling.sam2_base import NO_OBJ_SCORE, SAM2Base
-from sam2.utils.misc import concat_points, fill_holes_in_mask_scores, load_video_frames
+from sam2.modeling.sam2_utils import select_closest_cond_frames
+from sam2.utils.misc import (
+    concat_points,
+    fill_holes_in_mask_scores,
+    get_jpg_frame_paths,
+    get_mask_geometry,
+    load_video_frame,
+    load_video_frames,
+)
+from sam2.utils.profiling import profile_stage
 
 
 class SAM2VideoPredictor(SAM2Base):
@@ -37,6 +47,9 @@ class SAM2VideoPredictor(SAM2Base):
         self.non_overlap_masks = non_overlap_masks
         self.clear_non_cond_mem_around_input = clear_non_cond_mem_around_input
         self.add_all_frames_to_correct_as_cond = add_all_frames_to_correct_as_cond
+        # dtype to store the memory features in (bfloat16 to save memory; float32 to
+        # track without autocast, e.g. on CPUs without native bfloat16 support)
+        self.maskmem_dtype = torch.bfloat16
 
     @torch.inference_mode()
     def init_state(
@@ -45,9 +58,34 @@ class SAM2VideoPredictor(SAM2Base):
         offload_video_to_cpu=False,
         offload_state_to_cpu=False,
         async_loading_frames=False,
+        roi_tracking=False,
+        roi_margin=0.5,
+        roi_min_size=256,
+        roi_edge_margin=0.1,
     ):
-        """Initialize an inference state."""
+        """
+        Initialize an inference state.
+
+        With `roi_tracking=True` (only for JPEG folders), the objects are tracked in
+        a crop of the original frames around their last known boxes instead of in the
+        full frames, which gives the image encoder a higher resolution view of small
+        objects. The objects of a group (see `set_roi_object_groups`; by default all
+        the objects form one group) share a crop around the union of their boxes,
+        enlarged by `roi_margin` times the box size on each side, of at least
+        `roi_min_size` pixels and with the aspect ratio of the model input. The crop
+        is kept fixed (so that the memories of consecutive frames are aligned) until
+        an object gets within `roi_edge_margin` times the crop size of its edge or
+        gets much smaller than the crop, and falls back to the full frame when an
+        object is lost. Frames with clicks or mask inputs always use the full frame,
+        and their memories are encoded again in each crop that is tracked from them
+        (so that they are aligned with the features of the crop). The memories of
+        the frames tracked before a crop changes stay in their previous crop.
+        """
         compute_device = self.device  # device of the model
+        if roi_tracking and not (
+            isinstance(video_path, str) and os.path.isdir(video_path)
+        ):
+            raise NotImplementedError("ROI tracking is only supported on JPEG folders")
         images, video_height, video_width = load_video_frames(
             video_path=video_path,
             image_size=self.image_size,
@@ -79,6 +117,10 @@ class SAM2VideoPredictor(SAM2Base):
         inference_state["mask_inputs_per_obj"] = {}
         # visual features on a small number of recently visited frames for quick interactions
         inference_state["cached_features"] = {}
+        # number of lookups in "cached_features" that hit or missed the cache
+        inference_state["feature_cache_stats"] = {"hit": 0, "miss": 0}
+        # number of frames tracked or interpolated (when skipping frames) in propagation
+        inference_state["propagation_stats"] = {"tracked": 0, "interpolated": 0}
         # values that don't change across frames (so we only need to hold one copy of them)
         inference_state["constants"] = {}
         # mapping between client-side object id and model-side object index
@@ -94,6 +136,23 @@ class SAM2VideoPredictor(SAM2Base):
         # (we directly use their consolidated outputs during tracking)
         # metadata for each tracking frame (e.g. which direction it's tracked)
         inference_state["frames_tracked_per_obj"] = {}
+        # crop tracking settings and state (None if tracking in the full frames)
+        inference_state["roi_tracking"] = None
+        if roi_tracking:
+            inference_state["roi_tracking"] = {
+                "frame_paths": get_jpg_frame_paths(video_path),
+                "margin": roi_margin,
+                "min_size": roi_min_size,
+                "edge_margin": roi_edge_margin,
+                # lists of object ids sharing a crop (None for a single group)
+                "object_groups": None,
+                # current crop box of each group (keyed by object ids), or None
+                # for the full frame
+                "boxes": {},
+                # memories of the conditioning frames encoded in the current crop of
+                # their objects, keyed by (object index, frame index)
+                "cond_memories": {},
+            }
         # Warm up the visual backbone and cache the image feature on frame 0
         self._get_image_feature(inference_state, frame_idx=0, batch_size=1)
         return inference_state
@@ -157,6 +216,42 @@ class SAM2VideoPredictor(SAM2Base):
         """Get the total number of unique object ids received so far in this session."""
         return len(inference_state["obj_idx_to_id"])
 
+    def set_roi_object_groups(self, inference_state, object_groups):
+        """
+        Set the groups of object ids that share a crop in ROI tracking (see
+        `init_state`), e.g. objects that stay close to each other. Each crop is
+        encoded separately on every frame, and objects that are not in any group
+        are tracked in their own crop.
+        """
+        roi_state = inference_state["roi_tracking"]
+        if roi_state is None:
+            raise RuntimeError("ROI tracking is not enabled in this inference state")
+        roi_state["object_groups"] = [list(group) for group in object_groups]
+        roi_state["boxes"].clear()
+        roi_state["cond_memories"].clear()
+
+    def _get_roi_object_groups(self, inference_state):
+        """Get the groups of object indices that share a crop in tracking."""
+        num_objs = self._get_obj_num(inference_state)
+        roi_state = inference_state["roi_tracking"]
+        if roi_state is None or roi_state["object_groups"] is None:
+            return [list(range(num_objs))]
+        obj_id_to_idx = inference_state["obj_id_to_idx"]
+        obj_groups, grouped = [], set()
+        for group in roi_state["object_groups"]:
+            obj_group = [
+                obj_id_to_idx[obj_id]
+                for obj_id in group
+                if obj_id in obj_id_to_idx and obj_id_to_idx[obj_id] not in grouped
+            ]
+            grouped.update(obj_group)
+            obj_groups.append(obj_group)
+        obj_groups += [[i] for i in range(num_objs) if i not in grouped]
+        return [obj_group for obj_group in obj_groups if len(obj_group) > 0]
+
+    def _get_roi_box_key(self, inference_state, obj_group):
+        return tuple(inference_state["obj_idx_to_id"][i] for i in obj_group)
+
     @torch.inference_mode()
     def add_new_points_or_box(
         self,
@@ -214,7 +309,9 @@ class SAM2VideoPredictor(SAM2Base):
             video_W = inference_state["video_width"]
             points = points / torch.tensor([video_W, video_H]).to(points.device)
         # scale the (normalized) coordinates by the model's internal image size
-        points = points * self.image_size
+        points = points * torch.tensor(
+            [self.image_hw[1], self.image_hw[0]], device=points.device
+        )
         points = points.to(inference_state["device"])
         labels = labels.to(inference_state["device"])
 
@@ -258,11 +355,22 @@ class SAM2VideoPredictor(SAM2Base):
         if prev_out is not None and prev_out["pred_masks"] is not None:
             device = inference_state["device"]
             prev_sam_mask_logits = prev_out["pred_masks"].to(device, non_blocking=True)
+            if prev_out.get("roi_box") is not None:
+                # Paste masks predicted in a crop (in ROI tracking) into the frame
+                prev_sam_mask_logits = self._roi_masks_to_frame(
+                    inference_state,
+                    prev_sam_mask_logits,
+                    prev_out["roi_box"],
+                    (self.image_hw[0] // 4, self.image_hw[1] // 4),
+                )
             # Clamp the scale of prev_sam_mask_logits to avoid rare numerical issues.
             prev_sam_mask_logits = torch.clamp(prev_sam_mask_logits, -32.0, 32.0)
         current_out, _ = self._run_single_frame_inference(
             inference_state=inference_state,
-            output_dict=obj_output_dict,  # run on the slice of a single object
+            # run on the slice of a single object
+            output_dict=self._get_prompt_memory_view(
+                inference_state, obj_idx, frame_idx, reverse
+            ),
             frame_idx=frame_idx,
             batch_size=1,  # run on the slice of a single object
             is_init_cond_frame=is_init_cond_frame,
@@ -317,10 +425,10 @@ class SAM2VideoPredictor(SAM2Base):
         mask_inputs_orig = mask_inputs_orig.float().to(inference_state["device"])
 
         # resize the mask if it doesn't match the model's image size
-        if mask_H != self.image_size or mask_W != self.image_size:
+        if (mask_H, mask_W) != self.image_hw:
             mask_inputs = torch.nn.functional.interpolate(
                 mask_inputs_orig,
-                size=(self.image_size, self.image_size),
+                size=self.image_hw,
                 align_corners=False,
                 mode="bilinear",
                 antialias=True,  # use antialias for downsampling
@@ -342,7 +450,6 @@ class SAM2VideoPredictor(SAM2Base):
             reverse = False
         else:
             reverse = obj_frames_tracked[frame_idx]["reverse"]
-        obj_output_dict = inference_state["output_dict_per_obj"][obj_idx]
         obj_temp_output_dict = inference_state["temp_output_dict_per_obj"][obj_idx]
         # Add a frame to conditioning output if it's an initial conditioning frame or
         # if the model sees all frames receiving clicks/mask as conditioning frames.
@@ -351,7 +458,10 @@ class SAM2VideoPredictor(SAM2Base):
 
         current_out, _ = self._run_single_frame_inference(
             inference_state=inference_state,
-            output_dict=obj_output_dict,  # run on the slice of a single object
+            # run on the slice of a single object
+            output_dict=self._get_prompt_memory_view(
+                inference_state, obj_idx, frame_idx, reverse
+            ),
             frame_idx=frame_idx,
             batch_size=1,  # run on the slice of a single object
             is_init_cond_frame=is_init_cond_frame,
@@ -402,6 +512,233 @@ class SAM2VideoPredictor(SAM2Base):
             video_res_masks = self._apply_non_overlapping_constraints(video_res_masks)
         return any_res_masks, video_res_masks
 
+    def _get_roi_box(self, inference_state, obj_group):
+        """Get the current crop box of a group of objects (None for the full frame)."""
+        roi_state = inference_state["roi_tracking"]
+        if roi_state is None:
+            return None
+        return roi_state["boxes"].get(self._get_roi_box_key(inference_state, obj_group))
+
+    def _update_roi_box(self, inference_state, obj_group, pred_masks_per_obj, outs):
+        """
+        Update the crop box of a group of objects from their masks predicted on the
+        current frame: it falls back to the full frame if an object is lost, and it
+        is recomputed around the objects if they get close to its edge (or much
+        smaller than it), or if tracking was in the full frame.
+        """
+        roi_state = inference_state["roi_tracking"]
+        key = self._get_roi_box_key(inference_state, obj_group)
+        obj_boxes = []
+        for obj_idx in obj_group:
+            out = outs[obj_idx]
+            obj_box = None
+            if (out["object_score_logits"] > 0).all():
+                obj_box = self._get_video_res_box(
+                    inference_state, pred_masks_per_obj[obj_idx], out.get("roi_box")
+                )
+            if obj_box is None:
+                roi_state["boxes"][key] = None  # the object is lost
+                return
+            obj_boxes.append(obj_box)
+        union_box = (
+            min(box[0] for box in obj_boxes),
+            min(box[1] for box in obj_boxes),
+            max(box[2] for box in obj_boxes),
+            max(box[3] for box in obj_boxes),
+        )
+        roi_box = roi_state["boxes"].get(key)
+        new_roi_box = self._compute_roi_box(inference_state, union_box)
+        if roi_box is None or new_roi_box is None:
+            roi_state["boxes"][key] = new_roi_box
+            return
+        video_H = inference_state["video_height"]
+        video_W = inference_state["video_width"]
+        x0, y0, x1, y1 = roi_box
+        edge_x = roi_state["edge_margin"] * (x1 - x0)
+        edge_y = roi_state["edge_margin"] * (y1 - y0)
+        # (crop edges on the frame border don't count, objects can't go further)
+        near_edge = (
+            (x0 > 0 and union_box[0] < x0 + edge_x)
+            or (y0 > 0 and union_box[1] < y0 + edge_y)
+            or (x1 < video_W and union_box[2] > x1 - edge_x)
+            or (y1 < video_H and union_box[3] > y1 - edge_y)
+        )
+        too_large = 2 * (new_roi_box[2] - new_roi_box[0]) <= x1 - x0
+        if near_edge or too_large:
+            roi_state["boxes"][key] = new_roi_box
+
+    def _get_video_res_box(self, inference_state, pred_masks, roi_box):
+        """
+        Get the XYXY box (in original video pixels, with exclusive end) of a [1, 1,
+        H, W] low-res mask predicted in the `roi_box` crop (or None for the full
+        frame), or None if the mask is empty.
+        """
+        geometry = get_mask_geometry(pred_masks[0, 0])
+        if geometry["areas"].item() == 0:
+            return None
+        if roi_box is None:
+            video_H = inference_state["video_height"]
+            video_W = inference_state["video_width"]
+            roi_box = (0, 0, video_W, video_H)
+        mask_H, mask_W = pred_masks.shape[-2:]
+        scale_x = (roi_box[2] - roi_box[0]) / mask_W
+        scale_y = (roi_box[3] - roi_box[1]) / mask_H
+        x0, y0, x1, y1 = geometry["boxes"].tolist()  # inclusive end
+        return (
+            roi_box[0] + x0 * scale_x,
+            roi_box[1] + y0 * scale_y,
+            roi_box[0] + (x1 + 1) * scale_x,
+            roi_box[1] + (y1 + 1) * scale_y,
+        )
+
+    def _compute_roi_box(self, inference_state, obj_box):
+        """
+        Compute a crop box (in original video pixels) around an object box, enlarged
+        by the ROI margin, of at least the ROI min size and with the aspect ratio of
+        the model input, or None if it would cover the full frame.
+        """
+        roi_state = inference_state["roi_tracking"]
+        video_H = inference_state["video_height"]
+        video_W = inference_state["video_width"]
+        margin, min_size = roi_state["margin"], roi_state["min_size"]
+        x0, y0, x1, y1 = obj_box
+        w = max((x1 - x0) * (1 + 2 * margin), min_size)
+        h = max((y1 - y0) * (1 + 2 * margin), min_size)
+        # enlarge the crop to the aspect ratio of the model input
+        aspect_ratio = self.image_hw[1] / self.image_hw[0]
+        w, h = max(w, h * aspect_ratio), max(h, w / aspect_ratio)
+        w, h = min(w, video_W), min(h, video_H)
+        if w >= video_W and h >= video_H:
+            return None
+        # center the crop on the object, keeping it inside the frame
+        crop_x0 = min(max((x0 + x1 - w) / 2, 0), video_W - w)
+        crop_y0 = min(max((y0 + y1 - h) / 2, 0), video_H - h)
+        crop_x0, crop_y0 = int(crop_x0), int(crop_y0)
+        return (
+            crop_x0,
+            crop_y0,
+            min(crop_x0 + max(round(w), 1), video_W),
+            min(crop_y0 + max(round(h), 1), video_H),
+        )
+
+    def _roi_masks_to_frame(self, inference_state, masks, roi_box, out_hw):
+        """
+        Resize [B, 1, H, W] mask scores predicted in the `roi_box` crop of a frame
+        (or the full frame if None) into a frame of size `out_hw`, filling the
+        outside of the crop with NO_OBJ_SCORE.
+        """
+        masks = masks.to(inference_state["device"], non_blocking=True)
+        out_H, out_W = out_hw
+        if roi_box is None:
+            if masks.shape[-2:] == (out_H, out_W):
+                return masks
+            return F.interpolate(
+                masks, size=(out_H, out_W), mode="bilinear", align_corners=False
+            )
+        scale_x = out_W / inference_state["video_width"]
+        scale_y = out_H / inference_state["video_height"]
+        x0, y0 = round(roi_box[0] * scale_x), round(roi_box[1] * scale_y)
+        x1 = max(round(roi_box[2] * scale_x), x0 + 1)
+        y1 = max(round(roi_box[3] * scale_y), y0 + 1)
+        frame_masks = masks.new_full((masks.size(0), 1, out_H, out_W), NO_OBJ_SCORE)
+        frame_masks[..., y0:y1, x0:x1] = F.interpolate(
+            masks, size=(y1 - y0, x1 - x0), mode="bilinear", align_corners=False
+        )
+        return frame_masks
+
+    def _frame_masks_to_roi(self, inference_state, masks, roi_box):
+        """
+        Resample [B, 1, H, W] mask scores of the full frame into its `roi_box` crop
+        at the model input resolution (the inverse of `_roi_masks_to_frame`).
+        """
+        masks = masks.to(inference_state["device"], non_blocking=True).float()
+        video_H = inference_state["video_height"]
+        video_W = inference_state["video_width"]
+        out_H, out_W = self.image_hw
+        x0, y0, x1, y1 = roi_box
+        # the centers of the output pixels, normalized to [-1, 1] in the frame
+        xs = torch.arange(out_W, device=masks.device) + 0.5
+        ys = torch.arange(out_H, device=masks.device) + 0.5
+        xs = (x0 + xs * (x1 - x0) / out_W) * 2 / video_W - 1
+        ys = (y0 + ys * (y1 - y0) / out_H) * 2 / video_H - 1
+        grid = torch.stack(torch.meshgrid(xs, ys, indexing="xy"), dim=-1)
+        return F.grid_sample(
+            masks,
+            grid[None].expand(masks.size(0), -1, -1, -1),
+            mode="bilinear",
+            padding_mode="border",
+            align_corners=False,
+        )
+
+    def _get_roi_memory_view(
+        self, inference_state, obj_idx, output_dict, frame_idx, roi_box
+    ):
+        """
+        Get a view of an object's `output_dict` to track `frame_idx` in the `roi_box`
+        crop, where the memories of the conditioning frames it attends to (which are
+        encoded in the full frame) are encoded in that crop instead. They're encoded
+        on the first frame tracked in a crop and reused until the crop changes.
+        """
+        cond_memories = inference_state["roi_tracking"]["cond_memories"]
+        cond_outputs = output_dict["cond_frame_outputs"]
+        selected_cond_outputs, _ = select_closest_cond_frames(
+            frame_idx, cond_outputs, self.max_cond_frames_in_attn
+        )
+        view_cond_outputs = dict(cond_outputs)
+        for t, out in selected_cond_outputs.items():
+            if out.get("roi_box") == roi_box:
+                continue  # already encoded in this crop
+            cached = cond_memories.get((obj_idx, t))
+            if cached is None or cached[0] is not out or cached[1] != roi_box:
+                masks = out["pred_masks"]
+                if out.get("roi_box") is not None:
+                    low_res_hw = (self.image_hw[0] // 4, self.image_hw[1] // 4)
+                    masks = self._roi_masks_to_frame(
+                        inference_state, masks, out["roi_box"], low_res_hw
+                    )
+                maskmem_features, maskmem_pos_enc = self._run_memory_encoder(
+                    inference_state=inference_state,
+                    frame_idx=t,
+                    batch_size=1,  # run on the slice of a single object
+                    high_res_masks=self._frame_masks_to_roi(
+                        inference_state, masks, roi_box
+                    ),
+                    object_score_logits=out["object_score_logits"],
+                    # as when encoding the memories of the conditioning frames
+                    is_mask_from_pts=True,
+                    roi_box=roi_box,
+                )
+                cached = (out, roi_box, maskmem_features, maskmem_pos_enc)
+                cond_memories[(obj_idx, t)] = cached
+            view_cond_outputs[t] = {
+                **out,
+                "maskmem_features": cached[2],
+                "maskmem_pos_enc": cached[3],
+            }
+        return {
+            "cond_frame_outputs": view_cond_outputs,
+            "non_cond_frame_outputs": output_dict["non_cond_frame_outputs"],
+        }
+
+    def _get_roi_video_res_output(self, inference_state, pred_masks_per_obj, outs):
+        """
+        Same as `_get_orig_video_res_output` for the masks of all objects in ROI
+        tracking, which can be predicted in different crops of the frame.
+        """
+        video_hw = (inference_state["video_height"], inference_state["video_width"])
+        video_res_masks = torch.cat(
+            [
+                self._roi_masks_to_frame(
+                    inference_state, pred_masks, out.get("roi_box"), video_hw
+                )
+                for pred_masks, out in zip(pred_masks_per_obj, outs)
+            ],
+            dim=0,
+        )
+        if self.non_overlap_masks:
+            video_res_masks = self._apply_non_overlapping_constraints(video_res_masks)
+        return video_res_masks
+
     def _consolidate_temp_output_across_obj(
         self,
         inference_state,
@@ -427,7 +764,8 @@ class SAM2VideoPredictor(SAM2Base):
             consolidated_W = inference_state["video_width"]
             consolidated_mask_key = "pred_masks_video_res"
         else:
-            consolidated_H = consolidated_W = self.image_size // 4
+            consolidated_H = self.image_hw[0] // 4
+            consolidated_W = self.image_hw[1] // 4
             consolidated_mask_key = "pred_masks"
 
         # Initialize `consolidated_out`. Its "maskmem_features" and "maskmem_pos_enc"
@@ -462,6 +800,14 @@ class SAM2VideoPredictor(SAM2Base):
             # Add the temporary object output mask to consolidated output mask
             obj_mask = out["pred_masks"]
             consolidated_pred_masks = consolidated_out[consolidated_mask_key]
+            if out.get("roi_box") is not None:
+                # Paste masks predicted in a crop (in ROI tracking) into the frame
+                obj_mask = self._roi_masks_to_frame(
+                    inference_state,
+                    obj_mask,
+                    out["roi_box"],
+                    consolidated_pred_masks.shape[-2:],
+                ).to(consolidated_pred_masks.device)
             if obj_mask.shape[-2:] == consolidated_pred_masks.shape[-2:]:
                 consolidated_pred_masks[obj_idx : obj_idx + 1] = obj_mask
             else:
@@ -504,7 +850,7 @@ class SAM2VideoPredictor(SAM2Base):
                     if out["maskmem_features"] is None:
                         high_res_masks = torch.nn.functional.interpolate(
                             out["pred_masks"].to(inference_state["device"]),
-                            size=(self.image_size, self.image_size),
+                            size=self.image_hw,
                             mode="bilinear",
                             align_corners=False,
                         )
@@ -549,13 +895,28 @@ class SAM2VideoPredictor(SAM2Base):
         start_frame_idx=None,
         max_frame_num_to_track=None,
         reverse=False,
+        frame_stride=1,
+        densify_iou_thresh=0.8,
     ):
-        """Propagate the input points across frames to track in the entire video."""
+        """
+        Propagate the input points across frames to track in the entire video.
+
+        With `frame_stride` > 1, the objects are first tracked on every
+        `frame_stride`-th frame only (and on the frames with clicks or mask inputs).
+        Between two such frames, if the low-res masks of any object have an IoU
+        below `densify_iou_thresh` (or if it appears or disappears), all the frames
+        in between are tracked; otherwise, their masks are interpolated from the
+        mask logits of the two frames, shifted along the motion of the mask
+        centroids. `densify_iou_thresh` trades throughput (lower values) for
+        fidelity (higher values, 1.0 tracking all frames in most cases).
+        Interpolated frames are not used as memory nor counted as tracked frames in
+        the propagation stats, but prompts added on them correct their masks from
+        the memories of the nearest tracked frames (as when tracking them).
+        """
         self.propagate_in_video_preflight(inference_state)
 
         obj_ids = inference_state["obj_ids"]
         num_frames = inference_state["num_frames"]
-        batch_size = self._get_obj_num(inference_state)
 
         # set start index, end index, and processing order
         if start_frame_idx is None:
@@ -580,9 +941,40 @@ class SAM2VideoPredictor(SAM2Base):
             )
             processing_order = range(start_frame_idx, end_frame_idx + 1)
 
+        if frame_stride > 1:
+            yield from self._propagate_in_video_adaptive(
+                inference_state,
+                processing_order,
+                reverse,
+                frame_stride,
+                densify_iou_thresh,
+            )
+            return
+
         for frame_idx in tqdm(processing_order, desc="propagate in video"):
-            pred_masks_per_obj = [None] * batch_size
-            for obj_idx in range(batch_size):
+            pred_masks_per_obj, outs_per_obj = self._track_frame(
+                inference_state, frame_idx, reverse
+            )
+            video_res_masks = self._get_tracked_frame_output(
+                inference_state, pred_masks_per_obj, outs_per_obj
+            )
+            yield frame_idx, obj_ids, video_res_masks
+
+    def _track_frame(self, inference_state, frame_idx, reverse, frame_stride=None):
+        """
+        Track all objects on a frame during propagation, returning their low-res
+        mask scores (on the device) and outputs. With `frame_stride` set, the
+        objects are tracked from the last tracked frames as memory, which can be
+        non-consecutive (see `_get_sparse_memory_view`).
+        """
+        batch_size = self._get_obj_num(inference_state)
+        pred_masks_per_obj = [None] * batch_size
+        outs_per_obj = [None] * batch_size
+        # In ROI tracking, each group of objects is tracked in its own crop
+        # (otherwise, all objects are tracked in the full frame)
+        for obj_group in self._get_roi_object_groups(inference_state):
+            roi_box = self._get_roi_box(inference_state, obj_group)
+            for obj_idx in obj_group:
                 obj_output_dict = inference_state["output_dict_per_obj"][obj_idx]
                 # We skip those frames already in consolidated outputs (these are frames
                 # that received input clicks or mask). Note that we cannot directly run
@@ -600,9 +992,18 @@ class SAM2VideoPredictor(SAM2Base):
                         )
                 else:
                     storage_key = "non_cond_frame_outputs"
+                    output_dict = obj_output_dict
+                    if frame_stride is not None:
+                        output_dict = self._get_sparse_memory_view(
+                            obj_output_dict, frame_idx, reverse, frame_stride
+                        )
+                    if roi_box is not None:
+                        output_dict = self._get_roi_memory_view(
+                            inference_state, obj_idx, output_dict, frame_idx, roi_box
+                        )
                     current_out, pred_masks = self._run_single_frame_inference(
                         inference_state=inference_state,
-                        output_dict=obj_output_dict,
+                        output_dict=output_dict,
                         frame_idx=frame_idx,
                         batch_size=1,  # run on the slice of a single object
                         is_init_cond_frame=False,
@@ -610,6 +1011,7 @@ class SAM2VideoPredictor(SAM2Base):
                         mask_inputs=None,
                         reverse=reverse,
                         run_mem_encoder=True,
+                        roi_box=roi_box,
                     )
                     obj_output_dict[storage_key][frame_idx] = current_out
 
@@ -617,17 +1019,225 @@ class SAM2VideoPredictor(SAM2Base):
                     "reverse": reverse
                 }
                 pred_masks_per_obj[obj_idx] = pred_masks
+                outs_per_obj[obj_idx] = current_out
 
-            # Resize the output mask to the original video resolution (we directly use
-            # the mask scores on GPU for output to avoid any CPU conversion in between)
-            if len(pred_masks_per_obj) > 1:
-                all_pred_masks = torch.cat(pred_masks_per_obj, dim=0)
+            if inference_state["roi_tracking"] is not None:
+                self._update_roi_box(
+                    inference_state, obj_group, pred_masks_per_obj, outs_per_obj
+                )
+
+        stats = inference_state.get("propagation_stats")
+        if stats is not None:
+            stats["tracked"] += 1
+        return pred_masks_per_obj, outs_per_obj
+
+    def _get_tracked_frame_output(self, inference_state, pred_masks_per_obj, outs):
+        """Get the video resolution mask scores of all objects on a tracked frame."""
+        # Resize the output mask to the original video resolution (we directly use
+        # the mask scores on GPU for output to avoid any CPU conversion in between)
+        if inference_state["roi_tracking"] is not None:
+            return self._get_roi_video_res_output(
+                inference_state, pred_masks_per_obj, outs
+            )
+        if len(pred_masks_per_obj) > 1:
+            all_pred_masks = torch.cat(pred_masks_per_obj, dim=0)
+        else:
+            all_pred_masks = pred_masks_per_obj[0]
+        _, video_res_masks = self._get_orig_video_res_output(
+            inference_state, all_pred_masks
+        )
+        return video_res_masks
+
+    def _propagate_in_video_adaptive(
+        self,
+        inference_state,
+        processing_order,
+        reverse,
+        frame_stride,
+        densify_iou_thresh,
+    ):
+        """Propagation with frame skipping, see `propagate_in_video`."""
+        obj_ids = inference_state["obj_ids"]
+        processing_order = list(processing_order)
+        if len(processing_order) == 0:
+            return
+        # Track every `frame_stride`-th frame, the last one and all conditioning frames
+        cond_frames = set()
+        for obj_output_dict in inference_state["output_dict_per_obj"].values():
+            cond_frames.update(obj_output_dict["cond_frame_outputs"])
+        key_frames = [
+            t
+            for i, t in enumerate(processing_order)
+            if i % frame_stride == 0
+            or t in cond_frames
+            or i == len(processing_order) - 1
+        ]
+        step = -1 if reverse else 1
+        stats = inference_state.get("propagation_stats")
+        roi_state = inference_state["roi_tracking"]
+        frames_tracked_per_obj = inference_state["frames_tracked_per_obj"]
+        progress_bar = tqdm(total=len(processing_order), desc="propagate in video")
+
+        prev_frame_idx = key_frames[0]
+        prev_out = self._track_frame(
+            inference_state, prev_frame_idx, reverse, frame_stride
+        )
+        yield prev_frame_idx, obj_ids, self._get_tracked_frame_output(
+            inference_state, *prev_out
+        )
+        progress_bar.update(1)
+        for frame_idx in key_frames[1:]:
+            skipped_frames = list(range(prev_frame_idx + step, frame_idx, step))
+            roi_boxes = dict(roi_state["boxes"]) if roi_state is not None else None
+            out = self._track_frame(inference_state, frame_idx, reverse, frame_stride)
+            if len(skipped_frames) > 0 and self._needs_dense_tracking(
+                inference_state, prev_out, out, densify_iou_thresh
+            ):
+                # Drop the output on this frame, and track all frames up to it instead
+                # (so that it is also tracked from the previous frames as memory)
+                self._remove_non_cond_frame_outputs(inference_state, frame_idx)
+                if stats is not None:
+                    stats["tracked"] -= 1
+                if roi_state is not None:
+                    roi_state["boxes"] = roi_boxes
+                for t in skipped_frames + [frame_idx]:
+                    out = self._track_frame(inference_state, t, reverse, frame_stride)
+                    yield t, obj_ids, self._get_tracked_frame_output(
+                        inference_state, *out
+                    )
             else:
-                all_pred_masks = pred_masks_per_obj[0]
-            _, video_res_masks = self._get_orig_video_res_output(
-                inference_state, all_pred_masks
+                num_steps = len(skipped_frames) + 1
+                for i, t in enumerate(skipped_frames, start=1):
+                    for obj_frames_tracked in frames_tracked_per_obj.values():
+                        obj_frames_tracked[t] = {
+                            "reverse": reverse,
+                            # (it has no output, see `_get_prompt_memory_view`)
+                            "interpolated_with_stride": frame_stride,
+                        }
+                    yield t, obj_ids, self._get_interpolated_frame_output(
+                        inference_state, prev_out, out, i / num_steps
+                    )
+                if stats is not None:
+                    stats["interpolated"] += len(skipped_frames)
+                yield frame_idx, obj_ids, self._get_tracked_frame_output(
+                    inference_state, *out
+                )
+            progress_bar.update(len(skipped_frames) + 1)
+            prev_frame_idx, prev_out = frame_idx, out
+        progress_bar.close()
+
+    def _get_prompt_memory_view(self, inference_state, obj_idx, frame_idx, reverse):
+        """
+        Get the `output_dict` of an object to add a prompt on `frame_idx` from. For
+        a frame that was interpolated in `propagate_in_video` (with `frame_stride` >
+        1), it's the sparse memory view it would have been tracked from, since the
+        frames right before it have no outputs either.
+        """
+        obj_output_dict = inference_state["output_dict_per_obj"][obj_idx]
+        obj_frames_tracked = inference_state["frames_tracked_per_obj"][obj_idx]
+        frame_stride = obj_frames_tracked.get(frame_idx, {}).get(
+            "interpolated_with_stride"
+        )
+        if frame_stride is None:
+            return obj_output_dict
+        return self._get_sparse_memory_view(
+            obj_output_dict, frame_idx, reverse, frame_stride
+        )
+
+    def _get_sparse_memory_view(self, output_dict, frame_idx, reverse, frame_stride):
+        """
+        Get a view of an object's `output_dict` to track `frame_idx` when frames are
+        skipped: the last tracked non-conditioning frames before `frame_idx` (in the
+        tracking direction) are moved to the indices of the frames right before it,
+        so that they are used as its memories and object pointers as in dense
+        tracking (which would otherwise look for the skipped frames).
+        """
+        step = 1 if reverse else -1
+        num_prev_frames = (
+            self.num_maskmem * self.memory_temporal_stride_for_eval
+            + self.max_obj_ptrs_in_encoder
+        )
+        non_cond_outputs = output_dict["non_cond_frame_outputs"]
+        view_non_cond_outputs = {}
+        for dist in range(1, num_prev_frames * frame_stride + 1):
+            out = non_cond_outputs.get(frame_idx + dist * step)
+            if out is not None:
+                view_frame_idx = frame_idx + (len(view_non_cond_outputs) + 1) * step
+                view_non_cond_outputs[view_frame_idx] = out
+                if len(view_non_cond_outputs) == num_prev_frames:
+                    break
+        return {
+            "cond_frame_outputs": output_dict["cond_frame_outputs"],
+            "non_cond_frame_outputs": view_non_cond_outputs,
+        }
+
+    def _needs_dense_tracking(self, inference_state, prev_out, out, iou_thresh):
+        """
+        Whether the frames between two tracked frames (with outputs `prev_out` and
+        `out` from `_track_frame`) should be tracked instead of interpolated, i.e.
+        if an object appears, disappears or changes too much between them.
+        """
+        for obj_idx in range(len(out[0])):
+            prev_masks, masks = self._get_low_res_frame_masks(
+                inference_state, [prev_out, out], obj_idx
             )
-            yield frame_idx, obj_ids, video_res_masks
+            prev_appearing = (prev_out[1][obj_idx]["object_score_logits"] > 0).all()
+            appearing = (out[1][obj_idx]["object_score_logits"] > 0).all()
+            if prev_appearing.item() != appearing.item():
+                return True
+            prev_masks, masks = prev_masks > 0, masks > 0
+            union = (prev_masks | masks).sum()
+            if union > 0 and (prev_masks & masks).sum() < iou_thresh * union:
+                return True
+        return False
+
+    def _get_low_res_frame_masks(self, inference_state, tracked_outs, obj_idx):
+        """
+        Get the low-res mask scores of an object in the full frame (i.e. pasted into
+        the frame in ROI tracking) from a list of `_track_frame` outputs.
+        """
+        low_res_hw = (self.image_hw[0] // 4, self.image_hw[1] // 4)
+        return [
+            self._roi_masks_to_frame(
+                inference_state,
+                pred_masks_per_obj[obj_idx],
+                outs[obj_idx].get("roi_box"),
+                low_res_hw,
+            )
+            for pred_masks_per_obj, outs in tracked_outs
+        ]
+
+    def _get_interpolated_frame_output(self, inference_state, prev_out, out, alpha):
+        """
+        Get the video resolution mask scores of all objects on a skipped frame at
+        fraction `alpha` between two tracked frames (with outputs `prev_out` and
+        `out` from `_track_frame`), by blending their low-res mask scores after
+        shifting them along the motion of the mask centroids.
+        """
+        interpolated_masks = []
+        for obj_idx in range(len(out[0])):
+            prev_masks, masks = self._get_low_res_frame_masks(
+                inference_state, [prev_out, out], obj_idx
+            )
+            prev_centroid = get_mask_geometry(prev_masks[0, 0])["centroids"]
+            centroid = get_mask_geometry(masks[0, 0])["centroids"]
+            motion = centroid - prev_centroid  # NaN if one of the masks is empty
+            if not torch.isnan(motion).any():
+                prev_masks = _shift_masks(prev_masks, alpha * motion)
+                masks = _shift_masks(masks, (alpha - 1) * motion)
+            interpolated_masks.append((1 - alpha) * prev_masks + alpha * masks)
+        _, video_res_masks = self._get_orig_video_res_output(
+            inference_state, torch.cat(interpolated_masks, dim=0)
+        )
+        return video_res_masks
+
+    def _remove_non_cond_frame_outputs(self, inference_state, frame_idx):
+        """Remove the tracking outputs of all objects on a non-conditioning frame."""
+        for obj_idx, obj_output_dict in inference_state["output_dict_per_obj"].items():
+            if frame_idx in obj_output_dict["cond_frame_outputs"]:
+                continue
+            obj_output_dict["non_cond_frame_outputs"].pop(frame_idx, None)
+            inference_state["frames_tracked_per_obj"][obj_idx].pop(frame_idx, None)
 
     @torch.inference_mode()
     def clear_all_prompts_in_frame(
@@ -701,20 +1311,35 @@ class SAM2VideoPredictor(SAM2Base):
         for v in inference_state["frames_tracked_per_obj"].values():
             v.clear()
 
-    def _get_image_feature(self, inference_state, frame_idx, batch_size):
-        """Compute the image features on a given frame."""
+    def _get_image_feature(self, inference_state, frame_idx, batch_size, roi_box=None):
+        """
+        Compute the image features on a given frame, or on its `roi_box` crop (in ROI
+        tracking, see `init_state`).
+        """
+        cache_key = frame_idx if roi_box is None else (frame_idx, roi_box)
         # Look up in the cache first
         image, backbone_out = inference_state["cached_features"].get(
-            frame_idx, (None, None)
+            cache_key, (None, None)
         )
+        cache_stats = inference_state.get("feature_cache_stats")
+        if cache_stats is not None:
+            cache_stats["miss" if backbone_out is None else "hit"] += 1
         if backbone_out is None:
             # Cache miss -- we will run inference on a single image
             device = inference_state["device"]
-            image = inference_state["images"][frame_idx].to(device).float().unsqueeze(0)
-            backbone_out = self.forward_image(image)
+            if roi_box is None:
+                image = inference_state["images"][frame_idx]
+            else:
+                frame_paths = inference_state["roi_tracking"]["frame_paths"]
+                image, _, _ = load_video_frame(
+                    frame_paths[frame_idx], self.image_size, crop_box=roi_box
+                )
+            image = image.to(device).float().unsqueeze(0)
+            with profile_stage("forward_image", frame_idx):
+                backbone_out = self.forward_image(image)
             # Cache the most recent frame's feature (for repeated interactions with
             # a frame; we can use an LRU cache for more frames in the future).
-            inference_state["cached_features"] = {frame_idx: (image, backbone_out)}
+            inference_state["cached_features"] = {cache_key: (image, backbone_out)}
 
         # expand the features to have the same dimension as the number of objects
         expanded_image = image.expand(batch_size, -1, -1, -1)
@@ -746,8 +1371,12 @@ class SAM2VideoPredictor(SAM2Base):
         reverse,
         run_mem_encoder,
         prev_sam_mask_logits=None,
+        roi_box=None,
     ):
-        """Run tracking on a single frame based on current inputs and previous memory."""
+        """
+        Run tracking on a single frame based on current inputs and previous memory
+        (on the `roi_box` crop of the frame if set, see `init_state`).
+        """
         # Retrieve correct image features
         (
             _,
@@ -755,30 +1384,31 @@ class SAM2VideoPredictor(SAM2Base):
             current_vision_feats,
             current_vision_pos_embeds,
             feat_sizes,
-        ) = self._get_image_feature(inference_state, frame_idx, batch_size)
+        ) = self._get_image_feature(inference_state, frame_idx, batch_size, roi_box)
 
         # point and mask should not appear as input simultaneously on the same frame
         assert point_inputs is None or mask_inputs is None
-        current_out = self.track_step(
-            frame_idx=frame_idx,
-            is_init_cond_frame=is_init_cond_frame,
-            current_vision_feats=current_vision_feats,
-            current_vision_pos_embeds=current_vision_pos_embeds,
-            feat_sizes=feat_sizes,
-            point_inputs=point_inputs,
-            mask_inputs=mask_inputs,
-            output_dict=output_dict,
-            num_frames=inference_state["num_frames"],
-            track_in_reverse=reverse,
-            run_mem_encoder=run_mem_encoder,
-            prev_sam_mask_logits=prev_sam_mask_logits,
-        )
+        with profile_stage("track_step", frame_idx):
+            current_out = self.track_step(
+                frame_idx=frame_idx,
+                is_init_cond_frame=is_init_cond_frame,
+                current_vision_feats=current_vision_feats,
+                current_vision_pos_embeds=current_vision_pos_embeds,
+                feat_sizes=feat_sizes,
+                point_inputs=point_inputs,
+                mask_inputs=mask_inputs,
+                output_dict=output_dict,
+                num_frames=inference_state["num_frames"],
+                track_in_reverse=reverse,
+                run_mem_encoder=run_mem_encoder,
+                prev_sam_mask_logits=prev_sam_mask_logits,
+            )
 
         # optionally offload the output to CPU memory to save GPU space
         storage_device = inference_state["storage_device"]
         maskmem_features = current_out["maskmem_features"]
         if maskmem_features is not None:
-            maskmem_features = maskmem_features.to(torch.bfloat16)
+            maskmem_features = maskmem_features.to(self.maskmem_dtype)
             maskmem_features = maskmem_features.to(storage_device, non_blocking=True)
         pred_masks_gpu = current_out["pred_masks"]
         # potentially fill holes in the predicted masks
@@ -800,6 +1430,9 @@ class SAM2VideoPredictor(SAM2Base):
             "obj_ptr": obj_ptr,
             "object_score_logits": object_score_logits,
         }
+        if roi_box is not None:
+            # the masks are predicted in this crop of the frame
+            compact_current_out["roi_box"] = roi_box
         return compact_current_out, pred_masks_gpu
 
     def _run_memory_encoder(
@@ -810,27 +1443,30 @@ class SAM2VideoPredictor(SAM2Base):
         high_res_masks,
         object_score_logits,
         is_mask_from_pts,
+        roi_box=None,
     ):
         """
         Run the memory encoder on `high_res_masks`. This is usually after applying
         non-overlapping constraints to object scores. Since their scores changed, their
-        memory also need to be computed again with the memory encoder.
+        memory also need to be computed again with the memory encoder. With `roi_box`,
+        the masks are in this crop of the frame (see `init_state`).
         """
         # Retrieve correct image features
         _, _, current_vision_feats, _, feat_sizes = self._get_image_feature(
-            inference_state, frame_idx, batch_size
-        )
-        maskmem_features, maskmem_pos_enc = self._encode_new_memory(
-            current_vision_feats=current_vision_feats,
-            feat_sizes=feat_sizes,
-            pred_masks_high_res=high_res_masks,
-            object_score_logits=object_score_logits,
-            is_mask_from_pts=is_mask_from_pts,
+            inference_state, frame_idx, batch_size, roi_box
         )
+        with profile_stage("encode_new_memory", frame_idx):
+            maskmem_features, maskmem_pos_enc = self._encode_new_memory(
+                current_vision_feats=current_vision_feats,
+                feat_sizes=feat_sizes,
+                pred_masks_high_res=high_res_masks,
+                object_score_logits=object_score_logits,
+                is_mask_from_pts=is_mask_from_pts,
+            )
 
         # optionally offload the output to CPU memory to save GPU space
         storage_device = inference_state["storage_device"]
-        maskmem_features = maskmem_features.to(torch.bfloat16)
+        maskmem_features = maskmem_features.to(self.maskmem_dtype)
         maskmem_features = maskmem_features.to(storage_device, non_blocking=True)
         # "maskmem_pos_enc" is the same across frames, so we only need to store one copy of it
         maskmem_pos_enc = self._get_maskmem_pos_enc(
@@ -973,6 +1609,17 @@ class SAM2VideoPredictor(SAM2Base):
                 non_cond_frame_outputs.pop(t, None)
 
 
+def _shift_masks(masks, shift):
+    """Shift [B, 1, H, W] mask scores by a (x, y) shift in pixels (bilinearly)."""
+    H, W = masks.shape[-2:]
+    theta = torch.zeros(1, 2, 3, dtype=masks.dtype, device=masks.device)
+    theta[0, 0, 0] = theta[0, 1, 1] = 1.0
+    theta[0, 0, 2] = -2 * shift[0] / W
+    theta[0, 1, 2] = -2 * shift[1] / H
+    grid = F.affine_grid(theta.expand(masks.size(0), -1, -1), masks.shape, False)
+    return F.grid_sample(masks, grid, padding_mode="border", align_corners=False)
+
+
 class SAM2VideoPredictorVOS(SAM2VideoPredictor):
     """Optimized for the VOS setting"""
 
@@ -981,7 +1628,11 @@ class SAM2VideoPredictorVOS(SAM2VideoPredictor):
         self._compile_all_components()
 
     def _compile_all_components(self):
-        print("Compiling all components for VOS setting. First time may be very slow.")
+        print(
+            "Compiling all components for VOS setting. First time may be very slow "
+            "(unless the compilation caches are prebuilt, see "
+            "tools/build_compile_cache.py)."
+        )
         self.memory_encoder.forward = torch.compile(
             self.memory_encoder.forward,
             mode="max-autotune",
@@ -1048,8 +1699,7 @@ class SAM2VideoPredictorVOS(SAM2VideoPredictor):
         B = backbone_features.size(0)
         device = backbone_features.device
         assert backbone_features.size(1) == self.sam_prompt_embed_dim
-        assert backbone_features.size(2) == self.sam_image_embedding_size
-        assert backbone_features.size(3) == self.sam_image_embedding_size
+        assert backbone_features.shape[2:] == self.sam_image_embedding_hw
 
         # a) Handle point prompts
         if point_inputs is not None:
@@ -1128,7 +1778,7 @@ class SAM2VideoPredictorVOS(SAM2VideoPredictor):
         low_res_multimasks = low_res_multimasks.float()
         high_res_multimasks = F.interpolate(
             low_res_multimasks,
-            size=(self.image_size, self.image_size),
+            size=self.image_hw,
             mode="bilinear",
             align_corners=False,
         )
@@ -235,7 +235,9 @@ class SAM2VideoPredictor(SAM2Base):
             video_W = inference_state["video_width"]
             points = points / torch.tensor([video_W, video_H]).to(points.device)
         # scale the (normalized) coordinates by the model's internal image size
-        points = points * self.image_size
+        points = points * torch.tensor(
+            [self.image_hw[1], self.image_hw[0]], device=points.device
+        )
         points = points.to(inference_state["device"])
         labels = labels.to(inference_state["device"])
 
@@ -338,10 +340,10 @@ class SAM2VideoPredictor(SAM2Base):
         mask_inputs_orig = mask_inputs_orig.float().to(inference_state["device"])
 
         # resize the mask if it doesn't match the model's image size
-        if mask_H != self.image_size or mask_W != self.image_size:
+        if (mask_H, mask_W) != self.image_hw:
             mask_inputs = torch.nn.functional.interpolate(
                 mask_inputs_orig,
-                size=(self.image_size, self.image_size),
+                size=self.image_hw,
                 align_corners=False,
                 mode="bilinear",
                 antialias=True,  # use antialias for downsampling
@@ -450,7 +452,8 @@ class SAM2VideoPredictor(SAM2Base):
             consolidated_W = inference_state["video_width"]
             consolidated_mask_key = "pred_masks_video_res"
         else:
-            consolidated_H = consolidated_W = self.image_size // 4
+            consolidated_H = self.image_hw[0] // 4
+            consolidated_W = self.image_hw[1] // 4
             consolidated_mask_key = "pred_masks"
 
         # Initialize `consolidated_out`. Its "maskmem_features" and "maskmem_pos_enc"
@@ -534,7 +537,7 @@ class SAM2VideoPredictor(SAM2Base):
             device = inference_state["device"]
             high_res_masks = torch.nn.functional.interpolate(
                 consolidated_out["pred_masks"].to(device, non_blocking=True),
-                size=(self.image_size, self.image_size),
+                size=self.image_hw,
                 mode="bilinear",
                 align_corners=False,
             )
@@ -558,7 +561,7 @@ class SAM2VideoPredictor(SAM2Base):
         # A dummy (empty) mask with a single object
         batch_size = 1
         mask_inputs = torch.zeros(
-            (batch_size, 1, self.image_size, self.image_size),
+            (batch_size, 1, *self.image_hw),
             dtype=torch.float32,
             device=inference_state["device"],
         )
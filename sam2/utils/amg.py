@@ -5,9 +5,10 @@
 # LICENSE file in the root directory of this source tree.
 
 import math
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from itertools import product
-from typing import Any, Dict, Generator, ItemsView, List, Tuple
+from typing import Any, Dict, Generator, ItemsView, List, Optional, Tuple
 
 import numpy as np
 import torch
@@ -78,14 +79,28 @@ class MaskData:
 
 
 def is_box_near_crop_edge(
-    boxes: torch.Tensor, crop_box: List[int], orig_box: List[int], atol: float = 20.0
+    boxes: torch.Tensor,
+    crop_box: List[int],
+    orig_box: List[int],
+    atol: float = 20.0,
+    box_error: float = 0.0,
 ) -> torch.Tensor:
-    """Filter masks at the edge of a crop, but not at the edge of the original image."""
+    """
+    Filter masks at the edge of a crop, but not at the edge of the original image.
+    If the boxes are approximate, with coordinates off by up to `box_error`, only
+    the boxes that are at the edge of the crop for any such error are returned.
+    """
+    if atol < box_error:
+        return torch.zeros(boxes.shape[0], dtype=torch.bool, device=boxes.device)
     crop_box_torch = torch.as_tensor(crop_box, dtype=torch.float, device=boxes.device)
     orig_box_torch = torch.as_tensor(orig_box, dtype=torch.float, device=boxes.device)
     boxes = uncrop_boxes_xyxy(boxes, crop_box).float()
-    near_crop_edge = torch.isclose(boxes, crop_box_torch[None, :], atol=atol, rtol=0)
-    near_image_edge = torch.isclose(boxes, orig_box_torch[None, :], atol=atol, rtol=0)
+    near_crop_edge = torch.isclose(
+        boxes, crop_box_torch[None, :], atol=atol - box_error, rtol=0
+    )
+    near_image_edge = torch.isclose(
+        boxes, orig_box_torch[None, :], atol=atol + box_error, rtol=0
+    )
     near_crop_edge = torch.logical_and(near_crop_edge, ~near_image_edge)
     return torch.any(near_crop_edge, dim=1)
 
@@ -137,6 +152,34 @@ def mask_to_rle_pytorch(tensor: torch.Tensor) -> List[Dict[str, Any]]:
     return out
 
 
+def cropped_mask_to_rle_pytorch(
+    masks: List[torch.Tensor], mask_boxes: torch.Tensor, h: int, w: int
+) -> List[Dict[str, Any]]:
+    """
+    Encodes cropped masks (as returned by `SAM2Transforms.postprocess_masks_cropped`
+    after thresholding) to the same uncompressed RLE as `mask_to_rle_pytorch` on
+    the full HxW masks, without materializing them. `mask_boxes` holds the XYXY
+    box (with exclusive end) of each crop in the HxW frame.
+    """
+    out = []
+    for mask, (x0, y0, x1, y1) in zip(masks, mask_boxes.tolist()):
+        if x1 <= x0 or y1 <= y0:
+            out.append({"size": [h, w], "counts": [h * w]})
+            continue
+        # In fortran order, the full mask is the crop padded to full height,
+        # preceded by x0 and followed by w - x1 columns of zeros
+        padded = torch.zeros((h, x1 - x0), dtype=torch.bool, device=mask.device)
+        padded[y0:y1] = mask
+        counts = mask_to_rle_pytorch(padded[None])[0]["counts"]
+        counts[0] += x0 * h
+        if len(counts) % 2 == 1:
+            counts[-1] += (w - x1) * h  # ends with a run of zeros
+        elif x1 < w:
+            counts.append((w - x1) * h)
+        out.append({"size": [h, w], "counts": counts})
+    return out
+
+
 def rle_to_mask(rle: Dict[str, Any]) -> np.ndarray:
     """Compute a binary mask from an uncompressed RLE."""
     h, w = rle["size"]
@@ -155,6 +198,53 @@ def area_from_rle(rle: Dict[str, Any]) -> int:
     return sum(rle["counts"][1::2])
 
 
+def _rle_foreground_runs(rle: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+    # Start and (exclusive) end of the non-empty runs of ones, in fortran order
+    counts = np.asarray(rle["counts"], dtype=np.int64)
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    starts, ends = starts[1::2], ends[1::2]
+    nonempty = ends > starts
+    return starts[nonempty], ends[nonempty]
+
+
+def box_from_rle(rle: Dict[str, Any]) -> List[int]:
+    """
+    Calculates the box in XYXY format around a mask given as an uncompressed RLE,
+    as `batched_mask_to_box` does. Returns [0,0,0,0] for an empty mask.
+    """
+    h, _ = rle["size"]
+    starts, ends = _rle_foreground_runs(rle)
+    if starts.size == 0:
+        return [0, 0, 0, 0]
+    last = ends - 1
+    # A run spanning several columns covers both the first and the last rows
+    same_column = starts // h == last // h
+    x0, x1 = int(starts[0] // h), int(last[-1] // h)
+    y0 = int(np.where(same_column, starts % h, 0).min())
+    y1 = int(np.where(same_column, last % h, h - 1).max())
+    return [x0, y0, x1, y1]
+
+
+def rle_to_cropped_mask(rle: Dict[str, Any], crop_box: List[int]) -> np.ndarray:
+    """
+    Compute the crop of a binary mask given as an uncompressed RLE, without decoding
+    the full mask. `crop_box` is in XYXY format (with exclusive end).
+    """
+    h, _ = rle["size"]
+    x0, y0, x1, y1 = crop_box
+    starts, ends = _rle_foreground_runs(rle)
+    # Only decode the columns of the crop (in fortran order)
+    lo, hi = x0 * h, x1 * h
+    starts = np.clip(starts, lo, hi) - lo
+    ends = np.clip(ends, lo, hi) - lo
+    delta = np.zeros(hi - lo + 1, dtype=np.int32)
+    np.add.at(delta, starts, 1)
+    np.add.at(delta, ends, -1)
+    columns = np.cumsum(delta[:-1]).reshape(x1 - x0, h) > 0
+    return np.ascontiguousarray(columns[:, y0:y1].transpose())
+
+
 def calculate_stability_score(
     masks: torch.Tensor, mask_threshold: float, threshold_offset: float
 ) -> torch.Tensor:
@@ -267,11 +357,18 @@ def uncrop_masks(
 
 
 def remove_small_regions(
-    mask: np.ndarray, area_thresh: float, mode: str
+    mask: np.ndarray,
+    area_thresh: float,
+    mode: str,
+    outside: Optional[np.ndarray] = None,
 ) -> Tuple[np.ndarray, bool]:
     """
     Removes small disconnected regions and holes in a mask. Returns the
     mask and an indicator of if the mask has been modified.
+
+    If the mask is a crop of a larger mask, `outside` can mark the (background)
+    pixels of the crop that are connected to the rest of the frame, so that the
+    background regions containing them are not treated as holes.
     """
     import cv2  # type: ignore
 
@@ -280,7 +377,11 @@ def remove_small_regions(
     working_mask = (correct_holes ^ mask).astype(np.uint8)
     n_labels, regions, stats, _ = cv2.connectedComponentsWithStats(working_mask, 8)
     sizes = stats[:, -1][1:]  # Row 0 is background label
-    small_regions = [i + 1 for i, s in enumerate(sizes) if s < area_thresh]
+    is_small = sizes < area_thresh
+    if correct_holes and outside is not None:
+        outside_labels = np.unique(regions[outside])
+        is_small[outside_labels[outside_labels > 0] - 1] = False
+    small_regions = [i + 1 for i, small in enumerate(is_small) if small]
     if len(small_regions) == 0:
         return mask, False
     fill_labels = [0] + small_regions
@@ -293,6 +394,164 @@ def remove_small_regions(
     return mask, True
 
 
+def get_small_regions_crop(
+    box: List[int], h: int, w: int, area_thresh: float
+) -> Tuple[List[int], Optional[np.ndarray]]:
+    """
+    Returns the crop (in XYXY format with exclusive end) of a HxW mask with box
+    `box` (in XYXY format, as returned by `batched_mask_to_box`) on which
+    `remove_small_regions` gives the same result as on the full mask, and the
+    `outside` pixels of the crop to pass to it (or None).
+
+    The crop is the box with a margin of one background pixel on the sides that
+    don't touch the border of the frame. These pixels are connected to the
+    background outside of the box, so they can't be in a hole, unless the
+    background outside of the box has a part smaller than `area_thresh`, in which
+    case the full mask is used.
+    """
+    x0, y0, x1, y1 = box
+    box_h, box_w = y1 - y0 + 1, x1 - x0 + 1
+    outside_areas = [y0 * w, (h - 1 - y1) * w, x0 * box_h, (w - 1 - x1) * box_h]
+    if any(0 < area < area_thresh for area in outside_areas):
+        return [0, 0, w, h], None
+    crop_box = [max(x0 - 1, 0), max(y0 - 1, 0), min(x1 + 2, w), min(y1 + 2, h)]
+    crop_x0, crop_y0, crop_x1, crop_y1 = crop_box
+    outside = np.ones((crop_y1 - crop_y0, crop_x1 - crop_x0), dtype=bool)
+    outside[y0 - crop_y0 : y1 + 1 - crop_y0, x0 - crop_x0 : x1 + 1 - crop_x0] = False
+    return crop_box, outside
+
+
+def _remove_small_holes_and_islands(
+    mask: np.ndarray, area_thresh: float, outside: Optional[np.ndarray]
+) -> Tuple[np.ndarray, bool]:
+    if mask.size == 0:
+        return mask, False
+    mask, changed = remove_small_regions(mask, area_thresh, "holes", outside)
+    unchanged = not changed
+    mask, changed = remove_small_regions(mask, area_thresh, "islands")
+    unchanged = unchanged and not changed
+    return mask, not unchanged
+
+
+def _remove_small_holes_and_islands_on_device(
+    masks: List[np.ndarray],
+    area_thresh: float,
+    outsides: List[Optional[np.ndarray]],
+    device: torch.device,
+) -> Tuple[List[np.ndarray], List[bool]]:
+    from sam2.utils.misc import get_connected_components
+
+    # Pad the masks to the same size, the padding is neither foreground nor background
+    n = len(masks)
+    max_h = max(mask.shape[0] for mask in masks)
+    max_w = max(mask.shape[1] for mask in masks)
+    batch = torch.zeros(n, max_h, max_w, dtype=torch.bool)
+    valid = torch.zeros(n, max_h, max_w, dtype=torch.bool)
+    outside = torch.zeros(n, max_h, max_w, dtype=torch.bool)
+    for i, (mask, mask_outside) in enumerate(zip(masks, outsides)):
+        h, w = mask.shape
+        batch[i, :h, :w] = torch.from_numpy(mask)
+        valid[i, :h, :w] = True
+        if mask_outside is not None:
+            outside[i, :h, :w] = torch.from_numpy(mask_outside)
+    batch, valid, outside = batch.to(device), valid.to(device), outside.to(device)
+    # Offset the labels of each mask to make them unique across the batch
+    label_offsets = torch.arange(n, device=device)[:, None, None] * (max_h * max_w + 1)
+
+    # Fill small holes, except those connected to the outside of the crop
+    working = valid & ~batch
+    labels, counts = get_connected_components(working[:, None])
+    labels = labels[:, 0].long() + label_offsets
+    is_outside = torch.isin(labels, labels[outside & working])
+    is_hole = working & (counts[:, 0] < area_thresh) & ~is_outside
+    batch = batch | is_hole
+    changed = is_hole.flatten(1).any(dim=1)
+
+    # Remove small islands. If every island is below threshold, keep the largest
+    # (the first one in raster order in case of ties, as `remove_small_regions`)
+    working = batch
+    labels, counts = get_connected_components(working[:, None])
+    labels, counts = labels[:, 0].long() + label_offsets, counts[:, 0]
+    counts = torch.where(working, counts, torch.zeros_like(counts))
+    max_counts = counts.flatten(1).amax(dim=1)
+    is_largest = working & (counts == max_counts[:, None, None])
+    first_largest = is_largest.flatten(1).int().argmax(dim=1, keepdim=True)
+    largest_labels = labels.flatten(1).gather(1, first_largest)
+    is_removed = torch.where(
+        (max_counts < area_thresh)[:, None, None],
+        working & (labels != largest_labels[:, :, None]),
+        working & (counts < area_thresh),
+    )
+    batch = batch & ~is_removed
+    # As `remove_small_regions`, a mask with a small island is reported as changed
+    # even if it's kept as the largest one
+    is_small = working & (counts < area_thresh)
+    changed = changed | is_small.flatten(1).any(dim=1)
+
+    batch = batch.cpu().numpy()
+    out_masks = [
+        batch[i, : mask.shape[0], : mask.shape[1]] for i, mask in enumerate(masks)
+    ]
+    return out_masks, changed.cpu().tolist()
+
+
+def remove_small_regions_batched(
+    masks: List[np.ndarray],
+    area_thresh: float,
+    outsides: Optional[List[Optional[np.ndarray]]] = None,
+    device: Optional[torch.device] = None,
+    num_workers: Optional[int] = None,
+    batch_size: int = 32,
+) -> Tuple[List[np.ndarray], List[bool]]:
+    """
+    Removes small holes and then small disconnected regions in a list of masks
+    (of possibly different sizes), as `remove_small_regions` does. Returns the
+    masks and whether each mask has been modified. `outsides` can give the
+    `outside` pixels of each mask for masks that are crops of larger masks.
+
+    If `device` is a CUDA device and the `sam2._C` extension is available, the
+    masks are processed on the device in batches of `batch_size` masks of
+    similar size. Otherwise, they are processed with opencv in a thread pool of
+    `num_workers` threads.
+    """
+    if outsides is None:
+        outsides = [None] * len(masks)
+    if device is not None and torch.device(device).type == "cuda":
+        try:
+            from sam2 import _C  # type: ignore  # noqa: F401
+
+            use_device = True
+        except ImportError:
+            use_device = False
+    else:
+        use_device = False
+
+    if not use_device:
+        with ThreadPoolExecutor(num_workers) as executor:
+            results = list(
+                executor.map(
+                    _remove_small_holes_and_islands,
+                    masks,
+                    [area_thresh] * len(masks),
+                    outsides,
+                )
+            )
+        return [mask for mask, _ in results], [changed for _, changed in results]
+
+    out_masks, out_changed = list(masks), [False] * len(masks)
+    # Batch masks of similar sizes together to limit padding
+    order = sorted(
+        (i for i in range(len(masks)) if masks[i].size > 0), key=lambda i: masks[i].size
+    )
+    for (idxs,) in batch_iterator(batch_size, order):
+        batch_masks, batch_changed = _remove_small_holes_and_islands_on_device(
+            [masks[i] for i in idxs], area_thresh, [outsides[i] for i in idxs], device
+        )
+        for i, mask, changed in zip(idxs, batch_masks, batch_changed):
+            out_masks[i], out_changed[i] = mask, changed
+    return out_masks, out_changed
+
+
 def coco_encode_rle(uncompressed_rle: Dict[str, Any]) -> Dict[str, Any]:
     from pycocotools import mask as mask_utils  # type: ignore
 
@@ -346,3 +605,21 @@ def batched_mask_to_box(masks: torch.Tensor) -> torch.Tensor:
         out = out[0]
 
     return out
+
+
+def batched_cropped_mask_to_box(
+    masks: List[torch.Tensor], mask_boxes: torch.Tensor
+) -> torch.Tensor:
+    """
+    Same as `batched_mask_to_box` for cropped masks, given the XYXY box of each
+    crop in the full frame. Returns boxes in XYXY format in the full frame, and
+    [0,0,0,0] for an empty mask.
+    """
+    if len(masks) == 0:
+        return torch.zeros(0, 4, dtype=mask_boxes.dtype, device=mask_boxes.device)
+    boxes = torch.stack(
+        [batched_mask_to_box(mask).to(mask_boxes.dtype) for mask in masks], dim=0
+    )
+    is_empty = torch.stack([~mask.any() for mask in masks], dim=0)
+    offsets = mask_boxes[:, [0, 1, 0, 1]].to(boxes.device)
+    return boxes + offsets * (~is_empty).unsqueeze(-1)
@@ -0,0 +1,103 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import hashlib
+import json
+import logging
+import os
+import time
+import warnings
+
+import torch
+
+
+def _has_cache_artifacts():
+    # the portable caches of torch.compile were added in PyTorch 2.7
+    return hasattr(torch.compiler, "save_cache_artifacts")
+
+
+def get_compile_cache_metadata(model, dtype=None):
+    """
+    The properties of a model and of its environment that its compiled code depends
+    on: its architecture (the repr of its modules), input resolution and tracking
+    dtype (by default, the dtype of its memory features, i.e. its autocast dtype),
+    and the versions of PyTorch and Triton and the GPU.
+    """
+    if dtype is None:
+        dtype = getattr(model, "maskmem_dtype", torch.float32)
+    metadata = {
+        "model": type(model).__name__,
+        "architecture": hashlib.sha256(repr(model).encode()).hexdigest(),
+        "image_hw": list(model.image_hw),
+        "dtype": str(dtype),
+        "torch": torch.__version__,
+    }
+    try:
+        import triton
+
+        metadata["triton"] = triton.__version__
+    except ImportError:
+        pass
+    if torch.cuda.is_available():
+        metadata["gpu"] = torch.cuda.get_device_name()
+        metadata["gpu_capability"] = list(torch.cuda.get_device_capability())
+    return metadata
+
+
+def get_compile_cache_path(model, cache_dir, dtype=None):
+    """The path of the compilation caches of a model (see above) in `cache_dir`."""
+    metadata = get_compile_cache_metadata(model, dtype)
+    key = hashlib.sha256(json.dumps(metadata, sort_keys=True).encode()).hexdigest()
+    return os.path.join(cache_dir, f"{metadata['model']}_{key[:16]}.bin")
+
+
+def save_compile_cache(model, cache_dir, dtype=None):
+    """
+    Save the caches of the code compiled by `torch.compile` in this process (the
+    Inductor kernels and FX graphs, and the autotuning results of "max-autotune")
+    to `cache_dir`, keyed by the model and environment (see
+    `get_compile_cache_metadata`). The model should have run on all the input
+    shapes to compile for (e.g. on a video with more frames than its number of
+    memories). Returns the path of the saved caches.
+    """
+    if not _has_cache_artifacts():
+        raise RuntimeError("Saving compilation caches requires PyTorch 2.7 or later")
+    artifacts = torch.compiler.save_cache_artifacts()
+    if artifacts is None:
+        raise RuntimeError("No compiled code to save, run the compiled model first")
+    os.makedirs(cache_dir, exist_ok=True)
+    path = get_compile_cache_path(model, cache_dir, dtype)
+    # write atomically, since worker processes may be loading it
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(artifacts[0])
+    os.replace(tmp_path, path)
+    metadata = get_compile_cache_metadata(model, dtype)
+    metadata["created"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    with open(os.path.splitext(path)[0] + ".json", "w") as f:
+        json.dump(metadata, f, indent=2)
+    return path
+
+
+def load_compile_cache(model, cache_dir, dtype=None):
+    """
+    Load the compilation caches of a model saved by `save_compile_cache` (before
+    running the compiled model), so that `torch.compile` reuses the compiled code
+    and autotuning results instead of compiling from scratch. Since the Inductor
+    caches are keyed by the content of the graphs, stale caches only make the
+    compilation slower, never the results wrong. Returns whether they were found.
+    """
+    path = get_compile_cache_path(model, cache_dir, dtype)
+    if not os.path.exists(path):
+        logging.info(f"No compilation caches for this model and setup in {cache_dir}")
+        return False
+    if not _has_cache_artifacts():
+        warnings.warn("Loading compilation caches requires PyTorch 2.7 or later")
+        return False
+    with open(path, "rb") as f:
+        torch.compiler.load_cache_artifacts(f.read())
+    logging.info(f"Loaded the compilation caches from {path}")
+    return True
@@ -0,0 +1,157 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import contextlib
+import logging
+import os
+
+import torch
+
+
+def has_native_bf16():
+    """
+    Whether the CPU computes in bfloat16 natively (with AVX512-BF16 or AMX), in which
+    case bfloat16 autocast is faster than float32 (otherwise, it is often slower).
+    """
+    # these checks are private in PyTorch, and missing in older versions
+    checks = ["_is_avx512_bf16_supported", "_is_amx_tile_supported"]
+    return any(getattr(torch.cpu, check, lambda: False)() for check in checks)
+
+
+def get_cpu_autocast_dtype(dtype="auto"):
+    """
+    Get the dtype to track in on CPU: bfloat16 (with autocast) if the CPU supports
+    it natively and float32 otherwise for "auto", or the given dtype.
+    """
+    if dtype == "auto":
+        return torch.bfloat16 if has_native_bf16() else torch.float32
+    if isinstance(dtype, str):
+        dtype = getattr(torch, dtype)
+    if dtype not in (torch.bfloat16, torch.float32):
+        raise ValueError(f"Unsupported CPU inference dtype {dtype}")
+    return dtype
+
+
+def cpu_autocast(dtype="auto"):
+    """The autocast context to track in on CPU with `dtype` (see above)."""
+    dtype = get_cpu_autocast_dtype(dtype)
+    if dtype == torch.float32:
+        return contextlib.nullcontext()
+    return torch.autocast("cpu", dtype=dtype)
+
+
+def _parse_cpu_list(cpu_list):
+    """Parse a Linux CPU list such as "0-3,8-11" into a set of CPU ids."""
+    cpus = set()
+    for part in cpu_list.strip().split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.update(range(int(start), int(end) + 1))
+        elif part:
+            cpus.add(int(part))
+    return cpus
+
+
+def get_numa_node_cpus(numa_node):
+    """Get the ids of the CPUs of a NUMA node (on Linux)."""
+    with open(f"/sys/devices/system/node/node{numa_node}/cpulist") as f:
+        return _parse_cpu_list(f.read())
+
+
+def get_physical_cpus(cpus):
+    """
+    Keep one CPU per physical core from a set of CPU ids (i.e. drop hyper-threading
+    siblings, which slow down intra-op parallel compute), if the topology is known.
+    """
+    physical_cpus, seen = set(), set()
+    for cpu in sorted(cpus):
+        path = f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list"
+        try:
+            with open(path) as f:
+                siblings = frozenset(_parse_cpu_list(f.read()))
+        except OSError:
+            return set(cpus)
+        if siblings not in seen:
+            seen.add(siblings)
+            physical_cpus.add(cpu)
+    return physical_cpus
+
+
+def get_num_cpu_cores():
+    """
+    The number of physical cores available to this process (i.e. in its CPU
+    affinity, if supported).
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(get_physical_cpus(os.sched_getaffinity(0)))
+    return torch.get_num_threads()
+
+
+def configure_cpu_threads(num_threads=None, numa_node=None):
+    """
+    Configure the intra-op threads for CPU inference: optionally pin the process to
+    the CPUs of a NUMA node (so that the weights and activations stay in its local
+    memory), and use one thread per physical core available to the process by
+    default. Returns the number of threads.
+    """
+    if numa_node is not None:
+        if not hasattr(os, "sched_setaffinity"):
+            raise RuntimeError("Setting a NUMA node is only supported on Linux")
+        os.sched_setaffinity(0, get_numa_node_cpus(numa_node))
+    if num_threads is None:
+        num_threads = get_num_cpu_cores()
+    torch.set_num_threads(num_threads)
+    try:
+        # the inference runs a single model, so inter-op parallelism only adds
+        # threads competing with the intra-op ones
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # can only be set once, before any inter-op parallel work
+    logging.info(f"CPU inference with {num_threads} threads")
+    return num_threads
+
+
+def optimize_for_cpu(
+    predictor, dtype="auto", compile=False, num_threads=None, numa_node=None
+):
+    """
+    Apply the CPU inference profile to a video predictor (on CPU):
+    - configure the threads (see `configure_cpu_threads`);
+    - store the memory features in float32 if tracking in float32 (they are stored
+      in bfloat16 by default, which requires autocast);
+    - use the channels-last memory format for the convolutions of the memory encoder,
+      the image encoder neck and the mask decoder (faster with oneDNN);
+    - optionally compile the image encoder and memory attention with inductor (with
+      the default mode rather than the "max-autotune" used on GPU, which mostly tunes
+      GPU kernels, and with weight freezing). Compilation pays off over long videos
+      on many-core CPUs, so check it with `python -m sam2.benchmark --cpu_optimized`.
+
+    The tracking should then be run in `cpu_autocast(dtype)`. Returns the tracking
+    dtype (see `get_cpu_autocast_dtype`).
+    """
+    if getattr(predictor, "quantization", None) is not None and dtype == "auto":
+        dtype = torch.float32  # the int8 layers of quantized models take float32
+    dtype = get_cpu_autocast_dtype(dtype)
+    configure_cpu_threads(num_threads, numa_node)
+    predictor.maskmem_dtype = dtype
+    for module in [
+        predictor.memory_encoder,
+        predictor.image_encoder.neck,
+        predictor.sam_mask_decoder,
+    ]:
+        module.to(memory_format=torch.channels_last)
+
+    if compile:
+        options = {"freezing": True}
+        predictor.image_encoder.forward = torch.compile(
+            predictor.image_encoder.forward, dynamic=False, options=options
+        )
+        predictor.memory_attention.forward = torch.compile(
+            predictor.memory_attention.forward,
+            dynamic=True,  # Num. of memories varies
+            options=options,
+        )
+    return dtype
@@ -0,0 +1,209 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+import torch
+
+
+def compute_image_hash(image, namespace=""):
+    """
+    Compute a content hash of an image (np.ndarray in HWC format or PIL Image),
+    combined with a namespace identifying the model and its resolution.
+    """
+    image_np = np.ascontiguousarray(np.asarray(image))
+    hasher = hashlib.blake2b(digest_size=20)
+    hasher.update(namespace.encode("utf-8"))
+    hasher.update(str((image_np.shape, image_np.dtype.str)).encode("utf-8"))
+    hasher.update(memoryview(image_np).cast("B"))
+    return hasher.hexdigest()
+
+
+@torch.no_grad()
+def compute_weights_fingerprint(model, num_samples=64):
+    """
+    Compute a short fingerprint of the weights of a model, from the names and shapes
+    of its parameters and `num_samples` evenly spaced values of each of them, so
+    that different checkpoints of the same architecture (e.g. fine-tunes) get
+    different fingerprints without hashing all the weights.
+    """
+    hasher = hashlib.blake2b(digest_size=8)
+    samples = []
+    for name, param in model.named_parameters():
+        hasher.update(f"{name}:{tuple(param.shape)}".encode("utf-8"))
+        flat = param.detach().flatten()
+        step = max(1, flat.numel() // num_samples)
+        samples.append(flat[::step][:num_samples].float())
+    if len(samples) > 0:
+        # (gathered in a single transfer from the device of the model)
+        samples_np = torch.cat(samples).cpu().numpy()
+        hasher.update(memoryview(np.ascontiguousarray(samples_np)).cast("B"))
+    return hasher.hexdigest()
+
+
+def _entry_nbytes(entry):
+    features = entry["features"]
+    tensors = [features["image_embed"]] + list(features["high_res_feats"])
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def _entry_to(entry, device):
+    features = entry["features"]
+    return {
+        "features": {
+            "image_embed": features["image_embed"].to(device),
+            "high_res_feats": [f.to(device) for f in features["high_res_feats"]],
+        },
+        "orig_hw": list(entry["orig_hw"]),
+    }
+
+
+class EmbeddingCache:
+    """
+    An LRU cache of image embeddings (the `_features` and `_orig_hw` of
+    SAM2ImagePredictor) keyed by image content hash, bounded by the total number of
+    bytes of the cached features.
+
+    If `cache_dir` is set, every cached embedding is also persisted to disk, and
+    embeddings evicted from memory (or computed by another process, e.g. an offline
+    batch job) are loaded back from disk on lookup.
+    """
+
+    def __init__(self, max_bytes=2 * 1024**3, cache_dir=None, storage_device=None):
+        """
+        Arguments:
+          max_bytes (int): The maximum total size of the embeddings kept in memory.
+          cache_dir (str or None): If set, a directory where embeddings are persisted.
+          storage_device (torch.device or None): The device to keep cached embeddings
+            on. If None, they are kept on the device they were computed on.
+        """
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.storage_device = storage_device
+        self._entries = OrderedDict()
+        self._num_bytes = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries or (
+            self.cache_dir is not None and os.path.exists(self._entry_path(key))
+        )
+
+    @property
+    def num_bytes(self):
+        return self._num_bytes
+
+    def get(self, key, device=None):
+        """
+        Look up the embedding of an image hash, returning a dict with "features"
+        and "orig_hw" (with the features moved to `device` if set), or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and self.cache_dir is not None:
+            entry = self._load_entry(key)
+            if entry is not None:
+                self._insert(key, entry)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return entry if device is None else _entry_to(entry, device)
+
+    def put(self, key, features, orig_hw):
+        """
+        Cache the features ({"image_embed": ..., "high_res_feats": [...]}) and the
+        original image size(s) of an image hash.
+        """
+        entry = {
+            "features": {
+                "image_embed": features["image_embed"].detach(),
+                "high_res_feats": [f.detach() for f in features["high_res_feats"]],
+            },
+            "orig_hw": list(orig_hw),
+        }
+        if self.storage_device is not None:
+            entry = _entry_to(entry, self.storage_device)
+        self._insert(key, entry)
+        if self.cache_dir is not None:
+            self._save_entry(key, entry)
+
+    def clear(self):
+        """Remove all embeddings from memory (persisted embeddings are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._num_bytes = 0
+
+    def export(self, path, keys=None):
+        """
+        Save the in-memory embeddings (or only those in `keys`) to a single file that
+        can be loaded into another cache with `import_from`.
+        """
+        with self._lock:
+            keys = list(self._entries) if keys is None else keys
+            entries = {k: _entry_to(self._entries[k], "cpu") for k in keys}
+        torch.save(entries, path)
+
+    def import_from(self, path):
+        """
+        Load embeddings saved with `export` into the cache, returning their keys.
+        """
+        entries = torch.load(path, map_location="cpu", weights_only=True)
+        for key, entry in entries.items():
+            self.put(key, entry["features"], entry["orig_hw"])
+        return list(entries)
+
+    def _insert(self, key, entry):
+        nbytes = _entry_nbytes(entry)
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self._num_bytes -= _entry_nbytes(old_entry)
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self._num_bytes += nbytes
+            # evict the least recently used embeddings
+            while self._num_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._num_bytes -= _entry_nbytes(evicted)
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pt")
+
+    def _save_entry(self, key, entry):
+        path = self._entry_path(key)
+        tmp_path = f"{path}.tmp"
+        torch.save(_entry_to(entry, "cpu"), tmp_path)
+        os.replace(tmp_path, path)
+
+    def _load_entry(self, key):
+        path = self._entry_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            entry = torch.load(path, map_location="cpu", weights_only=True)
+        except Exception as e:
+            logging.warning(f"Failed to load cached embedding {path}: {e}")
+            return None
+        if self.storage_device is not None:
+            entry = _entry_to(entry, self.storage_device)
+        return entry
@@ -0,0 +1,124 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import contextlib
+import hashlib
+import json
+import os
+import warnings
+
+import torch
+from omegaconf import OmegaConf
+from torch import nn
+from torch.overrides import TorchFunctionMode
+
+# resolved configs composed in this process, as YAML strings
+_config_cache = {}
+
+
+def _get_config_key(config_file, overrides):
+    import sam2
+
+    config_path = os.path.join(sam2.__path__[0], config_file)
+    if not config_path.endswith(".yaml"):
+        config_path += ".yaml"
+    if not os.path.isfile(config_path):
+        # not a config of the sam2 package (e.g. from another Hydra search path)
+        return None
+    with open(config_path, "rb") as f:
+        config_hash = hashlib.sha256(f.read()).hexdigest()
+    key = json.dumps([config_file, list(overrides), config_hash])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def load_config(config_file, overrides=(), cache_dir=None):
+    """
+    Compose a config of the sam2 package with Hydra overrides and resolve it. The
+    resolved configs are cached in this process and, if `cache_dir` is given, in
+    `cache_dir` (keyed by the config file, its content and the overrides), so that
+    new processes skip composing them with Hydra.
+    """
+    key = _get_config_key(config_file, overrides)
+    if key is not None and key in _config_cache:
+        return OmegaConf.create(_config_cache[key])
+    cache_path = None
+    if key is not None and cache_dir is not None:
+        cache_path = os.path.join(cache_dir, f"{key[:16]}.yaml")
+        if os.path.exists(cache_path):
+            cfg = OmegaConf.load(cache_path)
+            _config_cache[key] = OmegaConf.to_yaml(cfg)
+            return cfg
+
+    from hydra import compose
+    from sam2 import initialize_hydra
+
+    initialize_hydra()
+    cfg = compose(config_name=config_file, overrides=list(overrides))
+    OmegaConf.resolve(cfg)
+    if key is not None:
+        _config_cache[key] = OmegaConf.to_yaml(cfg)
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write atomically, since other processes may be loading it
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(_config_cache[key])
+        os.replace(tmp_path, cache_path)
+    return cfg
+
+
+class _SkipParameterInit(TorchFunctionMode):
+    def __torch_function__(self, func, types, args=(), kwargs=None):
+        kwargs = kwargs or {}
+        name = getattr(func, "__name__", "")
+        if name.endswith("_") and not name.endswith("__"):
+            # the `torch.nn.init` functions take the parameter as `tensor`
+            tensor = args[0] if args else kwargs.get("tensor")
+            if isinstance(tensor, nn.Parameter):
+                return tensor
+        return func(*args, **kwargs)
+
+
+@contextlib.contextmanager
+def empty_init():
+    """
+    Within this context, the in-place ops on parameters (i.e. their random or
+    constant initialization) are skipped, so that the parameters of the modules
+    being constructed stay empty (and not even paged in memory), to be replaced by
+    the weights of a checkpoint with `load_state_dict(..., assign=True)`. Everything
+    else (e.g. the buffers and rotary encodings) is created as usual.
+    """
+    with _SkipParameterInit():
+        yield
+
+
+def load_checkpoint_file(ckpt_path, device="cpu", mmap=True):
+    """
+    Load a checkpoint file saved with `torch.save` (as a dict with the state dict
+    under "model") or a safetensors file (of the state dict), with its tensors
+    directly on `device`. With `mmap`, the file is memory-mapped rather than read
+    into memory, so that the CPU tensors are backed by the (page cache of the) file.
+    """
+    ckpt_path = os.fspath(ckpt_path)
+    if ckpt_path.endswith(".safetensors"):
+        try:
+            from safetensors.torch import load_file
+        except ImportError as e:
+            raise ImportError(
+                "Loading .safetensors checkpoints requires the safetensors package "
+                "(`pip install safetensors`)"
+            ) from e
+        return {"model": load_file(ckpt_path, device=str(device))}
+    try:
+        return torch.load(ckpt_path, map_location=device, weights_only=True, mmap=mmap)
+    except RuntimeError as e:
+        if not mmap or "zipfile" not in str(e):
+            raise
+        # checkpoints saved in the legacy (non-zip) format of torch.save can't be
+        # memory-mapped
+        warnings.warn(f"Can't memory-map {ckpt_path}, loading it into memory: {e}")
+        return torch.load(ckpt_path, map_location=device, weights_only=True)
+
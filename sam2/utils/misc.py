@@ -4,8 +4,10 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
+import functools
 import os
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from threading import Thread
 
 import numpy as np
@@ -57,10 +59,148 @@ def get_connected_components(mask):
               for foreground pixels and 0 for background pixels.
     - counts: A tensor of shape (N, 1, H, W) containing the area of the connected
               components for foreground pixels and 0 for background pixels.
+
+    CUDA tensors are processed with the CUDA kernel of the `sam2._C` extension if it
+    is available, and other inputs with OpenCV if it is installed. The slower
+    `get_connected_components_union_find` is only used as a last resort (e.g. on
+    CUDA tensors without the extension, or without OpenCV).
     """
-    from sam2 import _C
+    if mask.is_cuda:
+        if _has_connected_components_kernel():
+            from sam2 import _C
+
+            return _C.get_connected_componnets(mask.to(torch.uint8).contiguous())
+    elif _has_cv2():
+        return _get_connected_components_cv2(mask)
+    return get_connected_components_union_find(mask)
+
+
+@functools.lru_cache(maxsize=None)
+def _has_connected_components_kernel():
+    # (cached, since a failed import of the extension is retried on each call)
+    try:
+        from sam2 import _C  # noqa: F401
+
+        return True
+    except ImportError:
+        return False
 
-    return _C.get_connected_componnets(mask.to(torch.uint8).contiguous())
+
+@functools.lru_cache(maxsize=None)
+def _has_cv2():
+    try:
+        import cv2  # noqa: F401
+
+        return True
+    except ImportError:
+        return False
+
+
+def _get_connected_components_cv2(mask):
+    import cv2
+
+    mask_np = mask.to(torch.uint8).cpu().numpy()
+    labels = np.zeros(mask_np.shape, dtype=np.int32)
+    counts = np.zeros(mask_np.shape, dtype=np.int32)
+    for i in range(mask_np.shape[0]):
+        _, labels[i, 0], stats, _ = cv2.connectedComponentsWithStats(
+            mask_np[i, 0], connectivity=8
+        )
+        areas = stats[:, cv2.CC_STAT_AREA]
+        areas[0] = 0  # the background
+        counts[i, 0] = areas[labels[i, 0]]
+    labels = torch.from_numpy(labels).to(mask.device)
+    counts = torch.from_numpy(counts).to(mask.device)
+    return labels, counts
+
+
+def get_connected_components_union_find(mask, num_workers=None):
+    """
+    Same as `get_connected_components`, implemented with vectorized tensor ops on
+    the device of `mask` (typically the CPU), without the `sam2._C` extension.
+
+    The horizontal runs of foreground pixels of the masks are the nodes of a graph,
+    with an edge between each pair of 8-connected runs in consecutive rows (any such
+    pair is connected through the first pixel of one of the two runs). Each round
+    hooks the larger root of every edge joining two different components onto the
+    smaller one, then compresses the paths to the roots by pointer jumping, until
+    no edge joins two components.
+
+    On the CPU, the batch is split across `num_workers` threads (by default, the
+    number of threads used by torch).
+    """
+    n = mask.shape[0]
+    if num_workers is None:
+        num_workers = torch.get_num_threads() if mask.device.type == "cpu" else 1
+    num_workers = max(min(num_workers, n), 1)
+    if num_workers == 1:
+        return _get_connected_components_union_find(mask)
+
+    chunks = torch.chunk(mask, num_workers, dim=0)
+    with ThreadPoolExecutor(num_workers) as executor:
+        results = list(executor.map(_get_connected_components_union_find, chunks))
+    # Offset the labels of each chunk to keep them unique across the batch
+    labels, counts, offset = [], [], 0
+    for chunk, (chunk_labels, chunk_counts) in zip(chunks, results):
+        labels.append(torch.where(chunk_labels > 0, chunk_labels + offset, 0))
+        counts.append(chunk_counts)
+        offset += chunk.numel()
+    return torch.cat(labels, dim=0), torch.cat(counts, dim=0)
+
+
+def _get_connected_components_union_find(mask):
+    n, _, h, w = mask.shape
+    fg = mask.reshape(n, h, w).bool()
+    no_pixel = torch.zeros_like(fg[:, :, :1])
+    is_run_start = (fg & ~torch.cat([no_pixel, fg[:, :, :-1]], dim=2)).flatten()
+    fg = fg.flatten()
+    # 1-based run ids of the foreground pixels (0 for the background)
+    run_ids = torch.cumsum(is_run_start, dim=0) * fg
+
+    # Edges from the first pixel of each run to the runs of its neighbors in the
+    # next and previous rows
+    starts = torch.nonzero(is_run_start).squeeze(1)
+    num_runs = starts.numel()
+    start_ids = torch.arange(1, num_runs + 1, device=mask.device)
+    start_x, start_y = starts % w, (starts // w) % h
+    src, dst = [], []
+    for dy, valid_y in ((1, start_y < h - 1), (-1, start_y > 0)):
+        for dx, valid_x in ((-1, start_x > 0), (0, None), (1, start_x < w - 1)):
+            valid = valid_y if valid_x is None else valid_y & valid_x
+            neighbor_ids = run_ids[starts[valid] + dy * w + dx]
+            is_edge = neighbor_ids > 0
+            src.append(start_ids[valid][is_edge])
+            dst.append(neighbor_ids[is_edge])
+    src, dst = torch.cat(src), torch.cat(dst)
+
+    parent = torch.arange(num_runs + 1, device=mask.device)
+    while src.numel() > 0:
+        root_src, root_dst = parent[src], parent[dst]
+        is_merge = root_src != root_dst
+        if not is_merge.any():
+            break
+        # Edges within a component stay so in the following rounds
+        src, dst = src[is_merge], dst[is_merge]
+        root_src, root_dst = root_src[is_merge], root_dst[is_merge]
+        parent.scatter_reduce_(
+            0,
+            torch.maximum(root_src, root_dst),
+            torch.minimum(root_src, root_dst),
+            reduce="amin",
+        )
+        while True:
+            grandparent = parent[parent]
+            if torch.equal(grandparent, parent):
+                break
+            parent = grandparent
+
+    labels = parent[run_ids]
+    counts = torch.bincount(labels, minlength=num_runs + 1)
+    counts[0] = 0
+    counts = counts[labels]
+    labels = labels.to(torch.int32).reshape(n, 1, h, w)
+    counts = counts.to(torch.int32).reshape(n, 1, h, w)
+    return labels, counts
 
 
 def mask_to_box(masks: torch.Tensor):
@@ -74,24 +214,95 @@ def mask_to_box(masks: torch.Tensor):
     - box_coords: [B, 1, 4], contains (x, y) coordinates of top left and bottom right box corners, dtype=torch.Tensor
     """
     B, _, h, w = masks.shape
-    device = masks.device
-    xs = torch.arange(w, device=device, dtype=torch.int32)
-    ys = torch.arange(h, device=device, dtype=torch.int32)
-    grid_xs, grid_ys = torch.meshgrid(xs, ys, indexing="xy")
-    grid_xs = grid_xs[None, None, ...].expand(B, 1, h, w)
-    grid_ys = grid_ys[None, None, ...].expand(B, 1, h, w)
-    min_xs, _ = torch.min(torch.where(masks, grid_xs, w).flatten(-2), dim=-1)
-    max_xs, _ = torch.max(torch.where(masks, grid_xs, -1).flatten(-2), dim=-1)
-    min_ys, _ = torch.min(torch.where(masks, grid_ys, h).flatten(-2), dim=-1)
-    max_ys, _ = torch.max(torch.where(masks, grid_ys, -1).flatten(-2), dim=-1)
+    row_counts = masks.sum(dim=-1, dtype=torch.int32)
+    col_counts = masks.sum(dim=-2, dtype=torch.int32)
+    min_ys, max_ys = _get_nonzero_extent(row_counts)
+    min_xs, max_xs = _get_nonzero_extent(col_counts)
+    # empty masks get the box (w, h, -1, -1)
+    is_empty = row_counts.sum(dim=-1) == 0
+    min_xs = torch.where(is_empty, w, min_xs)
+    min_ys = torch.where(is_empty, h, min_ys)
+    max_xs = torch.where(is_empty, -1, max_xs)
+    max_ys = torch.where(is_empty, -1, max_ys)
     bbox_coords = torch.stack((min_xs, min_ys, max_xs, max_ys), dim=-1)
 
-    return bbox_coords
+    return bbox_coords.to(torch.int32)
+
+
+def _get_nonzero_extent(counts: torch.Tensor):
+    # Indices of the first and last nonzero entries along the last dim (0 if empty)
+    is_nonzero = (counts > 0).to(torch.uint8)
+    first = torch.argmax(is_nonzero, dim=-1)
+    last = counts.shape[-1] - 1 - torch.argmax(is_nonzero.flip(-1), dim=-1)
+    return first, last
+
+
+def get_mask_geometry(
+    masks: torch.Tensor, mask_threshold: float = 0.0, return_rle: bool = False
+):
+    """
+    Compute the boxes, areas and centroids (and optionally the RLEs) of a batch of
+    masks, from the number of foreground pixels in each of their rows and columns
+    (without materializing coordinate grids).
+
+    Inputs:
+    - masks: [..., H, W] binary masks, or mask logits that are thresholded at
+             `mask_threshold` (e.g. the [N, 1, H, W] `video_res_masks` returned by
+             `propagate_in_video` or the [N, H, W] masks of the automatic mask
+             generator)
+    - return_rle: whether to also compute the uncompressed RLE of each mask
+
+    Returns a dict with:
+    - boxes: [..., 4] XYXY boxes (with inclusive end), [0, 0, 0, 0] for empty masks
+             (as `batched_mask_to_box`)
+    - areas: [...] numbers of foreground pixels
+    - centroids: [..., 2] (x, y) centroids, NaN for empty masks
+    - rles (if return_rle): the list of RLEs (as `mask_to_rle_pytorch`) of the
+             flattened batch of masks
+    """
+    if masks.dtype != torch.bool:
+        masks = masks > mask_threshold
+    h, w = masks.shape[-2:]
+    row_counts = masks.sum(dim=-1, dtype=torch.int32)
+    col_counts = masks.sum(dim=-2, dtype=torch.int32)
+    areas = row_counts.sum(dim=-1, dtype=torch.int64)
+
+    min_ys, max_ys = _get_nonzero_extent(row_counts)
+    min_xs, max_xs = _get_nonzero_extent(col_counts)
+    boxes = torch.stack((min_xs, min_ys, max_xs, max_ys), dim=-1)
+    boxes = boxes * (areas > 0).unsqueeze(-1)
+
+    xs = torch.arange(w, device=masks.device, dtype=torch.float32)
+    ys = torch.arange(h, device=masks.device, dtype=torch.float32)
+    centroids = torch.stack(
+        ((col_counts.float() * xs).sum(dim=-1), (row_counts.float() * ys).sum(dim=-1)),
+        dim=-1,
+    )
+    centroids = centroids / areas.unsqueeze(-1)
+
+    geometry = {"boxes": boxes, "areas": areas, "centroids": centroids}
+    if return_rle:
+        from sam2.utils.amg import mask_to_rle_pytorch
+
+        geometry["rles"] = mask_to_rle_pytorch(masks.reshape(-1, h, w))
+    return geometry
+
+
+def get_image_hw(image_size):
+    """
+    Get the (height, width) of a model input resolution, which can be given either
+    as an int (for a square resolution) or as a (height, width) pair.
+    """
+    if isinstance(image_size, int):
+        return image_size, image_size
+    height, width = image_size
+    return int(height), int(width)
 
 
 def _load_img_as_tensor(img_path, image_size):
     img_pil = Image.open(img_path)
-    img_np = np.array(img_pil.convert("RGB").resize((image_size, image_size)))
+    height, width = get_image_hw(image_size)
+    img_np = np.array(img_pil.convert("RGB").resize((width, height)))
     if img_np.dtype == np.uint8:  # np.uint8 is expected for JPEG images
         img_np = img_np / 255.0
     else:
@@ -180,7 +391,8 @@ def load_video_frames(
 ):
     """
     Load the video frames from video_path. The frames are resized to image_size as in
-    the model and are loaded to GPU if offload_video_to_cpu=False. This is used by the demo.
+    the model (an int for a square resolution or a (height, width) pair) and are loaded
+    to GPU if offload_video_to_cpu=False. This is used by the demo.
     """
     is_bytes = isinstance(video_path, bytes)
     is_str = isinstance(video_path, str)
@@ -210,6 +422,48 @@ def load_video_frames(
         )
 
 
+def get_jpg_frame_paths(jpg_folder):
+    """
+    Get the paths of the JPEG frames ("<frame_index>.jpg" format) in a directory,
+    sorted by frame index.
+    """
+    frame_names = [
+        p
+        for p in os.listdir(jpg_folder)
+        if os.path.splitext(p)[-1] in [".jpg", ".jpeg", ".JPG", ".JPEG"]
+    ]
+    frame_names.sort(key=lambda p: int(os.path.splitext(p)[0]))
+    if len(frame_names) == 0:
+        raise RuntimeError(f"no images found in {jpg_folder}")
+    return [os.path.join(jpg_folder, frame_name) for frame_name in frame_names]
+
+
+def load_video_frame(
+    img_path,
+    image_size,
+    crop_box=None,
+    img_mean=(0.485, 0.456, 0.406),
+    img_std=(0.229, 0.224, 0.225),
+):
+    """
+    Load a single video frame resized to image_size and normalized as in
+    `load_video_frames`, optionally only its `crop_box` region (an XYXY box in
+    original frame pixels, with exclusive end). Returns the [3, H, W] frame tensor
+    and the original frame height and width.
+    """
+    img_pil = Image.open(img_path)
+    video_width, video_height = img_pil.size
+    height, width = get_image_hw(image_size)
+    x0, y0, x1, y1 = crop_box if crop_box is not None else (0, 0, *img_pil.size)
+    # (the frames are decoded in full and resized with the same filter as in
+    # `load_video_frames`, so that crops and full frames are preprocessed alike)
+    img_pil = img_pil.convert("RGB").resize((width, height), box=(x0, y0, x1, y1))
+    img = torch.from_numpy(np.array(img_pil)).permute(2, 0, 1).float() / 255.0
+    img -= torch.tensor(img_mean, dtype=torch.float32)[:, None, None]
+    img /= torch.tensor(img_std, dtype=torch.float32)[:, None, None]
+    return img, video_height, video_width
+
+
 def load_video_frames_from_jpg_images(
     video_path,
     image_size,
@@ -222,7 +476,8 @@ def load_video_frames_from_jpg_images(
     """
     Load the video frames from a directory of JPEG files ("<frame_index>.jpg" format).
 
-    The frames are resized to image_size x image_size and are loaded to GPU if
+    The frames are resized to image_size (an int for a square resolution or a
+    (height, width) pair) and are loaded to GPU if
     `offload_video_to_cpu` is `False` and to CPU if `offload_video_to_cpu` is `True`.
 
     You can load a frame asynchronously by setting `async_loading_frames` to `True`.
@@ -240,16 +495,8 @@ def load_video_frames_from_jpg_images(
             "ffmpeg to start the JPEG file from 00000.jpg."
         )
 
-    frame_names = [
-        p
-        for p in os.listdir(jpg_folder)
-        if os.path.splitext(p)[-1] in [".jpg", ".jpeg", ".JPG", ".JPEG"]
-    ]
-    frame_names.sort(key=lambda p: int(os.path.splitext(p)[0]))
-    num_frames = len(frame_names)
-    if num_frames == 0:
-        raise RuntimeError(f"no images found in {jpg_folder}")
-    img_paths = [os.path.join(jpg_folder, frame_name) for frame_name in frame_names]
+    img_paths = get_jpg_frame_paths(jpg_folder)
+    num_frames = len(img_paths)
     img_mean = torch.tensor(img_mean, dtype=torch.float32)[:, None, None]
     img_std = torch.tensor(img_std, dtype=torch.float32)[:, None, None]
 
@@ -264,7 +511,8 @@ def load_video_frames_from_jpg_images(
         )
         return lazy_images, lazy_images.video_height, lazy_images.video_width
 
-    images = torch.zeros(num_frames, 3, image_size, image_size, dtype=torch.float32)
+    height, width = get_image_hw(image_size)
+    images = torch.zeros(num_frames, 3, height, width, dtype=torch.float32)
     for n, img_path in enumerate(tqdm(img_paths, desc="frame loading (JPEG)")):
         images[n], video_height, video_width = _load_img_as_tensor(img_path, image_size)
     if not offload_video_to_cpu:
@@ -294,8 +542,9 @@ def load_video_frames_from_video_file(
     decord.bridge.set_bridge("torch")
     video_height, video_width, _ = decord.VideoReader(video_path).next().shape
     # Iterate over all frames in the video
+    height, width = get_image_hw(image_size)
     images = []
-    for frame in decord.VideoReader(video_path, width=image_size, height=image_size):
+    for frame in decord.VideoReader(video_path, width=width, height=height):
         images.append(frame.permute(2, 0, 1))
 
     images = torch.stack(images, dim=0).float() / 255.0
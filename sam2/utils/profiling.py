@@ -0,0 +1,213 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict, OrderedDict
+
+import numpy as np
+import torch
+from torch.utils.hooks import RemovableHandle
+
+# callbacks called with each finished `StageRecord` (see `register_stage_callback`)
+_stage_callbacks = OrderedDict()
+_stage_stack = threading.local()  # the stages being recorded in each thread
+_NULL_CONTEXT = contextlib.nullcontext()
+
+
+def register_stage_callback(callback, record_cuda=True):
+    """
+    Register a callback called with a `StageRecord` at the end of each stage
+    instrumented with `profile_stage` (e.g. the steps of `SAM2Base.track_step`).
+    With `record_cuda`, the records of the stages also have their CUDA time and
+    change of allocated CUDA memory (when CUDA is initialized). Returns a handle
+    to remove the callback with `handle.remove()`.
+    """
+    handle = RemovableHandle(_stage_callbacks)
+    _stage_callbacks[handle.id] = (callback, record_cuda)
+    return handle
+
+
+def profile_stage(name, frame_idx=None):
+    """
+    A context manager recording the time spent in a stage of tracking on a frame
+    (inheriting the frame index of the enclosing stage if `frame_idx` is None).
+    When no callback is registered, this is a shared no-op context manager.
+    """
+    if not _stage_callbacks:
+        return _NULL_CONTEXT
+    return StageRecord(name, frame_idx)
+
+
+class StageRecord:
+    """The wall-clock time (and CUDA time and memory) of a stage on a frame."""
+
+    def __init__(self, name, frame_idx=None):
+        self.name = name
+        self.frame_idx = frame_idx
+        self.depth = 0
+        self.thread_id = threading.get_ident()
+        self.start_time = None  # in seconds, from time.perf_counter
+        self.wall_time = None  # in seconds
+        self.allocated_bytes = None  # change of the allocated CUDA memory
+        self._cuda_events = None
+
+    def __enter__(self):
+        stack = getattr(_stage_stack, "stack", None)
+        if stack is None:
+            stack = _stage_stack.stack = []
+        if self.frame_idx is None and len(stack) > 0:
+            self.frame_idx = stack[-1].frame_idx
+        self.depth = len(stack)
+        stack.append(self)
+        record_cuda = any(r for _, r in _stage_callbacks.values())
+        if record_cuda and torch.cuda.is_available() and torch.cuda.is_initialized():
+            self._cuda_events = (
+                torch.cuda.Event(enable_timing=True),
+                torch.cuda.Event(enable_timing=True),
+            )
+            self._cuda_events[0].record()
+            self.allocated_bytes = -torch.cuda.memory_allocated()
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.wall_time = time.perf_counter() - self.start_time
+        if self._cuda_events is not None:
+            self._cuda_events[1].record()
+            self.allocated_bytes += torch.cuda.memory_allocated()
+        _stage_stack.stack.pop()
+        for callback, _ in list(_stage_callbacks.values()):
+            callback(self)
+
+    @property
+    def cuda_time(self):
+        """
+        The time (in seconds) between the start and end of the stage on the CUDA
+        stream, or None if not recorded. This waits for the end of the stage.
+        """
+        if self._cuda_events is None:
+            return None
+        start_event, end_event = self._cuda_events
+        end_event.synchronize()
+        return start_event.elapsed_time(end_event) / 1000
+
+
+def _get_stats(values, num_bins):
+    values = np.asarray(values, dtype=np.float64)
+    hist, bin_edges = np.histogram(values, bins=num_bins)
+    return {
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p90": float(np.percentile(values, 90)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(values.max()),
+        "hist": hist.tolist(),
+        "bin_edges": bin_edges.tolist(),
+    }
+
+
+class TrackingProfiler:
+    """
+    Record the stages of tracking (see `profile_stage`) run within its context, and
+    export them as a Chrome trace (to open in chrome://tracing or Perfetto) or as
+    histograms aggregated per stage:
+
+        with TrackingProfiler() as profiler:
+            for _ in predictor.propagate_in_video(inference_state):
+                pass
+        profiler.export_chrome_trace("trace.json")
+        print(profiler.summary())
+    """
+
+    def __init__(self, record_cuda=True):
+        self.record_cuda = record_cuda
+        self.records = []
+        self._handle = None
+
+    def __enter__(self):
+        self._handle = register_stage_callback(self.records.append, self.record_cuda)
+        return self
+
+    def __exit__(self, *args):
+        self._handle.remove()
+        self._handle = None
+
+    def reset(self):
+        self.records.clear()
+
+    def export_chrome_trace(self, path):
+        """Export the records as a Chrome trace JSON file."""
+        if len(self.records) == 0:
+            raise RuntimeError("No tracking stage was recorded")
+        origin = min(r.start_time for r in self.records)
+        pid = os.getpid()
+        events = []
+        for r in self.records:
+            args = {"frame_idx": r.frame_idx}
+            cuda_time = r.cuda_time
+            if cuda_time is not None:
+                args["cuda_ms"] = cuda_time * 1000
+                args["allocated_bytes"] = r.allocated_bytes
+            events.append(
+                {
+                    "name": r.name,
+                    "cat": "sam2",
+                    "ph": "X",
+                    "ts": (r.start_time - origin) * 1e6,
+                    "dur": r.wall_time * 1e6,
+                    "pid": pid,
+                    "tid": r.thread_id,
+                    "args": args,
+                }
+            )
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def histograms(self, num_bins=20):
+        """
+        Aggregate the records per stage into the mean, percentiles and histogram
+        of their wall time (and of their CUDA time and change of allocated memory
+        if recorded), with times in ms.
+        """
+        values = defaultdict(lambda: defaultdict(list))
+        for r in self.records:
+            values[r.name]["wall_ms"].append(r.wall_time * 1000)
+            cuda_time = r.cuda_time
+            if cuda_time is not None:
+                values[r.name]["cuda_ms"].append(cuda_time * 1000)
+                values[r.name]["allocated_bytes"].append(r.allocated_bytes)
+        histograms = {}
+        for name, stage_values in values.items():
+            histograms[name] = {"count": len(stage_values["wall_ms"])}
+            for key, v in stage_values.items():
+                histograms[name][key] = _get_stats(v, num_bins)
+        return histograms
+
+    def frame_times(self):
+        """The total wall time (in ms) of each stage on each frame."""
+        frame_times = defaultdict(lambda: defaultdict(float))
+        for r in self.records:
+            frame_times[r.frame_idx][r.name] += r.wall_time * 1000
+        return {t: dict(times) for t, times in frame_times.items()}
+
+    def summary(self):
+        """A table of the mean and percentiles of the wall (and CUDA) time."""
+        lines = [
+            f"{'stage':<40} {'count':>7} {'mean ms':>9} {'p50 ms':>9} "
+            f"{'p90 ms':>9} {'p99 ms':>9} {'CUDA ms':>9}"
+        ]
+        for name, h in self.histograms().items():
+            wall = h["wall_ms"]
+            cuda_mean = f"{h['cuda_ms']['mean']:.2f}" if "cuda_ms" in h else "-"
+            lines.append(
+                f"{name:<40} {h['count']:>7} {wall['mean']:>9.2f} {wall['p50']:>9.2f} "
+                f"{wall['p90']:>9.2f} {wall['p99']:>9.2f} {cuda_mean:>9}"
+            )
+        return "\n".join(lines)
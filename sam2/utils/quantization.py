@@ -0,0 +1,104 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import warnings
+
+import torch
+from torch import nn
+from torch.ao.quantization import (
+    convert,
+    default_dynamic_qconfig,
+    get_default_qconfig,
+    prepare,
+    quantize_dynamic,
+    QuantWrapper,
+)
+
+# The modules of SAM2Base whose linear layers are quantized to int8 by default: the
+# Hiera trunk of the image encoder, the memory attention and the two-way transformer
+# of the mask decoder (which make up most of the compute of video tracking).
+QUANTIZED_MODULES = [
+    "image_encoder.trunk",
+    "memory_attention",
+    "sam_mask_decoder.transformer",
+]
+
+
+def _get_linear_layer_names(model, module_names):
+    names = []
+    for module_name in module_names:
+        module = model.get_submodule(module_name)
+        for name, layer in module.named_modules():
+            if isinstance(layer, nn.Linear):
+                names.append(f"{module_name}.{name}")
+    return names
+
+
+def quantize_model(
+    model, scheme="dynamic", module_names=QUANTIZED_MODULES, calibrate_fn=None
+):
+    """
+    Quantize the linear layers of the `module_names` submodules of a SAM 2 model (on
+    CPU) to int8 in place, returning the quantization config to save with its state
+    dict (see `save_quantized_checkpoint`).
+
+    With the "dynamic" scheme, the weights are quantized ahead of time and the
+    activations on the fly. With the "static" scheme, the activations are also
+    quantized with scales calibrated by `calibrate_fn(model)`, which should run the
+    model on sample frames (the quantization and dequantization of the activations
+    around each layer then make it faster than "dynamic" only on some CPUs).
+
+    The quantized model only runs on CPU, in float32 (i.e. without autocast).
+    """
+    if scheme not in ["dynamic", "static"]:
+        raise ValueError(f"Unknown quantization scheme {scheme}")
+    engine = torch.backends.quantized.engine
+    config = {"scheme": scheme, "modules": list(module_names), "engine": engine}
+    model.eval()
+    layer_names = _get_linear_layer_names(model, module_names)
+    if scheme == "dynamic":
+        quantize_dynamic(
+            model,
+            {name: default_dynamic_qconfig for name in layer_names},
+            inplace=True,
+        )
+    else:
+        # quantize the inputs and dequantize the outputs of each layer
+        for name in layer_names:
+            parent_name, _, layer_name = name.rpartition(".")
+            parent = model.get_submodule(parent_name)
+            layer = QuantWrapper(getattr(parent, layer_name))
+            layer.qconfig = get_default_qconfig(engine)
+            setattr(parent, layer_name, layer)
+        prepare(model, inplace=True)
+        if calibrate_fn is not None:
+            with torch.inference_mode():
+                calibrate_fn(model)
+        convert(model, inplace=True)
+    if hasattr(model, "maskmem_dtype"):
+        model.maskmem_dtype = torch.float32  # video predictors track in float32
+    model.quantization = config
+    return config
+
+
+def apply_quantization(model, config):
+    """
+    Quantize a model with the `config` of a quantized checkpoint before loading its
+    state dict (which then sets the quantized weights and scales).
+    """
+    torch.backends.quantized.engine = config["engine"]
+    with warnings.catch_warnings():
+        # the static quantization scales are not calibrated, but loaded afterwards
+        warnings.filterwarnings("ignore", message=".*must run observer.*")
+        quantize_model(model, config["scheme"], config["modules"])
+
+
+def save_quantized_checkpoint(model, path):
+    """
+    Save a model quantized by `quantize_model` as a checkpoint that `build_sam2` and
+    `build_sam2_video_predictor` can load (on CPU).
+    """
+    torch.save({"model": model.state_dict(), "quantization": model.quantization}, path)
@@ -0,0 +1,70 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import hashlib
+import logging
+import os
+
+import torch
+
+from sam2.utils.fast_load import load_checkpoint_file
+
+
+def get_shared_weights_path(ckpt_path, shared_dir):
+    """
+    The path in `shared_dir` of the shared weights file of a checkpoint, keyed by
+    the path, size and modification time of the checkpoint.
+    """
+    ckpt_path = os.path.abspath(ckpt_path)
+    stat = os.stat(ckpt_path)
+    key = f"{ckpt_path}:{stat.st_size}:{stat.st_mtime_ns}"
+    key = hashlib.sha256(key.encode()).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(ckpt_path))[0]
+    return os.path.join(shared_dir, f"{name}_{key}.pt")
+
+
+def share_checkpoint(ckpt_path, shared_dir="/dev/shm/sam2"):
+    """
+    Write the weights of a checkpoint (a `torch.save` or `.safetensors` file) once
+    to a file in `shared_dir` that can be memory-mapped, by default in shared memory
+    (tmpfs). Building models from it with `fast_load` (e.g. in several worker
+    processes) maps the same pages in all of them instead of copying the weights.
+    The file is created by the first process to get here and reused by the others
+    (until the checkpoint changes). Returns the path of the shared weights file.
+    """
+    ckpt_path = os.fspath(ckpt_path)
+    path = get_shared_weights_path(ckpt_path, shared_dir)
+    if os.path.exists(path):
+        return path
+    os.makedirs(shared_dir, exist_ok=True)
+    ckpt = load_checkpoint_file(ckpt_path)
+    # write atomically, since other processes may be creating or loading it
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        # (in the zip format of torch.save, which can be memory-mapped)
+        torch.save(ckpt, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    logging.info(f"Shared the weights of {ckpt_path} in {path}")
+    return path
+
+
+def get_memory_usage():
+    """
+    The memory usage of this process in MB (on Linux): its resident set size, its
+    proportional set size (where the pages shared with other processes, e.g. the
+    shared weights, are divided by the number of processes sharing them) and its
+    anonymous memory (i.e. everything but the mapped files).
+    """
+    usage = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("Rss", "Pss", "Anonymous"):
+                usage[key.lower()] = int(value.split()[0]) / 1024
+    return usage
@@ -4,8 +4,11 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
+import math
 import warnings
+from typing import List, Tuple
 
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -17,10 +20,14 @@ class SAM2Transforms(nn.Module):
         self, resolution, mask_threshold, max_hole_area=0.0, max_sprinkle_area=0.0
     ):
         """
-        Transforms for SAM2.
+        Transforms for SAM2. The `resolution` is either an int (for a square input
+        resolution) or a (height, width) pair.
         """
         super().__init__()
+        from sam2.utils.misc import get_image_hw
+
         self.resolution = resolution
+        self.resolution_hw = get_image_hw(resolution)
         self.mask_threshold = mask_threshold
         self.max_hole_area = max_hole_area
         self.max_sprinkle_area = max_sprinkle_area
@@ -29,11 +36,16 @@ class SAM2Transforms(nn.Module):
         self.to_tensor = ToTensor()
         self.transforms = torch.jit.script(
             nn.Sequential(
-                Resize((self.resolution, self.resolution)),
+                Resize(self.resolution_hw),
                 Normalize(self.mean, self.std),
             )
         )
 
+        # Host staging buffer for uint8 images (reused across calls) and the event
+        # marking the end of the last copy from it, see `forward_batch_on_device`
+        self._staging_buffer = None
+        self._staging_event = None
+
     def __call__(self, x):
         x = self.to_tensor(x)
         return self.transforms(x)
@@ -43,6 +55,73 @@ class SAM2Transforms(nn.Module):
         img_batch = torch.stack(img_batch, dim=0)
         return img_batch
 
+    def forward_batch_on_device(self, img_list, device, pin_memory=True):
+        """
+        Same as `forward_batch`, but uploads the images as uint8 HWC buffers and
+        resizes and normalizes them on `device`. Images of the same size are copied
+        through a reused (optionally pinned) host staging buffer and transformed in
+        a single batched op. Images that are not uint8 go through `forward_batch`.
+        """
+        img_np_list = [np.asarray(img) for img in img_list]
+        if any(img.dtype != np.uint8 or img.ndim != 3 for img in img_np_list):
+            return self.forward_batch(img_list).to(device)
+
+        device = torch.device(device)
+        pin_memory = pin_memory and device.type == "cuda"
+        if all(img.shape == img_np_list[0].shape for img in img_np_list):
+            img_batch = self._upload_uint8_batch(img_np_list, device, pin_memory)
+            img_batch = img_batch.permute(0, 3, 1, 2).float()
+            img_batch = self._resize_on_device(img_batch)
+        else:
+            # Images of different sizes are uploaded and resized one by one
+            img_batch = torch.cat(
+                [
+                    self._resize_on_device(
+                        torch.from_numpy(img)
+                        .to(device, non_blocking=True)
+                        .permute(2, 0, 1)[None]
+                        .float()
+                    )
+                    for img in img_np_list
+                ],
+                dim=0,
+            )
+        mean = torch.tensor(self.mean, device=device)[None, :, None, None] * 255.0
+        std = torch.tensor(self.std, device=device)[None, :, None, None] * 255.0
+        img_batch.sub_(mean).div_(std)
+        return img_batch
+
+    def _upload_uint8_batch(self, img_np_list, device, pin_memory):
+        shape = (len(img_np_list),) + img_np_list[0].shape
+        if pin_memory:
+            buffer = self._staging_buffer
+            if buffer is None or buffer.shape != shape:
+                buffer = torch.empty(shape, dtype=torch.uint8, pin_memory=True)
+                self._staging_buffer = buffer
+            elif self._staging_event is not None:
+                # wait for the previous copy from the staging buffer to finish
+                self._staging_event.synchronize()
+        else:
+            buffer = torch.empty(shape, dtype=torch.uint8)
+        buffer_np = buffer.numpy()
+        for i, img in enumerate(img_np_list):
+            buffer_np[i] = img
+        img_batch = buffer.to(device, non_blocking=pin_memory)
+        if pin_memory:
+            self._staging_event = torch.cuda.Event()
+            self._staging_event.record()
+        return img_batch
+
+    def _resize_on_device(self, img_batch):
+        # Equivalent to the `Resize` (with antialiasing) in `self.transforms`
+        return F.interpolate(
+            img_batch,
+            size=self.resolution_hw,
+            mode="bilinear",
+            align_corners=False,
+            antialias=True,
+        )
+
     def transform_coords(
         self, coords: torch.Tensor, normalize=False, orig_hw=None
     ) -> torch.Tensor:
@@ -60,7 +139,9 @@ class SAM2Transforms(nn.Module):
             coords[..., 0] = coords[..., 0] / w
             coords[..., 1] = coords[..., 1] / h
 
-        coords = coords * self.resolution  # unnormalize coords
+        # unnormalize coords
+        h, w = self.resolution_hw
+        coords = coords * torch.tensor([w, h], dtype=coords.dtype, device=coords.device)
         return coords
 
     def transform_boxes(
@@ -75,11 +156,107 @@ class SAM2Transforms(nn.Module):
 
     def postprocess_masks(self, masks: torch.Tensor, orig_hw) -> torch.Tensor:
         """
-        Perform PostProcessing on output masks.
+        Perform PostProcessing on output masks. If `orig_hw` is None, the masks
+        are kept at low resolution (and can be upsampled later with `upsample_masks`
+        or `upsample_masks_cropped`).
+        """
+        masks = self._fill_holes_and_sprinkles(masks.float())
+        if orig_hw is None:
+            return masks
+        return self.upsample_masks(masks, orig_hw)
+
+    def upsample_masks(self, masks: torch.Tensor, orig_hw) -> torch.Tensor:
+        """
+        Upsample BxCxHxW low-res masks to the original image resolution.
         """
+        if masks.shape[0] == 0:
+            return masks.new_zeros(masks.shape[:2] + tuple(orig_hw))
+        return F.interpolate(masks, orig_hw, mode="bilinear", align_corners=False)
+
+    def postprocess_masks_cropped(
+        self, masks: torch.Tensor, orig_hw, roi_threshold=None, padding=1
+    ) -> Tuple[List[torch.Tensor], torch.Tensor]:
+        """
+        Same as `postprocess_masks`, but each mask is only upsampled inside a box
+        around the pixels of its low-res logits above `roi_threshold` (defaults to
+        the mask threshold), padded by `padding` low-res pixels. For padding >= 1,
+        the upsampled logits outside of this box are all <= `roi_threshold`, so
+        thresholding the cropped masks at `roi_threshold` or above gives the same
+        result as thresholding the full masks.
+
+        Returns a list over the B*C masks of their upsampled logits inside the box,
+        and a (B*C)x4 tensor with the boxes in XYXY format (with exclusive end) in
+        the original image frame. Masks without any pixel above `roi_threshold`
+        get an empty 0x0 crop and a [0, 0, 0, 0] box. Images with a side smaller
+        than the low-res masks (which are then downsampled) are resized in full
+        before cropping, which keeps the equivalence.
+        """
+        masks = self._fill_holes_and_sprinkles(masks.float())
+        return self.upsample_masks_cropped(masks, orig_hw, roi_threshold, padding)
+
+    def upsample_masks_cropped(
+        self, masks: torch.Tensor, orig_hw, roi_threshold=None, padding=1
+    ) -> Tuple[List[torch.Tensor], torch.Tensor]:
+        """
+        Same as `upsample_masks`, but returns cropped masks as described in
+        `postprocess_masks_cropped`.
+        """
+        from sam2.utils.amg import batched_mask_to_box
+
+        if roi_threshold is None:
+            roi_threshold = self.mask_threshold
+        masks = masks.flatten(0, 1)
+        in_h, in_w = masks.shape[-2:]
+        out_h, out_w = orig_hw
+        scale_y, scale_x = out_h / in_h, out_w / in_w
+
+        in_roi = masks > roi_threshold
+        low_res_boxes = batched_mask_to_box(in_roi).tolist()  # inclusive end
+        is_empty = (~in_roi.flatten(1).any(dim=1)).tolist()
+        full_masks = None
+        if out_h < in_h or out_w < in_w:
+            # The padding argument only holds for upsampling, but the full masks are
+            # small in this case
+            full_masks = self.upsample_masks(masks[:, None], orig_hw)[:, 0]
+
+        mask_crops, mask_boxes = [], []
+        for i, (mask, (lx0, ly0, lx1, ly1), empty) in enumerate(
+            zip(masks, low_res_boxes, is_empty)
+        ):
+            if empty:
+                mask_crops.append(mask.new_zeros((0, 0)))
+                mask_boxes.append([0, 0, 0, 0])
+                continue
+            box = [
+                max(math.floor((lx0 - padding) * scale_x), 0),
+                max(math.floor((ly0 - padding) * scale_y), 0),
+                min(math.ceil((lx1 + 1 + padding) * scale_x), out_w),
+                min(math.ceil((ly1 + 1 + padding) * scale_y), out_h),
+            ]
+            if full_masks is not None:
+                mask_crops.append(full_masks[i, box[1] : box[3], box[0] : box[2]])
+            else:
+                mask_crops.append(self._interpolate_box(mask, box, orig_hw))
+            mask_boxes.append(box)
+        mask_boxes = torch.tensor(mask_boxes, dtype=torch.int64, device=masks.device)
+        return mask_crops, mask_boxes.reshape(-1, 4)
+
+    def _interpolate_box(self, mask, box, orig_hw):
+        # Equivalent to `F.interpolate(mask, orig_hw, mode="bilinear", align_corners=False)`
+        # cropped to `box`, computed with the same source indices and weights
+        x0, y0, x1, y1 = box
+        in_h, in_w = mask.shape
+        out_h, out_w = orig_hw
+        ys0, ys1, ly0, ly1 = _bilinear_source_index(y0, y1, in_h, out_h, mask.device)
+        xs0, xs1, lx0, lx1 = _bilinear_source_index(x0, x1, in_w, out_w, mask.device)
+        rows0, rows1 = mask[ys0], mask[ys1]
+        return ly0[:, None] * (lx0 * rows0[:, xs0] + lx1 * rows0[:, xs1]) + ly1[
+            :, None
+        ] * (lx0 * rows1[:, xs0] + lx1 * rows1[:, xs1])
+
+    def _fill_holes_and_sprinkles(self, masks: torch.Tensor) -> torch.Tensor:
         from sam2.utils.misc import get_connected_components
 
-        masks = masks.float()
         input_masks = masks
         mask_flat = masks.flatten(0, 1).unsqueeze(1)  # flatten as 1-channel image
         try:
@@ -110,9 +287,21 @@ class SAM2Transforms(nn.Module):
                 "functionality may be limited (which doesn't affect the results in most cases; see "
                 "https://github.com/facebookresearch/sam2/blob/main/INSTALL.md).",
                 category=UserWarning,
-                stacklevel=2,
+                stacklevel=3,
             )
             masks = input_masks
-
-        masks = F.interpolate(masks, orig_hw, mode="bilinear", align_corners=False)
         return masks
+
+
+def _bilinear_source_index(start, end, in_size, out_size, device):
+    # Source indices and weights of the output pixels in [start, end) for bilinear
+    # interpolation with align_corners=False, as computed by F.interpolate
+    # (computed as a fused multiply-add, like the interpolation kernels)
+    dst = torch.arange(start, end, dtype=torch.float32, device=device) + 0.5
+    scale = torch.full_like(dst, in_size / out_size)
+    src = torch.addcmul(torch.full_like(dst, -0.5), dst, scale).clamp(min=0)
+    idx0 = src.long()
+    idx1 = (idx0 + 1).clamp(max=in_size - 1)
+    lambda1 = src - idx0
+    lambda0 = 1 - lambda1
+    return idx0, idx1, lambda0, lambda1
@@ -8,6 +8,8 @@
 # and  https://github.com/davisvideochallenge/davis2017-evaluation
 # with their licenses found in the LICENSE_VOS_BENCHMARK and LICENSE_DAVIS files
 # in the sav_dataset directory.
+import glob
+import json
 import math
 import os
 import time
@@ -43,6 +45,10 @@ class VideoEvaluator:
         # scan the folder to find subfolders for evaluation and
         # check if the folder structure is SA-V
         to_evaluate, is_sav_format = self.scan_vid_folder(vid_name)
+        # the predicted masks may be saved in a compact format instead of PNG files
+        pred_masks = None
+        if CompactPredMasks.exists(path.join(self.pred_root, vid_name)):
+            pred_masks = CompactPredMasks(path.join(self.pred_root, vid_name))
 
         # evaluate each (gt_path, pred_path) pair
         eval_results = []
@@ -54,7 +60,7 @@ class VideoEvaluator:
             evaluator = Evaluator(name=vid_name, obj_id=obj_id)
             for frame in all_frames:
                 gt_array, pred_array = self.get_gt_and_pred(
-                    gt_path, pred_path, frame, is_sav_format
+                    gt_path, pred_path, frame, is_sav_format, pred_masks, obj_id
                 )
                 evaluator.feed_frame(mask=pred_array, gt=gt_array)
 
@@ -76,16 +82,26 @@ class VideoEvaluator:
         pred_path: str,
         f_name: str,
         is_sav_format: bool,
+        pred_masks=None,
+        obj_id=None,
     ) -> Tuple[np.ndarray, np.ndarray]:
         """
-        Get the ground-truth and predicted masks for a single frame.
+        Get the ground-truth and predicted masks for a single frame (from the
+        compact predicted masks of the video `pred_masks` if given, see
+        `CompactPredMasks`).
         """
         gt_mask_path = path.join(gt_path, f_name)
-        pred_mask_path = path.join(pred_path, f_name)
-        assert os.path.exists(pred_mask_path), f"{pred_mask_path} not found"
-
         gt_array = np.array(Image.open(gt_mask_path))
-        pred_array = np.array(Image.open(pred_mask_path))
+        if pred_masks is not None:
+            frame_name = path.splitext(f_name)[0]
+            pred_mask_path = f"{frame_name} in {pred_masks.pred_path}"
+            pred_array = pred_masks.get_mask(
+                frame_name, obj_id if is_sav_format else None
+            )
+        else:
+            pred_mask_path = path.join(pred_path, f_name)
+            assert os.path.exists(pred_mask_path), f"{pred_mask_path} not found"
+            pred_array = np.array(Image.open(pred_mask_path))
         assert (
             gt_array.shape[-2:] == pred_array.shape[-2:]
         ), f"shape mismatch: {gt_mask_path}, {pred_mask_path}"
@@ -145,6 +161,86 @@ class VideoEvaluator:
         return iou_output, boundary_f_output
 
 
+def _rle_to_mask(rle) -> np.ndarray:
+    """Decode an uncompressed RLE (in column-major order, as in COCO)."""
+    h, w = rle["size"]
+    counts = rle["counts"]
+    mask = np.repeat(np.arange(len(counts)) % 2 == 1, counts)
+    return mask.reshape(w, h).transpose()
+
+
+class CompactPredMasks:
+    """
+    The predicted masks of a video saved in a compact format by
+    `tools/vos_inference.py` (with `--output_format rle_jsonl` or `npz`), i.e. the
+    per-object RLEs of each frame in a `masks.jsonl` file, or the bit-packed masks
+    of chunks of frames in `masks_*.npz` files.
+    """
+
+    def __init__(self, pred_path):
+        self.pred_path = pred_path
+        # frame name -> per-object RLEs (JSON lines) or (chunk path, index) (NPZ)
+        self.frames = {}
+        jsonl_path = path.join(pred_path, "masks.jsonl")
+        self.is_jsonl = path.exists(jsonl_path)
+        if self.is_jsonl:
+            with open(jsonl_path) as f:
+                for line in f:
+                    frame = json.loads(line)
+                    self.frames[frame["frame"]] = frame["masks"]
+        else:
+            for chunk_path in sorted(glob.glob(path.join(pred_path, "masks_*.npz"))):
+                with np.load(chunk_path) as chunk:
+                    for i, frame_name in enumerate(chunk["frame_names"]):
+                        self.frames[str(frame_name)] = (chunk_path, i)
+        self.chunk_path = None
+        self.chunk = None
+
+    @staticmethod
+    def exists(pred_path) -> bool:
+        """Check whether the predicted masks of a video are in a compact format."""
+        return path.exists(path.join(pred_path, "masks.jsonl")) or any(
+            glob.glob(path.join(pred_path, "masks_*.npz"))
+        )
+
+    def get_frame(self, frame_name) -> Dict[int, np.ndarray]:
+        """Get the per-object masks of a frame."""
+        assert frame_name in self.frames, f"{frame_name} not found in {self.pred_path}"
+        if self.is_jsonl:
+            return {
+                int(obj_id): _rle_to_mask(rle)
+                for obj_id, rle in self.frames[frame_name].items()
+            }
+        chunk_path, i = self.frames[frame_name]
+        if chunk_path != self.chunk_path:
+            with np.load(chunk_path) as chunk:
+                self.chunk = {key: chunk[key] for key in chunk.files}
+            self.chunk_path = chunk_path
+        h, w = self.chunk["size"]
+        masks = np.unpackbits(self.chunk["masks"][i], axis=-1, count=h * w)
+        masks = masks.reshape(-1, h, w).astype(bool)
+        return dict(zip(self.chunk["object_ids"].tolist(), masks))
+
+    def get_mask(self, frame_name, obj_id=None) -> np.ndarray:
+        """
+        Get the mask of an object on a frame (SA-V format), or if `obj_id` is None,
+        the masks of all the objects as a mask of object ids (DAVIS format).
+        """
+        per_obj_mask = self.get_frame(frame_name)
+        if obj_id is not None:
+            obj_mask = per_obj_mask.get(int(obj_id))
+            if obj_mask is None:
+                h, w = next(iter(per_obj_mask.values())).shape
+                obj_mask = np.zeros((h, w), dtype=bool)
+            return obj_mask
+        h, w = next(iter(per_obj_mask.values())).shape
+        mask = np.zeros((h, w), dtype=np.uint8)
+        # the objects with lower ids are on top (as in the PNG files)
+        for obj_id in sorted(per_obj_mask, reverse=True):
+            mask[per_obj_mask[obj_id]] = obj_id
+        return mask
+
+
 #################################################################################################################
 # Functions below are from https://github.com/hkchengrex/vos-benchmark with minor modifications
 # _seg2bmap from https://github.com/hkchengrex/vos-benchmark/blob/main/vos_benchmark/utils.py
@@ -0,0 +1,165 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from sam2.automatic_mask_generator import SAM2AutomaticMaskGenerator
+from sam2.build_sam import build_sam2
+
+
+# the automatic mask generator options to compare against the default one
+MODES = {
+    "default": {},
+    "low_res_filtering": {"low_res_filtering": True},
+    "roi_mask_upsampling": {"roi_mask_upsampling": True},
+    "low_res_filtering+roi_mask_upsampling": {
+        "low_res_filtering": True,
+        "roi_mask_upsampling": True,
+    },
+}
+
+
+def load_images(image_dir, long_side=None):
+    """Load all the images in a directory (sorted by name) as HWC uint8 arrays."""
+    image_names = sorted(
+        p
+        for p in os.listdir(image_dir)
+        if os.path.splitext(p)[-1].lower() in [".jpg", ".jpeg", ".png"]
+    )
+    images = []
+    for image_name in image_names:
+        image = Image.open(os.path.join(image_dir, image_name)).convert("RGB")
+        if long_side is not None:
+            scale = long_side / max(image.size)
+            size = (round(image.width * scale), round(image.height * scale))
+            image = image.resize(size, Image.BICUBIC)
+        images.append(np.array(image))
+    return image_names, images
+
+
+def compare_annotations(ref_anns, anns, atol=1e-4):
+    """Count the annotations in `anns` that differ from those in `ref_anns`."""
+    if len(ref_anns) != len(anns):
+        return abs(len(ref_anns) - len(anns)) + min(len(ref_anns), len(anns))
+    num_diffs = 0
+    for ref_ann, ann in zip(ref_anns, anns):
+        same = (
+            ref_ann["segmentation"]["counts"] == ann["segmentation"]["counts"]
+            and ref_ann["bbox"] == ann["bbox"]
+            and ref_ann["area"] == ann["area"]
+            and abs(ref_ann["predicted_iou"] - ann["predicted_iou"]) <= atol
+            and abs(ref_ann["stability_score"] - ann["stability_score"]) <= atol
+        )
+        num_diffs += int(not same)
+    return num_diffs
+
+
+def run_mode(model, images, runs, **kwargs):
+    """Run the automatic mask generator on all images, returning the annotations,
+    the average time per image and the peak memory."""
+    mask_generator = SAM2AutomaticMaskGenerator(
+        model, output_mode="uncompressed_rle", **kwargs
+    )
+    all_anns = [mask_generator.generate(image) for image in images]  # warmup
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    start = time.perf_counter()
+    for _ in range(runs):
+        for image in images:
+            mask_generator.generate(image)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    sec_per_image = (time.perf_counter() - start) / max(runs * len(images), 1)
+    peak_memory = (
+        torch.cuda.max_memory_allocated() if torch.cuda.is_available() else None
+    )
+    return all_anns, sec_per_image, peak_memory
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that the memory- and compute-saving options of "
+        "SAM2AutomaticMaskGenerator give the same annotations as the default "
+        "settings on a fixed set of images, and compare their speed and memory."
+    )
+    parser.add_argument(
+        "--sam2_cfg",
+        type=str,
+        default="configs/sam2.1/sam2.1_hiera_b+.yaml",
+        help="SAM 2 model configuration file",
+    )
+    parser.add_argument(
+        "--sam2_checkpoint",
+        type=str,
+        default="./checkpoints/sam2.1_hiera_base_plus.pt",
+        help="path to the SAM 2 model checkpoint",
+    )
+    parser.add_argument(
+        "--image_dir",
+        type=str,
+        default="./notebooks/images",
+        help="directory containing the images to run the mask generator on",
+    )
+    parser.add_argument(
+        "--long_side",
+        type=int,
+        default=None,
+        help="resize the images to this long side (e.g. 3840 to benchmark 4K images)",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=3, help="number of timed runs over all images"
+    )
+    parser.add_argument(
+        "--use_m2m",
+        action="store_true",
+        help="whether to use the one step mask-to-mask refinement",
+    )
+    parser.add_argument(
+        "--crop_n_layers",
+        type=int,
+        default=0,
+        help="number of crop layers of the mask generator",
+    )
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = build_sam2(args.sam2_cfg, args.sam2_checkpoint, device=device)
+    image_names, images = load_images(args.image_dir, args.long_side)
+    print(f"running the mask generator on {len(images)} images: {image_names}")
+
+    ref_anns = None
+    for mode, kwargs in MODES.items():
+        all_anns, sec_per_image, peak_memory = run_mode(
+            model,
+            images,
+            args.runs,
+            use_m2m=args.use_m2m,
+            crop_n_layers=args.crop_n_layers,
+            **kwargs,
+        )
+        if ref_anns is None:
+            ref_anns = all_anns
+        num_anns = sum(len(anns) for anns in ref_anns)
+        num_diffs = sum(
+            compare_annotations(ref, anns) for ref, anns in zip(ref_anns, all_anns)
+        )
+        memory_str = (
+            f"{peak_memory / 1024**2:.0f} MiB" if peak_memory is not None else "n/a"
+        )
+        print(
+            f"{mode}: {sec_per_image:.3f} s/image, peak memory {memory_str}, "
+            f"{num_diffs}/{num_anns} annotations differ from the default"
+        )
+
+
+if __name__ == "__main__":
+    main()
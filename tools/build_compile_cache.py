@@ -0,0 +1,142 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+from sam2.benchmark.videos import write_synthetic_video
+from sam2.build_sam import build_sam2_video_predictor
+from sam2.utils.compile_cache import save_compile_cache
+
+
+def warm_up(predictor, video_dir, points, device):
+    """
+    Run the compiled predictor on all the code paths of VOS inference: a mask prompt
+    (as in vos_inference.py) on one object, a click on another, and tracking until
+    the number of memories and object pointers no longer changes. Returns the time.
+    """
+    start = time.perf_counter()
+    with torch.autocast(device_type=device.type, dtype=torch.bfloat16):
+        inference_state = predictor.init_state(video_path=video_dir)
+        height = inference_state["video_height"]
+        width = inference_state["video_width"]
+        # a square mask around the first object
+        (x, y), r = points[0], min(height, width) // 20
+        mask = np.zeros((height, width), dtype=bool)
+        mask[max(int(y) - r, 0) : int(y) + r, max(int(x) - r, 0) : int(x) + r] = True
+        predictor.add_new_mask(inference_state, 0, 1, mask)
+        predictor.add_new_points_or_box(
+            inference_state,
+            0,
+            2,
+            points=np.array([points[1]], dtype=np.float32),
+            labels=np.array([1], dtype=np.int32),
+        )
+        for _ in predictor.propagate_in_video(inference_state):
+            pass
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Prebuild the compilation caches of the vos optimized video "
+        "predictor (SAM2VideoPredictorVOS) as a deployment step, so that the worker "
+        "processes load the compiled code at startup instead of compiling it again."
+    )
+    parser.add_argument(
+        "--sam2_cfg",
+        type=str,
+        default="configs/sam2.1/sam2.1_hiera_b+.yaml",
+        help="SAM 2 model configuration file",
+    )
+    parser.add_argument(
+        "--sam2_checkpoint",
+        type=str,
+        default="./checkpoints/sam2.1_hiera_base_plus.pt",
+        help="path to the SAM 2 model checkpoint",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default="./checkpoints/compile_cache",
+        help="directory to save the compilation caches in (to be passed as "
+        "`compile_cache_dir` to build_sam2_video_predictor)",
+    )
+    parser.add_argument(
+        "--resolution",
+        type=int,
+        default=None,
+        help="input resolution of the model (default: the one of the config)",
+    )
+    parser.add_argument(
+        "--apply_postprocessing",
+        action="store_true",
+        help="build the model with postprocessing, as with the same flag of "
+        "vos_inference.py",
+    )
+    parser.add_argument(
+        "--num_frames",
+        type=int,
+        default=24,
+        help="number of frames to track for warm-up (more than the number of "
+        "memories of the model)",
+    )
+    parser.add_argument(
+        "--device", type=str, default="cuda", help="device to compile the model for"
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="after saving the caches, time the warm-up again in a new process that "
+        "loads them",
+    )
+    parser.add_argument(
+        "--load_only",
+        action="store_true",
+        help="load the caches instead of building them (used by --verify)",
+    )
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    predictor = build_sam2_video_predictor(
+        config_file=args.sam2_cfg,
+        ckpt_path=args.sam2_checkpoint,
+        device=device,
+        apply_postprocessing=args.apply_postprocessing,
+        vos_optimized=True,
+        resolution=args.resolution,
+        compile_cache_dir=args.cache_dir if args.load_only else None,
+    )
+    with tempfile.TemporaryDirectory() as video_dir:
+        points = write_synthetic_video(video_dir, args.num_frames, num_objects=2)
+        warm_up_time = warm_up(predictor, video_dir, points, device)
+    if args.load_only:
+        print(f"warm-up with the compilation caches: {warm_up_time:.1f}s")
+        return
+
+    path = save_compile_cache(predictor, args.cache_dir)
+    print(f"warm-up with compilation: {warm_up_time:.1f}s")
+    print(f"saved the compilation caches to {path}")
+    if args.verify:
+        # a new process with empty local caches, as a worker on another machine
+        with tempfile.TemporaryDirectory() as local_cache_dir:
+            env = dict(os.environ)
+            env["TORCHINDUCTOR_CACHE_DIR"] = local_cache_dir
+            env["TRITON_CACHE_DIR"] = os.path.join(local_cache_dir, "triton")
+            argv = [arg for arg in sys.argv if arg != "--verify"]
+            subprocess.run([sys.executable, *argv, "--load_only"], env=env, check=True)
+
+
+if __name__ == "__main__":
+    main()
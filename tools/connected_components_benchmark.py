@@ -0,0 +1,114 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+from sam2.utils.misc import (
+    get_connected_components,
+    get_connected_components_union_find,
+)
+
+
+def make_masks(num_masks, size, seed=0):
+    """Random blob-like binary masks of shape (N, 1, H, W), similar to low-res masks."""
+    generator = torch.Generator().manual_seed(seed)
+    noise = torch.rand(num_masks, 1, size, size, generator=generator)
+    return F.avg_pool2d(noise, 9, stride=1, padding=4) > 0.5
+
+
+def cv2_connected_components(mask_np):
+    """Labels and counts (as in `get_connected_components`) of one HxW uint8 mask."""
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(mask_np, connectivity=8)
+    counts = stats[:, -1][labels]
+    counts[labels == 0] = 0
+    return labels, counts
+
+
+def check_same_components(labels, counts, ref_labels, ref_counts):
+    """Check that two labelings define the same components with the same areas."""
+    assert np.array_equal(counts, ref_counts), "component areas differ"
+    pairs = np.unique(np.stack([labels.ravel(), ref_labels.ravel()]), axis=1)
+    assert pairs.shape[1] == len(np.unique(ref_labels)), "components differ"
+
+
+def timeit(fn, runs):
+    fn()  # warmup
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the connected components implementations used for "
+        "hole filling against opencv on batches of low-res masks."
+    )
+    parser.add_argument("--num_masks", type=int, default=64)
+    parser.add_argument("--size", type=int, default=256)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=None,
+        help="number of threads for the CPU implementations (default: torch threads)",
+    )
+    args = parser.parse_args()
+
+    masks = make_masks(args.num_masks, args.size)
+    masks_np = masks[:, 0].numpy().astype(np.uint8)
+    num_workers = args.num_workers or torch.get_num_threads()
+
+    # Check that the union-find implementation matches opencv
+    labels, counts = get_connected_components_union_find(masks, num_workers)
+    for i, mask_np in enumerate(masks_np):
+        ref_labels, ref_counts = cv2_connected_components(mask_np)
+        check_same_components(
+            labels[i, 0].numpy(), counts[i, 0].numpy(), ref_labels, ref_counts
+        )
+    print(f"union-find components match opencv on {args.num_masks} masks")
+
+    def run_cv2():
+        return [cv2_connected_components(m) for m in masks_np]
+
+    def run_cv2_threads():
+        with ThreadPoolExecutor(num_workers) as executor:
+            return list(executor.map(cv2_connected_components, masks_np))
+
+    results = {
+        "opencv": timeit(run_cv2, args.runs),
+        f"opencv ({num_workers} threads)": timeit(run_cv2_threads, args.runs),
+        "union-find, 1 thread": timeit(
+            lambda: get_connected_components_union_find(masks, 1), args.runs
+        ),
+        f"union-find, {num_workers} threads": timeit(
+            lambda: get_connected_components_union_find(masks, num_workers),
+            args.runs,
+        ),
+    }
+    if torch.cuda.is_available():
+        masks_cuda = masks.cuda()
+        results["CUDA (sam2._C or union-find)"] = timeit(
+            lambda: get_connected_components(masks_cuda), args.runs
+        )
+
+    print(f"{args.num_masks} masks of {args.size}x{args.size}:")
+    for name, sec in results.items():
+        print(f"  {name}: {sec * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,476 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import contextlib
+import json
+import os
+
+import torch
+import torch.nn.functional as F
+from sam2.build_sam import build_sam2_video_predictor
+from sam2.modeling.sam.transformer import RoPEAttention
+from sam2.modeling.sam2_utils import get_1d_sine_pe
+from torch import nn
+
+# The ONNX graphs exported by `export_onnx` (see `ONNXVideoTracker` in
+# onnx_tracker.py for how they are chained to track objects in a video)
+ONNX_GRAPHS = [
+    "image_encoder",
+    "sam_heads",
+    "sam_heads_multimask",
+    "mask_as_output",
+    "memory_encoder",
+    "memory_attention",
+    "memory_attention_no_obj_ptrs",
+]
+# The configuration of the model and the tracking (read by `ONNXVideoTracker`)
+ONNX_CONFIG_FILE = "sam2_onnx.json"
+
+
+class ImageEncoderGraph(nn.Module):
+    """
+    The image encoder with the `conv_s0` and `conv_s1` projections of the high-res
+    features of the SAM mask decoder (as in `SAM2Base.forward_image`).
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, image):
+        backbone_out = self.model.forward_image(image)
+        feat_s0, feat_s1, vision_feat = backbone_out["backbone_fpn"][-3:]
+        vision_pos = backbone_out["vision_pos_enc"][-1]
+        return feat_s0, feat_s1, vision_feat, vision_pos
+
+
+class SAMHeadsGraph(nn.Module):
+    """
+    `SAM2Base._forward_sam_heads` on point prompts, on the memory-conditioned image
+    features (the frames without prompts are tracked with a padding point).
+    """
+
+    def __init__(self, model, multimask_output):
+        super().__init__()
+        self.model = model
+        self.multimask_output = multimask_output
+
+    def forward(self, backbone_features, feat_s0, feat_s1, point_coords, point_labels):
+        point_inputs = {"point_coords": point_coords, "point_labels": point_labels}
+        _, _, _, low_res_masks, _, obj_ptr, object_score_logits = (
+            self.model._forward_sam_heads(
+                backbone_features=backbone_features,
+                point_inputs=point_inputs,
+                high_res_features=[feat_s0, feat_s1],
+                multimask_output=self.multimask_output,
+            )
+        )
+        return low_res_masks, obj_ptr, object_score_logits
+
+
+class MaskAsOutputGraph(nn.Module):
+    """`SAM2Base._use_mask_as_output` on mask prompts (at the model resolution)."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, vision_feat, feat_s0, feat_s1, mask_inputs):
+        _, _, _, low_res_masks, _, obj_ptr, object_score_logits = (
+            self.model._use_mask_as_output(vision_feat, [feat_s0, feat_s1], mask_inputs)
+        )
+        return low_res_masks, obj_ptr, object_score_logits
+
+
+class MemoryEncoderGraph(nn.Module):
+    """
+    `SAM2Base._encode_new_memory` on the low-res mask scores (upsampled to the model
+    resolution in the graph), with `is_mask_from_pts` as a boolean input.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, vision_feat, pred_masks, object_score_logits, is_mask_from_pts):
+        model = self.model
+        pred_masks_high_res = F.interpolate(
+            pred_masks, size=model.image_hw, mode="bilinear", align_corners=False
+        )
+        if model.non_overlap_masks_for_mem_enc:
+            pred_masks_high_res = model._apply_non_overlapping_constraints(
+                pred_masks_high_res
+            )
+        mask_for_mem = torch.sigmoid(pred_masks_high_res)
+        if model.binarize_mask_from_pts_for_mem_enc:
+            mask_for_mem = torch.where(
+                is_mask_from_pts, (pred_masks_high_res > 0).float(), mask_for_mem
+            )
+        if model.sigmoid_scale_for_mem_enc != 1.0:
+            mask_for_mem = mask_for_mem * model.sigmoid_scale_for_mem_enc
+        if model.sigmoid_bias_for_mem_enc != 0.0:
+            mask_for_mem = mask_for_mem + model.sigmoid_bias_for_mem_enc
+        maskmem_out = model.memory_encoder(
+            vision_feat, mask_for_mem, skip_mask_sigmoid=True  # sigmoid already applied
+        )
+        maskmem_features = maskmem_out["vision_features"]
+        maskmem_pos_enc = maskmem_out["vision_pos_enc"][-1]
+        if model.no_obj_embed_spatial is not None:
+            is_obj_appearing = (object_score_logits > 0).float()
+            maskmem_features = maskmem_features + (
+                1 - is_obj_appearing[..., None, None]
+            ) * model.no_obj_embed_spatial[..., None, None].expand(
+                *maskmem_features.shape
+            )
+        return maskmem_features, maskmem_pos_enc
+
+
+class MemoryAttentionGraph(nn.Module):
+    """
+    The memory attention of `SAM2Base._prepare_memory_conditioned_features` on the
+    spatial memories of M frames and on P object pointers selected by the tracker:
+    - maskmem_features: [M, B, C_mem, H, W] memory features;
+    - maskmem_pos_enc: [B, C_mem, H, W] spatial positional encoding of the memories
+      (the same on all frames);
+    - maskmem_tpos_idx: [M] indices of the temporal positional encoding of the
+      memories in `maskmem_tpos_enc` (i.e. `num_maskmem - t_pos - 1`);
+    - obj_ptrs: [P, B, C] object pointers;
+    - obj_ptr_pos: [P] temporal distance of the object pointers to the current
+      frame, divided by the maximum distance.
+    Without object pointers (e.g. on the frames tracked before the first prompt with
+    `only_obj_ptrs_in_the_past_for_eval`), it only attends to the memories.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(
+        self,
+        vision_feat,
+        vision_pos,
+        maskmem_features,
+        maskmem_pos_enc,
+        maskmem_tpos_idx,
+        obj_ptrs=None,
+        obj_ptr_pos=None,
+    ):
+        model = self.model
+        B, C, H, W = vision_feat.shape
+        # flatten the features MxBxCxHxW to (MHW)xBxC
+        memory = maskmem_features.flatten(3).permute(0, 3, 1, 2).flatten(0, 1)
+        memory_pos = maskmem_pos_enc.flatten(2).permute(2, 0, 1)[None]
+        memory_pos = memory_pos + model.maskmem_tpos_enc[maskmem_tpos_idx]
+        memory_pos = memory_pos.flatten(0, 1)
+        if obj_ptrs is None:
+            pix_feat_with_mem = model.memory_attention(
+                curr=vision_feat.flatten(2).permute(2, 0, 1),
+                curr_pos=vision_pos.flatten(2).permute(2, 0, 1),
+                memory=memory,
+                memory_pos=memory_pos,
+                num_obj_ptr_tokens=0,
+            )
+            return pix_feat_with_mem.permute(1, 2, 0).reshape(B, C, H, W)
+
+        if model.add_tpos_enc_to_obj_ptrs:
+            tpos_dim = C if model.proj_tpos_enc_in_obj_ptrs else model.mem_dim
+            obj_pos = get_1d_sine_pe(obj_ptr_pos, dim=tpos_dim)
+            obj_pos = model.obj_ptr_tpos_proj(obj_pos)
+            obj_pos = obj_pos.unsqueeze(1).expand(-1, B, model.mem_dim)
+        else:
+            obj_pos = obj_ptrs.new_zeros(obj_ptrs.shape[0], B, model.mem_dim)
+        if model.mem_dim < C:
+            # split a pointer into (C // mem_dim) tokens for mem_dim < C
+            obj_ptrs = obj_ptrs.reshape(-1, B, C // model.mem_dim, model.mem_dim)
+            obj_ptrs = obj_ptrs.permute(0, 2, 1, 3).flatten(0, 1)
+            obj_pos = obj_pos.repeat_interleave(C // model.mem_dim, dim=0)
+
+        pix_feat_with_mem = model.memory_attention(
+            curr=vision_feat.flatten(2).permute(2, 0, 1),
+            curr_pos=vision_pos.flatten(2).permute(2, 0, 1),
+            memory=torch.cat([memory, obj_ptrs], dim=0),
+            memory_pos=torch.cat([memory_pos, obj_pos], dim=0),
+            num_obj_ptr_tokens=obj_ptrs.shape[0],
+        )
+        # reshape the output (HW)BC => BCHW
+        return pix_feat_with_mem.permute(1, 2, 0).reshape(B, C, H, W)
+
+
+def _apply_rotary_enc_real(xq, xk, freqs_cis, repeat_freqs_k=False):
+    """
+    Same as `apply_rotary_enc`, with the rotary encoding as the real [..., 2] view
+    of `freqs_cis` (ONNX has no complex tensors).
+    """
+    cos, sin = freqs_cis.unbind(-1)
+
+    def rotate(x, cos, sin):
+        x_real, x_imag = x.float().reshape(*x.shape[:-1], -1, 2).unbind(-1)
+        out = [x_real * cos - x_imag * sin, x_real * sin + x_imag * cos]
+        return torch.stack(out, dim=-1).flatten(3)
+
+    xq_out = rotate(xq, cos, sin).type_as(xq)
+    if xk.shape[-2] == 0:
+        # no keys to rotate, due to dropout
+        return xq_out, xk
+    if repeat_freqs_k:
+        # repeat freqs along seq_len dim to match k seq_len
+        r = xk.shape[-2] // xq.shape[-2]
+        cos, sin = cos.repeat(r, 1), sin.repeat(r, 1)
+    return xq_out, rotate(xk, cos, sin).type_as(xk)
+
+
+@contextlib.contextmanager
+def real_rotary_encoding(model):
+    """Compute the rotary encoding of the RoPE attention layers in real numbers."""
+    import sam2.modeling.sam.transformer as transformer
+
+    layers = [m for m in model.modules() if isinstance(m, RoPEAttention)]
+    apply_rotary_enc = transformer.apply_rotary_enc
+    transformer.apply_rotary_enc = _apply_rotary_enc_real
+    for layer in layers:
+        layer.freqs_cis = torch.view_as_real(layer.freqs_cis)
+    try:
+        yield
+    finally:
+        transformer.apply_rotary_enc = apply_rotary_enc
+        for layer in layers:
+            layer.freqs_cis = torch.view_as_complex(layer.freqs_cis)
+
+
+def _check_model(model):
+    """Check that the tracking steps of the model are those of `ONNXVideoTracker`."""
+    unsupported = {
+        "num_maskmem": model.num_maskmem == 0,
+        "use_high_res_features_in_sam": not model.use_high_res_features_in_sam,
+        "use_obj_ptrs_in_encoder": not model.use_obj_ptrs_in_encoder,
+        "directly_add_no_mem_embed": not model.directly_add_no_mem_embed,
+        "use_mask_input_as_output_without_sam": (
+            not model.use_mask_input_as_output_without_sam
+        ),
+    }
+    for name, is_unsupported in unsupported.items():
+        if is_unsupported:
+            raise ValueError(
+                f"ONNX export is not supported for {name}={getattr(model, name)}"
+            )
+
+
+def get_onnx_config(model):
+    """The configuration of the model saved along with the ONNX graphs."""
+    return {
+        "image_hw": list(model.image_hw),
+        "image_mean": [0.485, 0.456, 0.406],
+        "image_std": [0.229, 0.224, 0.225],
+        "hidden_dim": model.hidden_dim,
+        "num_maskmem": model.num_maskmem,
+        "max_cond_frames_in_attn": model.max_cond_frames_in_attn,
+        "memory_temporal_stride_for_eval": model.memory_temporal_stride_for_eval,
+        "max_obj_ptrs_in_encoder": model.max_obj_ptrs_in_encoder,
+        "only_obj_ptrs_in_the_past_for_eval": model.only_obj_ptrs_in_the_past_for_eval,
+        "use_signed_tpos_enc_to_obj_ptrs": model.use_signed_tpos_enc_to_obj_ptrs,
+        "multimask_output_in_sam": model.multimask_output_in_sam,
+        "multimask_output_for_tracking": model.multimask_output_for_tracking,
+        "multimask_min_pt_num": model.multimask_min_pt_num,
+        "multimask_max_pt_num": model.multimask_max_pt_num,
+        "fill_hole_area": model.fill_hole_area,
+        "non_overlap_masks": model.non_overlap_masks,
+        # added to the image features of the frames with prompts (float32 values
+        # are exactly represented in JSON)
+        "no_mem_embed": model.no_mem_embed.flatten().tolist(),
+    }
+
+
+def _get_sample_inputs(model, batch_size=2, num_maskmem=2, num_obj_ptrs=3):
+    """
+    Sample inputs of each graph (with sizes > 1 on the dynamic axes, since torch.export
+    specializes the axes of size 1).
+    """
+    B = batch_size
+    H, W = model.image_hw
+    h, w = model.sam_image_embedding_hw
+    C, C_mem = model.hidden_dim, model.mem_dim
+    vision_feat = torch.randn(B, C, h, w)
+    feat_s0 = torch.randn(B, C // 8, 4 * h, 4 * w)
+    feat_s1 = torch.randn(B, C // 4, 2 * h, 2 * w)
+    point_coords = torch.rand(B, 2, 2) * torch.tensor([W, H])
+    point_labels = torch.ones(B, 2, dtype=torch.int32)
+    memory_inputs = (
+        vision_feat,
+        torch.randn(B, C, h, w),
+        torch.randn(num_maskmem, B, C_mem, h, w),
+        torch.randn(B, C_mem, h, w),
+        torch.arange(num_maskmem),
+    )
+    return {
+        "image_encoder": (torch.randn(B, 3, H, W),),
+        "sam_heads": (vision_feat, feat_s0, feat_s1, point_coords, point_labels),
+        "sam_heads_multimask": (
+            vision_feat,
+            feat_s0,
+            feat_s1,
+            point_coords,
+            point_labels,
+        ),
+        "mask_as_output": (
+            vision_feat,
+            feat_s0,
+            feat_s1,
+            (torch.rand(B, 1, H, W) > 0.5).float(),
+        ),
+        "memory_encoder": (
+            vision_feat,
+            torch.randn(B, 1, 4 * h, 4 * w),
+            torch.randn(B, 1),
+            torch.tensor(True),
+        ),
+        "memory_attention": (
+            *memory_inputs,
+            torch.randn(num_obj_ptrs, B, C),
+            torch.rand(num_obj_ptrs),
+        ),
+        "memory_attention_no_obj_ptrs": memory_inputs,
+    }
+
+
+def _get_graph_io(name):
+    """The input names, dynamic axes and output names of a graph."""
+    batch = torch.export.Dim("batch", min=1)
+    num_points = torch.export.Dim("num_points", min=1)
+    num_maskmem = torch.export.Dim("num_maskmem", min=1)
+    num_obj_ptrs = torch.export.Dim("num_obj_ptrs", min=1)
+    sam_heads_inputs = {
+        "backbone_features": {0: batch},
+        "feat_s0": {0: batch},
+        "feat_s1": {0: batch},
+        "point_coords": {0: batch, 1: num_points},
+        "point_labels": {0: batch, 1: num_points},
+    }
+    mask_outputs = ["low_res_masks", "obj_ptr", "object_score_logits"]
+    memory_inputs = {
+        "vision_feat": {0: batch},
+        "vision_pos": {0: batch},
+        "maskmem_features": {0: num_maskmem, 1: batch},
+        "maskmem_pos_enc": {0: batch},
+        "maskmem_tpos_idx": {0: num_maskmem},
+    }
+    return {
+        "image_encoder": (
+            {"image": {0: batch}},
+            ["feat_s0", "feat_s1", "vision_feat", "vision_pos"],
+        ),
+        "sam_heads": (sam_heads_inputs, mask_outputs),
+        "sam_heads_multimask": (sam_heads_inputs, mask_outputs),
+        "mask_as_output": (
+            {
+                "vision_feat": {0: batch},
+                "feat_s0": {0: batch},
+                "feat_s1": {0: batch},
+                "mask_inputs": {0: batch},
+            },
+            mask_outputs,
+        ),
+        "memory_encoder": (
+            {
+                "vision_feat": {0: batch},
+                "pred_masks": {0: batch},
+                "object_score_logits": {0: batch},
+                "is_mask_from_pts": {},
+            },
+            ["maskmem_features", "maskmem_pos_enc"],
+        ),
+        "memory_attention": (
+            {
+                **memory_inputs,
+                "obj_ptrs": {0: num_obj_ptrs, 1: batch},
+                "obj_ptr_pos": {0: num_obj_ptrs},
+            },
+            ["pix_feat_with_mem"],
+        ),
+        "memory_attention_no_obj_ptrs": (memory_inputs, ["pix_feat_with_mem"]),
+    }[name]
+
+
+@torch.no_grad()
+def export_onnx(model, output_dir, opset_version=18):
+    """
+    Export the modules of a SAM 2 model (in float32, on CPU) as the ONNX graphs of
+    `ONNX_GRAPHS` in `output_dir` (with dynamic batch, i.e. object, axes, and
+    dynamic numbers of points, memories and object pointers), along with its
+    configuration in `ONNX_CONFIG_FILE`.
+    """
+    _check_model(model)
+    model = model.float().cpu().eval()
+    os.makedirs(output_dir, exist_ok=True)
+    graphs = {
+        "image_encoder": ImageEncoderGraph(model),
+        "sam_heads": SAMHeadsGraph(model, multimask_output=False),
+        "sam_heads_multimask": SAMHeadsGraph(model, multimask_output=True),
+        "mask_as_output": MaskAsOutputGraph(model),
+        "memory_encoder": MemoryEncoderGraph(model),
+        "memory_attention": MemoryAttentionGraph(model),
+        "memory_attention_no_obj_ptrs": MemoryAttentionGraph(model),
+    }
+    sample_inputs = _get_sample_inputs(model)
+    with real_rotary_encoding(model):
+        for name, graph in graphs.items():
+            inputs, output_names = _get_graph_io(name)
+            torch.onnx.export(
+                graph.eval(),
+                sample_inputs[name],
+                os.path.join(output_dir, f"{name}.onnx"),
+                input_names=list(inputs),
+                output_names=output_names,
+                dynamic_shapes=tuple(inputs.values()),
+                opset_version=opset_version,
+                dynamo=True,
+                external_data=False,
+            )
+    with open(os.path.join(output_dir, ONNX_CONFIG_FILE), "w") as f:
+        json.dump(get_onnx_config(model), f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export SAM 2 to separate ONNX graphs for the image encoder, the "
+        "SAM prompt encoder and mask decoder, the memory encoder and the memory "
+        "attention, to track objects in videos with ONNX Runtime (see "
+        "onnx_tracker.py)."
+    )
+    parser.add_argument(
+        "--sam2_cfg",
+        type=str,
+        default="configs/sam2.1/sam2.1_hiera_b+.yaml",
+        help="SAM 2 model configuration file",
+    )
+    parser.add_argument(
+        "--sam2_checkpoint",
+        type=str,
+        default="./checkpoints/sam2.1_hiera_base_plus.pt",
+        help="path to the SAM 2 model checkpoint",
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default="./checkpoints/sam2.1_hiera_base_plus_onnx",
+        help="directory to save the ONNX graphs and model configuration in",
+    )
+    parser.add_argument(
+        "--opset_version", type=int, default=18, help="ONNX opset version"
+    )
+    args = parser.parse_args()
+
+    predictor = build_sam2_video_predictor(
+        config_file=args.sam2_cfg,
+        ckpt_path=args.sam2_checkpoint,
+        device="cpu",
+    )
+    export_onnx(predictor, args.output_dir, args.opset_version)
+    print(f"exported the ONNX graphs to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+from export_onnx import export_onnx, ONNX_CONFIG_FILE
+from onnx_tracker import ONNXVideoTracker
+from PIL import Image
+from sam2.benchmark.videos import write_synthetic_video
+from sam2.build_sam import build_sam2_video_predictor
+from sam2.utils.misc import get_jpg_frame_paths
+
+
+def track(predictor, video_dir, points, num_frames):
+    """
+    Track the objects clicked at `points` on the first frame, returning the mask
+    scores on each frame (as numpy arrays) and the tracking time per frame.
+    """
+    inference_state = predictor.init_state(video_path=video_dir)
+    for obj_id, point in enumerate(points, start=1):
+        predictor.add_new_points_or_box(
+            inference_state,
+            frame_idx=0,
+            obj_id=obj_id,
+            points=np.array([point], dtype=np.float32),
+            labels=np.array([1], dtype=np.int32),
+        )
+    masks = {}
+    start = time.perf_counter()
+    for frame_idx, _, video_res_masks in predictor.propagate_in_video(
+        inference_state, max_frame_num_to_track=num_frames - 1
+    ):
+        if isinstance(video_res_masks, torch.Tensor):
+            video_res_masks = video_res_masks.float().cpu().numpy()
+        masks[frame_idx] = video_res_masks[:, 0]
+    return masks, (time.perf_counter() - start) / len(masks)
+
+
+def compare(masks, ref_masks):
+    """The IoU and max. absolute difference of the mask scores on each frame."""
+    rows = []
+    for frame_idx, ref_frame_masks in ref_masks.items():
+        frame_masks = masks[frame_idx]
+        union = np.logical_or(frame_masks > 0, ref_frame_masks > 0).sum(axis=(1, 2))
+        intersection = np.logical_and(frame_masks > 0, ref_frame_masks > 0).sum(
+            axis=(1, 2)
+        )
+        ious = np.where(union > 0, intersection / np.maximum(union, 1), 1.0)
+        # the scores of missing objects are placeholders (NO_OBJ_SCORE)
+        valid = ref_frame_masks > -1000
+        max_diff = np.abs(frame_masks - ref_frame_masks)[valid].max(initial=0)
+        rows.append((frame_idx, ious, max_diff))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check the parity of the ONNX tracker (onnx_tracker.py) with "
+        "the PyTorch video predictor in float32 on CPU, by tracking the same clicked "
+        "objects with both."
+    )
+    parser.add_argument(
+        "--sam2_cfg",
+        type=str,
+        default="configs/sam2.1/sam2.1_hiera_b+.yaml",
+        help="SAM 2 model configuration file",
+    )
+    parser.add_argument(
+        "--sam2_checkpoint",
+        type=str,
+        default="./checkpoints/sam2.1_hiera_base_plus.pt",
+        help="path to the SAM 2 model checkpoint",
+    )
+    parser.add_argument(
+        "--onnx_dir",
+        type=str,
+        default=None,
+        help="directory of the ONNX graphs exported from the checkpoint by "
+        "export_onnx.py (default: export them to a temporary directory)",
+    )
+    parser.add_argument(
+        "--video_dir",
+        type=str,
+        default=None,
+        help="directory of JPEG frames of a video to track objects in (default: a "
+        "synthetic video of moving ellipses)",
+    )
+    parser.add_argument(
+        "--points",
+        type=float,
+        nargs="+",
+        default=None,
+        help="x y coordinates of a click on each object on the first frame of "
+        "--video_dir (default: clicks evenly spaced on the middle row)",
+    )
+    parser.add_argument(
+        "--num_objects",
+        type=int,
+        default=2,
+        help="number of objects of the synthetic video",
+    )
+    parser.add_argument(
+        "--num_frames", type=int, default=16, help="number of frames to track"
+    )
+    parser.add_argument(
+        "--min_iou",
+        type=float,
+        default=0.99,
+        help="minimum IoU of the masks of each object on each frame with the "
+        "PyTorch masks (otherwise, exit with an error)",
+    )
+    args = parser.parse_args()
+
+    predictor = build_sam2_video_predictor(
+        config_file=args.sam2_cfg, ckpt_path=args.sam2_checkpoint, device="cpu"
+    )
+    predictor.maskmem_dtype = torch.float32  # track in float32 on CPU
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        onnx_dir = args.onnx_dir
+        if onnx_dir is None or not os.path.exists(
+            os.path.join(onnx_dir, ONNX_CONFIG_FILE)
+        ):
+            onnx_dir = onnx_dir or os.path.join(tmp_dir, "onnx")
+            export_onnx(predictor, onnx_dir)
+        tracker = ONNXVideoTracker(onnx_dir)
+
+        video_dir = args.video_dir
+        if video_dir is None:
+            video_dir = os.path.join(tmp_dir, "video")
+            points = write_synthetic_video(video_dir, args.num_frames, args.num_objects)
+        elif args.points is not None:
+            points = np.array(args.points, dtype=np.float32).reshape(-1, 2)
+        else:
+            width, height = Image.open(get_jpg_frame_paths(video_dir)[0]).size
+            xs = np.linspace(0, width, args.num_objects + 2)[1:-1]
+            points = np.stack([xs, np.full_like(xs, height / 2)], axis=1)
+
+        ref_masks, torch_time = track(predictor, video_dir, points, args.num_frames)
+        masks, onnx_time = track(tracker, video_dir, points, args.num_frames)
+
+    rows = compare(masks, ref_masks)
+    print("| frame | min IoU | max abs. score diff |")
+    print("|---|---|---|")
+    for frame_idx, ious, max_diff in rows:
+        print(f"| {frame_idx} | {ious.min():.4f} | {max_diff:.2e} |")
+    min_iou = min(ious.min() for _, ious, _ in rows)
+    print(f"min IoU: {min_iou:.4f}")
+    print(f"s/frame: {torch_time:.3f} (PyTorch), {onnx_time:.3f} (ONNX Runtime)")
+    if min_iou < args.min_iou:
+        sys.exit(f"the ONNX masks differ from the PyTorch masks (IoU < {args.min_iou})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,556 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import json
+import os
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+import onnxruntime as ort
+from PIL import Image
+
+# a large negative value as a placeholder score for missing objects
+NO_OBJ_SCORE = -1024.0
+
+
+def get_jpg_frame_paths(video_dir):
+    """The JPEG frames of a video directory, sorted by their frame index."""
+    frame_names = [
+        p
+        for p in os.listdir(video_dir)
+        if os.path.splitext(p)[-1] in [".jpg", ".jpeg", ".JPG", ".JPEG"]
+    ]
+    frame_names.sort(key=lambda p: int(os.path.splitext(p)[0]))
+    return [os.path.join(video_dir, p) for p in frame_names]
+
+
+def resize_bilinear(x, size):
+    """
+    Bilinear resizing of the last two axes of a float32 array to `size` (as
+    `torch.nn.functional.interpolate` with `align_corners=False`, i.e. without
+    antialiasing for downsampling).
+    """
+
+    def get_weights(in_size, out_size):
+        src = (np.arange(out_size, dtype=np.float32) + 0.5) * np.float32(
+            in_size / out_size
+        ) - 0.5
+        src = np.maximum(src, 0)
+        i0 = np.minimum(src.astype(np.int64), in_size - 1)
+        i1 = np.minimum(i0 + 1, in_size - 1)
+        return i0, i1, (src - i0).astype(np.float32)
+
+    y0, y1, wy = get_weights(x.shape[-2], size[0])
+    x0, x1, wx = get_weights(x.shape[-1], size[1])
+    rows = x[..., y0, :] * (1 - wy[:, None]) + x[..., y1, :] * wy[:, None]
+    return rows[..., x0] * (1 - wx) + rows[..., x1] * wx
+
+
+def fill_holes_in_mask_scores(masks, max_area):
+    """
+    Fill the holes (8-connected background regions) with an area up to `max_area`
+    in mask scores of [N, 1, H, W] shape (as `sam2.utils.misc`), with OpenCV.
+    """
+    try:
+        import cv2
+    except ImportError:
+        warnings.warn("Skipping the post-processing step without OpenCV")
+        return masks
+    masks = masks.copy()
+    for mask in masks[:, 0]:
+        _, labels, stats, _ = cv2.connectedComponentsWithStats(
+            (mask <= 0).astype(np.uint8), connectivity=8
+        )
+        areas = stats[:, cv2.CC_STAT_AREA]
+        is_hole = (labels > 0) & (areas[labels] <= max_area)
+        # fill the holes with a small positive mask score (0.1) as foreground
+        mask[is_hole] = 0.1
+    return masks
+
+
+def apply_non_overlapping_constraints(pred_masks):
+    """Keep only the highest scoring object at each location in pred_masks."""
+    if pred_masks.shape[0] == 1:
+        return pred_masks
+    max_obj_inds = np.argmax(pred_masks, axis=0)[None]
+    batch_obj_inds = np.arange(pred_masks.shape[0])[:, None, None, None]
+    keep = max_obj_inds == batch_obj_inds
+    return np.where(keep, pred_masks, np.minimum(pred_masks, -10.0))
+
+
+def select_closest_cond_frames(frame_idx, cond_frame_outputs, max_cond_frame_num):
+    """Same as `sam2.modeling.sam2_utils.select_closest_cond_frames`."""
+    if max_cond_frame_num == -1 or len(cond_frame_outputs) <= max_cond_frame_num:
+        return cond_frame_outputs, {}
+    selected_outputs = {}
+    idx_before = max((t for t in cond_frame_outputs if t < frame_idx), default=None)
+    if idx_before is not None:
+        selected_outputs[idx_before] = cond_frame_outputs[idx_before]
+    idx_after = min((t for t in cond_frame_outputs if t >= frame_idx), default=None)
+    if idx_after is not None:
+        selected_outputs[idx_after] = cond_frame_outputs[idx_after]
+    num_remain = max_cond_frame_num - len(selected_outputs)
+    inds_remain = sorted(
+        (t for t in cond_frame_outputs if t not in selected_outputs),
+        key=lambda x: abs(x - frame_idx),
+    )[:num_remain]
+    selected_outputs.update((t, cond_frame_outputs[t]) for t in inds_remain)
+    unselected_outputs = {
+        t: v for t, v in cond_frame_outputs.items() if t not in selected_outputs
+    }
+    return selected_outputs, unselected_outputs
+
+
+class ONNXVideoTracker:
+    """
+    Track objects in a video with the ONNX graphs exported by export_onnx.py, with
+    the semantics of `SAM2VideoPredictor` (in float32):
+
+        tracker = ONNXVideoTracker("./checkpoints/sam2.1_hiera_base_plus_onnx")
+        inference_state = tracker.init_state(video_dir)
+        tracker.add_new_points_or_box(inference_state, 0, 1, points, labels)
+        for frame_idx, obj_ids, video_res_masks in tracker.propagate_in_video(
+            inference_state
+        ):
+            ...
+
+    The masks are numpy arrays of mask scores of [num_objects, 1, H, W] shape. The
+    tracker only depends on numpy, PIL and ONNX Runtime (and OpenCV to fill holes in
+    the masks as in the video predictor). It does not support refining the masks
+    with prompts on frames that already have an output for the object (the prompts
+    should be added before tracking, or after `reset_state`).
+    """
+
+    def __init__(self, onnx_dir, providers=None, sess_options=None):
+        with open(os.path.join(onnx_dir, "sam2_onnx.json")) as f:
+            self.config = json.load(f)
+        if providers is None:
+            providers = ["CPUExecutionProvider"]
+        self.sessions = {}
+        for name in [
+            "image_encoder",
+            "sam_heads",
+            "sam_heads_multimask",
+            "mask_as_output",
+            "memory_encoder",
+            "memory_attention",
+            "memory_attention_no_obj_ptrs",
+        ]:
+            path = os.path.join(onnx_dir, f"{name}.onnx")
+            if name == "memory_attention_no_obj_ptrs" and not os.path.exists(path):
+                continue  # (not in older exports, only needed in some cases)
+            self.sessions[name] = ort.InferenceSession(
+                path,
+                sess_options=sess_options,
+                providers=providers,
+            )
+        self.image_hw = tuple(self.config["image_hw"])
+        self.no_mem_embed = np.array(self.config["no_mem_embed"], dtype=np.float32)
+
+    def _run(self, name, **inputs):
+        """Run a graph on its inputs (the unused inputs are pruned from the graphs)."""
+        session = self.sessions[name]
+        feeds = {i.name: inputs[i.name] for i in session.get_inputs()}
+        outputs = session.run(None, feeds)
+        return dict(zip([o.name for o in session.get_outputs()], outputs))
+
+    def init_state(self, video_path):
+        """Initialize an inference state on a directory of JPEG frames."""
+        frame_paths = get_jpg_frame_paths(video_path)
+        video_width, video_height = Image.open(frame_paths[0]).size
+        return {
+            "frame_paths": frame_paths,
+            "num_frames": len(frame_paths),
+            "video_height": video_height,
+            "video_width": video_width,
+            "obj_id_to_idx": OrderedDict(),
+            "obj_ids": [],
+            # the outputs of each object on the frames with prompts (conditioning
+            # frames) and on the tracked frames (non-conditioning frames)
+            "output_dict_per_obj": {},
+            "frames_tracked_per_obj": {},
+            # the image features of the most recent frame
+            "cached_features": {},
+            # the spatial positional encoding of the memories, the same on all frames
+            "maskmem_pos_enc": None,
+        }
+
+    def reset_state(self, inference_state):
+        """Remove all objects, their prompts and their outputs."""
+        inference_state["obj_id_to_idx"].clear()
+        inference_state["obj_ids"].clear()
+        inference_state["output_dict_per_obj"].clear()
+        inference_state["frames_tracked_per_obj"].clear()
+        inference_state["cached_features"].clear()
+
+    def _obj_id_to_idx(self, inference_state, obj_id):
+        obj_idx = inference_state["obj_id_to_idx"].get(obj_id)
+        if obj_idx is None:
+            obj_idx = len(inference_state["obj_id_to_idx"])
+            inference_state["obj_id_to_idx"][obj_id] = obj_idx
+            inference_state["obj_ids"].append(obj_id)
+            inference_state["output_dict_per_obj"][obj_idx] = {
+                "cond_frame_outputs": {},
+                "non_cond_frame_outputs": {},
+            }
+            inference_state["frames_tracked_per_obj"][obj_idx] = {}
+        return obj_idx
+
+    def _load_frame(self, frame_path):
+        """Load a frame resized and normalized as in `load_video_frames`."""
+        height, width = self.image_hw
+        img = Image.open(frame_path).convert("RGB").resize((width, height))
+        img = (np.array(img) / 255.0).astype(np.float32)
+        img -= np.array(self.config["image_mean"], dtype=np.float32)
+        img /= np.array(self.config["image_std"], dtype=np.float32)
+        return img.transpose(2, 0, 1)[None]
+
+    def _get_image_feature(self, inference_state, frame_idx):
+        features = inference_state["cached_features"].get(frame_idx)
+        if features is None:
+            image = self._load_frame(inference_state["frame_paths"][frame_idx])
+            features = self._run("image_encoder", image=image)
+            # Cache the most recent frame's feature (for repeated interactions with
+            # a frame and for the memory encoder)
+            inference_state["cached_features"] = {frame_idx: features}
+        return features
+
+    def _use_multimask(self, is_init_cond_frame, num_pts):
+        config = self.config
+        return (
+            config["multimask_output_in_sam"]
+            and (is_init_cond_frame or config["multimask_output_for_tracking"])
+            and (
+                config["multimask_min_pt_num"]
+                <= num_pts
+                <= config["multimask_max_pt_num"]
+            )
+        )
+
+    def _postprocess(self, low_res_masks):
+        if self.config["fill_hole_area"] > 0:
+            low_res_masks = fill_holes_in_mask_scores(
+                low_res_masks, self.config["fill_hole_area"]
+            )
+        return low_res_masks
+
+    def _check_new_prompt(self, inference_state, frame_idx, obj_idx):
+        obj_output_dict = inference_state["output_dict_per_obj"][obj_idx]
+        if (
+            frame_idx in obj_output_dict["cond_frame_outputs"]
+            or frame_idx in inference_state["frames_tracked_per_obj"][obj_idx]
+        ):
+            raise NotImplementedError(
+                "Refining the output of an object on a frame is not supported, add "
+                "the prompts before tracking or after `reset_state` instead"
+            )
+
+    def add_new_points_or_box(
+        self,
+        inference_state,
+        frame_idx,
+        obj_id,
+        points=None,
+        labels=None,
+        normalize_coords=True,
+        box=None,
+    ):
+        """Add new points (or a box) to a frame, see `SAM2VideoPredictor`."""
+        obj_idx = self._obj_id_to_idx(inference_state, obj_id)
+        self._check_new_prompt(inference_state, frame_idx, obj_idx)
+        if (points is not None) != (labels is not None):
+            raise ValueError("points and labels must be provided together")
+        if points is None and box is None:
+            raise ValueError("at least one of points or box must be provided as input")
+
+        points = np.zeros((0, 2)) if points is None else np.asarray(points)
+        labels = np.zeros(0) if labels is None else np.asarray(labels)
+        # If `box` is provided, we add it as the first two points with labels 2 and 3
+        # along with the user-provided points (consistent with how SAM 2 is trained).
+        if box is not None:
+            points = np.concatenate([np.asarray(box).reshape(2, 2), points])
+            labels = np.concatenate([[2, 3], labels])
+        points = points.astype(np.float32)
+        if normalize_coords:
+            video_hw = (inference_state["video_height"], inference_state["video_width"])
+            points = points / np.array(video_hw[::-1], dtype=np.float32)
+        # scale the (normalized) coordinates by the model's internal image size
+        points = points * np.array(self.image_hw[::-1], dtype=np.float32)
+
+        features = self._get_image_feature(inference_state, frame_idx)
+        # the frame is an initial conditioning frame, without memory
+        pix_feat = features["vision_feat"] + self.no_mem_embed[:, None, None]
+        multimask_output = self._use_multimask(True, len(labels))
+        outputs = self._run(
+            "sam_heads_multimask" if multimask_output else "sam_heads",
+            backbone_features=pix_feat,
+            feat_s0=features["feat_s0"],
+            feat_s1=features["feat_s1"],
+            point_coords=points[None],
+            point_labels=labels.astype(np.int32)[None],
+        )
+        return self._add_cond_frame_output(inference_state, frame_idx, obj_idx, outputs)
+
+    def add_new_mask(self, inference_state, frame_idx, obj_id, mask):
+        """Add a new mask to a frame, see `SAM2VideoPredictor`."""
+        obj_idx = self._obj_id_to_idx(inference_state, obj_id)
+        self._check_new_prompt(inference_state, frame_idx, obj_idx)
+        mask = np.asarray(mask, dtype=np.float32)
+        assert mask.ndim == 2
+        # resize the mask if it doesn't match the model's image size (PIL resizes
+        # with antialiasing for downsampling, as `interpolate(antialias=True)`)
+        if mask.shape != self.image_hw:
+            height, width = self.image_hw
+            mask_pil = Image.fromarray(mask)  # a float32 ("F") image
+            mask = np.array(mask_pil.resize((width, height), Image.BILINEAR))
+            mask = (mask >= 0.5).astype(np.float32)
+
+        features = self._get_image_feature(inference_state, frame_idx)
+        outputs = self._run(
+            "mask_as_output",
+            vision_feat=features["vision_feat"],
+            feat_s0=features["feat_s0"],
+            feat_s1=features["feat_s1"],
+            mask_inputs=mask[None, None],
+        )
+        return self._add_cond_frame_output(inference_state, frame_idx, obj_idx, outputs)
+
+    def _add_cond_frame_output(self, inference_state, frame_idx, obj_idx, outputs):
+        obj_output_dict = inference_state["output_dict_per_obj"][obj_idx]
+        obj_output_dict["cond_frame_outputs"][frame_idx] = {
+            "pred_masks": self._postprocess(outputs["low_res_masks"]),
+            "obj_ptr": outputs["obj_ptr"],
+            "object_score_logits": outputs["object_score_logits"],
+            # the memory is encoded at the beginning of `propagate_in_video`
+            "maskmem_features": None,
+        }
+        return frame_idx, inference_state["obj_ids"], self._get_frame_output(
+            inference_state, frame_idx
+        )
+
+    def _get_frame_output(self, inference_state, frame_idx):
+        """The mask scores of all objects on a frame at the video resolution."""
+        h, w = self.image_hw[0] // 4, self.image_hw[1] // 4
+        num_objects = len(inference_state["obj_ids"])
+        pred_masks = np.full((num_objects, 1, h, w), NO_OBJ_SCORE, dtype=np.float32)
+        for obj_idx, obj_output_dict in inference_state["output_dict_per_obj"].items():
+            out = obj_output_dict["cond_frame_outputs"].get(frame_idx)
+            if out is None:
+                out = obj_output_dict["non_cond_frame_outputs"].get(frame_idx)
+            if out is not None:
+                pred_masks[obj_idx] = out["pred_masks"][0]
+        video_res_masks = resize_bilinear(
+            pred_masks,
+            (inference_state["video_height"], inference_state["video_width"]),
+        )
+        if self.config["non_overlap_masks"]:
+            video_res_masks = apply_non_overlapping_constraints(video_res_masks)
+        return video_res_masks
+
+    def _encode_memory(self, inference_state, frame_idx, out, is_mask_from_pts):
+        features = self._get_image_feature(inference_state, frame_idx)
+        outputs = self._run(
+            "memory_encoder",
+            vision_feat=features["vision_feat"],
+            pred_masks=out["pred_masks"],
+            object_score_logits=out["object_score_logits"],
+            is_mask_from_pts=np.array(is_mask_from_pts),
+        )
+        out["maskmem_features"] = outputs["maskmem_features"]
+        if inference_state["maskmem_pos_enc"] is None:
+            inference_state["maskmem_pos_enc"] = outputs["maskmem_pos_enc"]
+
+    def _get_memories(self, inference_state, obj_output_dict, frame_idx, reverse):
+        """
+        Select the memories and object pointers to condition a frame on, as in
+        `SAM2Base._prepare_memory_conditioned_features`.
+        """
+        config = self.config
+        num_maskmem = config["num_maskmem"]
+        num_frames = inference_state["num_frames"]
+        cond_outputs = obj_output_dict["cond_frame_outputs"]
+        selected_cond_outputs, unselected_cond_outputs = select_closest_cond_frames(
+            frame_idx, cond_outputs, config["max_cond_frames_in_attn"]
+        )
+        # the conditioning frames have t_pos=0, then the last (num_maskmem - 1)
+        # frames (taken every `stride` frames but for the last one) have
+        # t_pos=1..(num_maskmem - 1) from the earliest one to the latest one
+        t_pos_and_prevs = [(0, out) for out in selected_cond_outputs.values()]
+        stride = config["memory_temporal_stride_for_eval"]
+        for t_pos in range(1, num_maskmem):
+            t_rel = num_maskmem - t_pos  # how many frames before current frame
+            if t_rel == 1:
+                prev_frame_idx = frame_idx + t_rel if reverse else frame_idx - t_rel
+            elif not reverse:
+                prev_frame_idx = ((frame_idx - 2) // stride) * stride
+                prev_frame_idx = prev_frame_idx - (t_rel - 2) * stride
+            else:
+                prev_frame_idx = -(-(frame_idx + 2) // stride) * stride
+                prev_frame_idx = prev_frame_idx + (t_rel - 2) * stride
+            out = obj_output_dict["non_cond_frame_outputs"].get(prev_frame_idx)
+            if out is None:
+                out = unselected_cond_outputs.get(prev_frame_idx)
+            if out is not None:
+                t_pos_and_prevs.append((t_pos, out))
+        maskmem_features = np.stack(
+            [out["maskmem_features"] for _, out in t_pos_and_prevs]
+        )
+        maskmem_tpos_idx = np.array(
+            [num_maskmem - t_pos - 1 for t_pos, _ in t_pos_and_prevs], dtype=np.int64
+        )
+
+        # the object pointers of the selected conditioning frames (in the past) and
+        # of up to (max_obj_ptrs_in_encoder - 1) frames before the current frame
+        max_obj_ptrs_in_encoder = min(num_frames, config["max_obj_ptrs_in_encoder"])
+        if config["only_obj_ptrs_in_the_past_for_eval"]:
+            ptr_cond_outputs = {
+                t: out
+                for t, out in selected_cond_outputs.items()
+                if (t >= frame_idx if reverse else t <= frame_idx)
+            }
+        else:
+            ptr_cond_outputs = selected_cond_outputs
+        tpos_sign_mul = -1 if reverse else 1
+        pos_and_ptrs = [
+            (
+                (
+                    (frame_idx - t) * tpos_sign_mul
+                    if config["use_signed_tpos_enc_to_obj_ptrs"]
+                    else abs(frame_idx - t)
+                ),
+                out["obj_ptr"],
+            )
+            for t, out in ptr_cond_outputs.items()
+        ]
+        for t_diff in range(1, max_obj_ptrs_in_encoder):
+            t = frame_idx + t_diff if reverse else frame_idx - t_diff
+            if t < 0 or t >= num_frames:
+                break
+            out = obj_output_dict["non_cond_frame_outputs"].get(
+                t, unselected_cond_outputs.get(t)
+            )
+            if out is not None:
+                pos_and_ptrs.append((t_diff, out["obj_ptr"]))
+        memories = {
+            "maskmem_features": maskmem_features,
+            "maskmem_pos_enc": inference_state["maskmem_pos_enc"],
+            "maskmem_tpos_idx": maskmem_tpos_idx,
+        }
+        # (there may be no object pointers, e.g. on the frames tracked before the
+        # first conditioning frame with `only_obj_ptrs_in_the_past_for_eval`)
+        if len(pos_and_ptrs) > 0:
+            memories["obj_ptrs"] = np.stack([ptr for _, ptr in pos_and_ptrs])
+            obj_ptr_pos = np.array([pos for pos, _ in pos_and_ptrs], dtype=np.float32)
+            obj_ptr_pos /= np.float32(max_obj_ptrs_in_encoder - 1)
+            memories["obj_ptr_pos"] = obj_ptr_pos
+        return memories
+
+    def _track_frame(self, inference_state, frame_idx, obj_output_dict, reverse):
+        """Track an object on a frame from its memories."""
+        features = self._get_image_feature(inference_state, frame_idx)
+        memories = self._get_memories(
+            inference_state, obj_output_dict, frame_idx, reverse
+        )
+        if "obj_ptrs" in memories:
+            memory_attention = "memory_attention"
+        elif "memory_attention_no_obj_ptrs" in self.sessions:
+            memory_attention = "memory_attention_no_obj_ptrs"
+        else:
+            raise RuntimeError(
+                f"No object pointers to track frame {frame_idx} (which is before "
+                "the first prompted frame in the tracking direction); re-export the "
+                "ONNX graphs with export_onnx.py to get the "
+                "memory_attention_no_obj_ptrs graph."
+            )
+        pix_feat = self._run(
+            memory_attention,
+            vision_feat=features["vision_feat"],
+            vision_pos=features["vision_pos"],
+            **memories,
+        )["pix_feat_with_mem"]
+        # the frame has no prompt: SAM pads it with an empty point (with label -1)
+        multimask_output = self._use_multimask(False, 0)
+        outputs = self._run(
+            "sam_heads_multimask" if multimask_output else "sam_heads",
+            backbone_features=pix_feat,
+            feat_s0=features["feat_s0"],
+            feat_s1=features["feat_s1"],
+            point_coords=np.zeros((1, 1, 2), dtype=np.float32),
+            point_labels=-np.ones((1, 1), dtype=np.int32),
+        )
+        out = {
+            "pred_masks": outputs["low_res_masks"],
+            "obj_ptr": outputs["obj_ptr"],
+            "object_score_logits": outputs["object_score_logits"],
+        }
+        self._encode_memory(inference_state, frame_idx, out, is_mask_from_pts=False)
+        # the holes are filled in the output masks after encoding them in memory
+        out["pred_masks"] = self._postprocess(out["pred_masks"])
+        return out
+
+    def propagate_in_video_preflight(self, inference_state):
+        """Encode the memories of the frames with prompts before tracking."""
+        if len(inference_state["obj_ids"]) == 0:
+            raise RuntimeError(
+                "No input points or masks are provided for any object; please add "
+                "inputs first."
+            )
+        for obj_output_dict in inference_state["output_dict_per_obj"].values():
+            for frame_idx, out in obj_output_dict["cond_frame_outputs"].items():
+                if out["maskmem_features"] is None:
+                    # these frames are what the user interacted with
+                    self._encode_memory(
+                        inference_state, frame_idx, out, is_mask_from_pts=True
+                    )
+                obj_output_dict["non_cond_frame_outputs"].pop(frame_idx, None)
+
+    def propagate_in_video(
+        self,
+        inference_state,
+        start_frame_idx=None,
+        max_frame_num_to_track=None,
+        reverse=False,
+    ):
+        """Propagate the prompts across frames to track in the entire video."""
+        self.propagate_in_video_preflight(inference_state)
+
+        obj_ids = inference_state["obj_ids"]
+        num_frames = inference_state["num_frames"]
+        output_dict_per_obj = inference_state["output_dict_per_obj"]
+        if start_frame_idx is None:
+            # default: start from the earliest frame with input points
+            start_frame_idx = min(
+                t
+                for obj_output_dict in output_dict_per_obj.values()
+                for t in obj_output_dict["cond_frame_outputs"]
+            )
+        if max_frame_num_to_track is None:
+            max_frame_num_to_track = num_frames
+        if reverse:
+            end_frame_idx = max(start_frame_idx - max_frame_num_to_track, 0)
+            if start_frame_idx > 0:
+                processing_order = range(start_frame_idx, end_frame_idx - 1, -1)
+            else:
+                processing_order = []  # skip reverse tracking if starting from frame 0
+        else:
+            end_frame_idx = min(
+                start_frame_idx + max_frame_num_to_track, num_frames - 1
+            )
+            processing_order = range(start_frame_idx, end_frame_idx + 1)
+
+        for frame_idx in processing_order:
+            for obj_idx, obj_output_dict in output_dict_per_obj.items():
+                if frame_idx not in obj_output_dict["cond_frame_outputs"]:
+                    obj_output_dict["non_cond_frame_outputs"][frame_idx] = (
+                        self._track_frame(
+                            inference_state, frame_idx, obj_output_dict, reverse
+                        )
+                    )
+                inference_state["frames_tracked_per_obj"][obj_idx][frame_idx] = {
+                    "reverse": reverse
+                }
+            yield frame_idx, obj_ids, self._get_frame_output(inference_state, frame_idx)
@@ -0,0 +1,241 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+from sam2.build_sam import build_sam2_video_predictor
+from sam2.utils.misc import get_jpg_frame_paths
+from sam2.utils.quantization import (
+    QUANTIZED_MODULES,
+    quantize_model,
+    save_quantized_checkpoint,
+)
+from vos_inference import load_masks_from_dir, vos_inference
+
+# the J&F evaluation of the SA-V dataset tools (sav_dataset/utils/sav_benchmark.py)
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "sav_dataset"))
+
+
+def get_video_names(base_video_dir, video_list_file=None):
+    if video_list_file is not None:
+        with open(video_list_file, "r") as f:
+            return [v.strip() for v in f.readlines() if v.strip()]
+    return sorted(
+        p
+        for p in os.listdir(base_video_dir)
+        if os.path.isdir(os.path.join(base_video_dir, p))
+    )
+
+
+def build_predictor(args, ckpt_path):
+    # all the object masks are packed into a single PNG file (DAVIS format)
+    predictor = build_sam2_video_predictor(
+        config_file=args.sam2_cfg,
+        ckpt_path=ckpt_path,
+        device="cpu",
+        hydra_overrides_extra=["++model.non_overlap_masks=true"],
+    )
+    predictor.maskmem_dtype = torch.float32  # track in float32 on CPU
+    return predictor
+
+
+@torch.inference_mode()
+def calibrate(predictor, base_video_dir, input_mask_dir, video_names, num_frames):
+    """
+    Track the objects of the first-frame masks of the calibration videos over their
+    first `num_frames` frames, to calibrate the static quantization scales.
+    """
+    for video_name in video_names:
+        print(f"calibrating on {video_name}")
+        video_dir = os.path.join(base_video_dir, video_name)
+        inference_state = predictor.init_state(video_path=video_dir)
+        first_frame = get_jpg_frame_paths(video_dir)[0]
+        frame_name = os.path.splitext(os.path.basename(first_frame))[0]
+        per_obj_input_mask, _ = load_masks_from_dir(
+            input_mask_dir=input_mask_dir,
+            video_name=video_name,
+            frame_name=frame_name,
+            per_obj_png_file=False,
+        )
+        for object_id, object_mask in per_obj_input_mask.items():
+            predictor.add_new_mask(inference_state, 0, object_id, object_mask)
+        for _ in predictor.propagate_in_video(
+            inference_state, max_frame_num_to_track=num_frames - 1
+        ):
+            pass
+
+
+def run_vos_inference(predictor, args, video_names, output_mask_dir):
+    """Run VOS inference on the evaluation videos, returning the seconds per frame."""
+    total_time, num_frames = 0.0, 0
+    for video_name in video_names:
+        start = time.perf_counter()
+        vos_inference(
+            predictor=predictor,
+            base_video_dir=args.base_video_dir,
+            input_mask_dir=args.input_mask_dir,
+            output_mask_dir=output_mask_dir,
+            video_name=video_name,
+        )
+        total_time += time.perf_counter() - start
+        video_dir = os.path.join(args.base_video_dir, video_name)
+        num_frames += len(get_jpg_frame_paths(video_dir))
+    return total_time / num_frames
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Quantize the linear layers of the Hiera trunk, the memory "
+        "attention and the mask decoder transformer of a SAM 2 model to int8 for CPU "
+        "inference, and compare the J&F of the float32 and int8 models on a small "
+        "DAVIS-format VOS set."
+    )
+    parser.add_argument(
+        "--sam2_cfg",
+        type=str,
+        default="configs/sam2.1/sam2.1_hiera_b+.yaml",
+        help="SAM 2 model configuration file",
+    )
+    parser.add_argument(
+        "--sam2_checkpoint",
+        type=str,
+        default="./checkpoints/sam2.1_hiera_base_plus.pt",
+        help="path to the SAM 2 model checkpoint",
+    )
+    parser.add_argument(
+        "--output_checkpoint",
+        type=str,
+        default="./checkpoints/sam2.1_hiera_base_plus_int8.pt",
+        help="path to save the quantized checkpoint to (which can be loaded with "
+        "build_sam2 or build_sam2_video_predictor on CPU)",
+    )
+    parser.add_argument(
+        "--scheme",
+        type=str,
+        default="dynamic",
+        choices=["dynamic", "static"],
+        help="int8 quantization of the weights only (dynamic) or also of the "
+        "activations with calibrated scales (static)",
+    )
+    parser.add_argument(
+        "--modules",
+        type=str,
+        nargs="+",
+        default=QUANTIZED_MODULES,
+        help="submodules of the model whose linear layers are quantized",
+    )
+    parser.add_argument(
+        "--base_video_dir",
+        type=str,
+        required=True,
+        help="directory containing videos (as JPEG files) for calibration and "
+        "evaluation",
+    )
+    parser.add_argument(
+        "--input_mask_dir",
+        type=str,
+        required=True,
+        help="directory containing the ground-truth masks (as PNG files) of each "
+        "video, the first one being the input of VOS inference",
+    )
+    parser.add_argument(
+        "--video_list_file",
+        type=str,
+        default=None,
+        help="text file containing the list of video names to evaluate on",
+    )
+    parser.add_argument(
+        "--calib_video_list_file",
+        type=str,
+        default=None,
+        help="text file containing the list of video names to calibrate the static "
+        "quantization on (default: the evaluation videos)",
+    )
+    parser.add_argument(
+        "--calib_frames",
+        type=int,
+        default=16,
+        help="number of frames of each video to calibrate on",
+    )
+    parser.add_argument(
+        "--output_mask_dir",
+        type=str,
+        default="./outputs/quantization",
+        help="directory to save the output masks of the float32 and int8 models in",
+    )
+    parser.add_argument(
+        "--skip_eval",
+        action="store_true",
+        help="only quantize the model, without the J&F comparison",
+    )
+    args = parser.parse_args()
+
+    video_names = get_video_names(args.base_video_dir, args.video_list_file)
+    calib_video_names = video_names
+    if args.calib_video_list_file is not None:
+        calib_video_names = get_video_names(
+            args.base_video_dir, args.calib_video_list_file
+        )
+
+    predictor = build_predictor(args, args.sam2_checkpoint)
+    quantize_model(
+        predictor,
+        args.scheme,
+        args.modules,
+        calibrate_fn=lambda model: calibrate(
+            model,
+            args.base_video_dir,
+            args.input_mask_dir,
+            calib_video_names,
+            args.calib_frames,
+        ),
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(args.output_checkpoint)), exist_ok=True)
+    save_quantized_checkpoint(predictor, args.output_checkpoint)
+    print(
+        f"saved the {args.scheme} int8 checkpoint to {args.output_checkpoint} "
+        f"({os.path.getsize(args.output_checkpoint) / 1024**2:.0f} MB, float32: "
+        f"{os.path.getsize(args.sam2_checkpoint) / 1024**2:.0f} MB)"
+    )
+    if args.skip_eval:
+        return
+
+    from utils.sav_benchmark import benchmark
+
+    rows = []
+    for name, ckpt_path in [
+        ("float32", args.sam2_checkpoint),
+        (f"int8 ({args.scheme})", args.output_checkpoint),
+    ]:
+        # load the int8 model back from its checkpoint, as in deployment
+        predictor = build_predictor(args, ckpt_path)
+        output_mask_dir = os.path.join(args.output_mask_dir, name.split(" ")[0])
+        sec_per_frame = run_vos_inference(
+            predictor, args, video_names, output_mask_dir
+        )
+        rows.append((name, output_mask_dir, sec_per_frame))
+        del predictor
+
+    # only evaluate on the videos we ran inference on
+    global_jf, global_j, global_f, _ = benchmark(
+        [args.input_mask_dir] * len(rows),
+        [output_mask_dir for _, output_mask_dir, _ in rows],
+        strict=False,
+        verbose=False,
+    )
+    print("| model | J&F | J | F | s/frame |")
+    print("|---|---|---|---|---|")
+    for (name, _, sec_per_frame), jf, j, f in zip(rows, global_jf, global_j, global_f):
+        print(f"| {name} | {jf:.1f} | {j:.1f} | {f:.1f} | {sec_per_frame:.3f} |")
+    print(f"J&F change: {global_jf[1] - global_jf[0]:+.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import contextlib
+import time
+
+import numpy as np
+import torch
+from sam2.build_sam import (
+    build_sam2_video_predictor,
+    get_resolution_hw,
+    RESOLUTION_PROFILES,
+)
+
+
+def get_device():
+    if torch.cuda.is_available():
+        return torch.device("cuda")
+    elif torch.backends.mps.is_available():
+        return torch.device("mps")
+    return torch.device("cpu")
+
+
+def synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    elif device.type == "mps":
+        torch.mps.synchronize()
+
+
+def track_video(predictor, video_dir, point, max_frames, runs):
+    """
+    Track the object under a positive click on the first frame of a video, returning
+    the binary masks (at the video resolution) and the average tracking FPS.
+    """
+    inference_state = predictor.init_state(video_path=video_dir)
+    predictor.add_new_points_or_box(
+        inference_state=inference_state,
+        frame_idx=0,
+        obj_id=1,
+        points=np.array([point], dtype=np.float32),
+        labels=np.array([1], np.int32),
+    )
+
+    def propagate():
+        masks = {}
+        for frame_idx, _, mask_logits in predictor.propagate_in_video(
+            inference_state, max_frame_num_to_track=max_frames
+        ):
+            masks[frame_idx] = (mask_logits[0, 0] > 0.0).cpu().numpy()
+        return masks
+
+    device = predictor.device
+    masks = propagate()  # warmup
+    synchronize(device)
+    start = time.perf_counter()
+    for _ in range(runs):
+        propagate()
+    synchronize(device)
+    fps = runs * len(masks) / (time.perf_counter() - start)
+    return masks, fps
+
+
+def mask_iou(mask, ref_mask):
+    union = np.logical_or(mask, ref_mask).sum()
+    if union == 0:
+        return 1.0
+    return np.logical_and(mask, ref_mask).sum() / union
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the tracking speed and accuracy of SAM 2 video "
+        "predictors at different input resolutions. The accuracy is the mean IoU "
+        "(J) of the masks with those of the first resolution profile."
+    )
+    parser.add_argument(
+        "--sam2_cfg",
+        type=str,
+        default="configs/sam2.1/sam2.1_hiera_b+.yaml",
+        help="SAM 2 model configuration file",
+    )
+    parser.add_argument(
+        "--sam2_checkpoint",
+        type=str,
+        default="./checkpoints/sam2.1_hiera_base_plus.pt",
+        help="path to the SAM 2 model checkpoint",
+    )
+    parser.add_argument(
+        "--video_dir",
+        type=str,
+        default="./notebooks/videos/bedroom",
+        help="directory of JPEG frames of the video to track an object in",
+    )
+    parser.add_argument(
+        "--point",
+        type=float,
+        nargs=2,
+        default=[210, 350],
+        help="(x, y) coordinates of a positive click on the object on the first frame",
+    )
+    parser.add_argument(
+        "--profiles",
+        type=str,
+        nargs="+",
+        default=list(RESOLUTION_PROFILES),
+        help="resolution profiles to compare (names in RESOLUTION_PROFILES or sizes "
+        "such as 1024 or 576,1024 for height,width), the first one being the reference",
+    )
+    parser.add_argument(
+        "--max_frames", type=int, default=None, help="number of frames to track"
+    )
+    parser.add_argument(
+        "--runs", type=int, default=3, help="number of timed runs over the video"
+    )
+    parser.add_argument(
+        "--vos_optimized",
+        action="store_true",
+        help="whether to use the compiled SAM2VideoPredictorVOS",
+    )
+    args = parser.parse_args()
+
+    device = get_device()
+    if device.type == "cuda":
+        autocast = torch.autocast("cuda", dtype=torch.bfloat16)
+    else:
+        autocast = contextlib.nullcontext()
+
+    rows, ref_masks = [], None
+    for profile in args.profiles:
+        resolution = profile
+        if profile not in RESOLUTION_PROFILES:
+            resolution = [int(s) for s in profile.split(",")]
+            resolution = resolution[0] if len(resolution) == 1 else resolution
+        height, width = get_resolution_hw(resolution)
+        predictor = build_sam2_video_predictor(
+            args.sam2_cfg,
+            args.sam2_checkpoint,
+            device=device,
+            vos_optimized=args.vos_optimized,
+            resolution=resolution,
+        )
+        with autocast:
+            masks, fps = track_video(
+                predictor, args.video_dir, args.point, args.max_frames, args.runs
+            )
+        if ref_masks is None:
+            ref_masks = masks
+        mean_iou = np.mean([mask_iou(masks[t], ref_masks[t]) for t in ref_masks])
+        num_tokens = (height // 16) * (width // 16)
+        rows.append((profile, f"{height}x{width}", num_tokens, fps, mean_iou))
+        del predictor
+
+    print(f"device: {device}, reference profile: {args.profiles[0]}")
+    print("| profile | input HxW | stride 16 tokens | FPS | speed-up | J vs reference |")
+    print("|---|---|---|---|---|---|")
+    ref_fps = rows[0][3]
+    for profile, size, num_tokens, fps, mean_iou in rows:
+        print(
+            f"| {profile} | {size} | {num_tokens} | {fps:.2f} | "
+            f"{fps / ref_fps:.2f}x | {mean_iou:.3f} |"
+        )
+
+
+if __name__ == "__main__":
+    main()
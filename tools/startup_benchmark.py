@@ -0,0 +1,152 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+MODES = ["default", "fast_load", "shared_weights"]
+
+
+def measure_startup(args):
+    """
+    Time the import of sam2.build_sam (with PyTorch and Hydra) and the building of
+    the video predictor in this process, and get the memory usage of the process.
+    """
+    start = time.perf_counter()
+    from sam2.build_sam import build_sam2_video_predictor
+
+    import_time = time.perf_counter() - start
+    start = time.perf_counter()
+    predictor = build_sam2_video_predictor(
+        config_file=args.sam2_cfg,
+        ckpt_path=args.sam2_checkpoint,
+        device=args.device,
+        fast_load=args.mode == "fast_load",
+        config_cache_dir=args.config_cache_dir,
+        shared_weights_dir=args.shared_weights_dir,
+    )
+    if args.device == "cuda":
+        import torch
+
+        torch.cuda.synchronize()
+    build_time = time.perf_counter() - start
+    from sam2.utils.shared_weights import get_memory_usage
+
+    memory_usage = get_memory_usage()  # (with the predictor loaded)
+    del predictor
+    return {
+        "import": import_time,
+        "build": build_time,
+        # the maximum resident set size, in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "anonymous_mb": memory_usage["anonymous"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the startup of the SAM 2 video predictor in new "
+        "processes (as when starting workers), building it as usual or with "
+        "`fast_load` (memory-mapped checkpoint loaded directly on the device, "
+        "without initializing the parameters, and a cached resolved config) or "
+        "with weights shared in memory between processes (`shared_weights_dir`)."
+    )
+    parser.add_argument(
+        "--sam2_cfg",
+        type=str,
+        default="configs/sam2.1/sam2.1_hiera_b+.yaml",
+        help="SAM 2 model configuration file",
+    )
+    parser.add_argument(
+        "--sam2_checkpoint",
+        type=str,
+        default="./checkpoints/sam2.1_hiera_base_plus.pt",
+        help="path to the SAM 2 model checkpoint (a .pt or .safetensors file)",
+    )
+    parser.add_argument(
+        "--device", type=str, default="cuda", help="device to load the model on"
+    )
+    parser.add_argument(
+        "--num_runs",
+        type=int,
+        default=5,
+        help="number of processes to start for each mode (the first one of each "
+        "mode is not counted, as it warms up the page cache and the config cache)",
+    )
+    parser.add_argument(
+        "--mode",
+        type=str,
+        choices=MODES,
+        default=None,
+        help="measure the startup of this process in this mode (used internally)",
+    )
+    parser.add_argument(
+        "--config_cache_dir",
+        type=str,
+        default=None,
+        help="directory of the cached resolved configs (used internally)",
+    )
+    parser.add_argument(
+        "--shared_weights_dir",
+        type=str,
+        default=None,
+        help="directory of the shared weights (used internally)",
+    )
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        print(json.dumps(measure_startup(args)))
+        return
+
+    results = {}
+    # the shared weights are in shared memory (if available, as on Linux)
+    shm_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    with tempfile.TemporaryDirectory() as config_cache_dir:
+        with tempfile.TemporaryDirectory(dir=shm_dir) as shared_weights_dir:
+            for mode in MODES:
+                argv = [*sys.argv, "--mode", mode]
+                if mode == "fast_load":
+                    argv += ["--config_cache_dir", config_cache_dir]
+                elif mode == "shared_weights":
+                    argv += ["--shared_weights_dir", shared_weights_dir]
+                runs = []
+                for _ in range(args.num_runs + 1):
+                    output = subprocess.run(
+                        [sys.executable, *argv],
+                        capture_output=True,
+                        text=True,
+                        check=True,
+                    ).stdout
+                    runs.append(json.loads(output.strip().splitlines()[-1]))
+                results[mode] = runs[1:]
+
+    print(
+        "| mode | import (s) | build (s) | total (s) | peak RSS (MB) "
+        "| anonymous memory (MB) |"
+    )
+    print("|---|---|---|---|---|---|")
+    for mode, runs in results.items():
+        import_time = np.median([run["import"] for run in runs])
+        build_time = np.median([run["build"] for run in runs])
+        total_time = np.median([run["import"] + run["build"] for run in runs])
+        peak_rss = np.median([run["peak_rss_mb"] for run in runs])
+        anonymous = np.median([run["anonymous_mb"] for run in runs])
+        print(
+            f"| {mode} | {import_time:.2f} | {build_time:.2f} | {total_time:.2f} "
+            f"| {peak_rss:.0f} | {anonymous:.0f} |"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,15 +5,29 @@
 # LICENSE file in the root directory of this source tree.
 
 import argparse
+import glob
+import json
+import multiprocessing
 import os
+import threading
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import torch
 from PIL import Image
 from sam2.build_sam import build_sam2_video_predictor
+from sam2.utils.amg import mask_to_rle_pytorch
+from sam2.utils.cpu_inference import configure_cpu_threads, get_num_cpu_cores
 
 
+# the file marking the output masks of a video as complete (to resume inference)
+COMPLETED_MARKER_FILE = ".completed"
+
+# the formats of the output masks of a video (see `MaskWriter`)
+OUTPUT_FORMATS = ["png", "rle_jsonl", "npz"]
+
 # the PNG palette for DAVIS 2017 dataset
 DAVIS_PALETTE = b"\x00\x00\x00\x80\x00\x00\x00\x80\x00\x80\x80\x00\x00\x00\x80\x80\x00\x80\x00\x80\x80\x80\x80\x80@\x00\x00\xc0\x00\x00@\x80\x00\xc0\x80\x00@\x00\x80\xc0\x00\x80@\x80\x80\xc0\x80\x80\x00@\x00\x80@\x00\x00\xc0\x00\x80\xc0\x00\x00@\x80\x80@\x80\x00\xc0\x80\x80\xc0\x80@@\x00\xc0@\x00@\xc0\x00\xc0\xc0\x00@@\x80\xc0@\x80@\xc0\x80\xc0\xc0\x80\x00\x00@\x80\x00@\x00\x80@\x80\x80@\x00\x00\xc0\x80\x00\xc0\x00\x80\xc0\x80\x80\xc0@\x00@\xc0\x00@@\x80@\xc0\x80@@\x00\xc0\xc0\x00\xc0@\x80\xc0\xc0\x80\xc0\x00@@\x80@@\x00\xc0@\x80\xc0@\x00@\xc0\x80@\xc0\x00\xc0\xc0\x80\xc0\xc0@@@\xc0@@@\xc0@\xc0\xc0@@@\xc0\xc0@\xc0@\xc0\xc0\xc0\xc0\xc0 \x00\x00\xa0\x00\x00 \x80\x00\xa0\x80\x00 \x00\x80\xa0\x00\x80 \x80\x80\xa0\x80\x80`\x00\x00\xe0\x00\x00`\x80\x00\xe0\x80\x00`\x00\x80\xe0\x00\x80`\x80\x80\xe0\x80\x80 @\x00\xa0@\x00 \xc0\x00\xa0\xc0\x00 @\x80\xa0@\x80 \xc0\x80\xa0\xc0\x80`@\x00\xe0@\x00`\xc0\x00\xe0\xc0\x00`@\x80\xe0@\x80`\xc0\x80\xe0\xc0\x80 \x00@\xa0\x00@ \x80@\xa0\x80@ \x00\xc0\xa0\x00\xc0 \x80\xc0\xa0\x80\xc0`\x00@\xe0\x00@`\x80@\xe0\x80@`\x00\xc0\xe0\x00\xc0`\x80\xc0\xe0\x80\xc0 @@\xa0@@ \xc0@\xa0\xc0@ @\xc0\xa0@\xc0 \xc0\xc0\xa0\xc0\xc0`@@\xe0@@`\xc0@\xe0\xc0@`@\xc0\xe0@\xc0`\xc0\xc0\xe0\xc0\xc0\x00 \x00\x80 \x00\x00\xa0\x00\x80\xa0\x00\x00 \x80\x80 \x80\x00\xa0\x80\x80\xa0\x80@ \x00\xc0 \x00@\xa0\x00\xc0\xa0\x00@ \x80\xc0 \x80@\xa0\x80\xc0\xa0\x80\x00`\x00\x80`\x00\x00\xe0\x00\x80\xe0\x00\x00`\x80\x80`\x80\x00\xe0\x80\x80\xe0\x80@`\x00\xc0`\x00@\xe0\x00\xc0\xe0\x00@`\x80\xc0`\x80@\xe0\x80\xc0\xe0\x80\x00 @\x80 @\x00\xa0@\x80\xa0@\x00 \xc0\x80 \xc0\x00\xa0\xc0\x80\xa0\xc0@ @\xc0 @@\xa0@\xc0\xa0@@ \xc0\xc0 \xc0@\xa0\xc0\xc0\xa0\xc0\x00`@\x80`@\x00\xe0@\x80\xe0@\x00`\xc0\x80`\xc0\x00\xe0\xc0\x80\xe0\xc0@`@\xc0`@@\xe0@\xc0\xe0@@`\xc0\xc0`\xc0@\xe0\xc0\xc0\xe0\xc0  \x00\xa0 \x00 \xa0\x00\xa0\xa0\x00  \x80\xa0 \x80 \xa0\x80\xa0\xa0\x80` \x00\xe0 \x00`\xa0\x00\xe0\xa0\x00` \x80\xe0 \x80`\xa0\x80\xe0\xa0\x80 `\x00\xa0`\x00 \xe0\x00\xa0\xe0\x00 `\x80\xa0`\x80 \xe0\x80\xa0\xe0\x80``\x00\xe0`\x00`\xe0\x00\xe0\xe0\x00``\x80\xe0`\x80`\xe0\x80\xe0\xe0\x80  @\xa0 @ \xa0@\xa0\xa0@  \xc0\xa0 \xc0 \xa0\xc0\xa0\xa0\xc0` @\xe0 @`\xa0@\xe0\xa0@` \xc0\xe0 \xc0`\xa0\xc0\xe0\xa0\xc0 `@\xa0`@ \xe0@\xa0\xe0@ `\xc0\xa0`\xc0 \xe0\xc0\xa0\xe0\xc0``@\xe0`@`\xe0@\xe0\xe0@``\xc0\xe0`\xc0`\xe0\xc0\xe0\xe0\xc0"
 
@@ -113,6 +127,186 @@ def save_masks_to_dir(
             save_ann_png(output_mask_path, output_mask, output_palette)
 
 
+class MaskWriter:
+    """
+    Write the output masks of a video in the background (in a pool of threads) as
+    they are predicted, in one of the `OUTPUT_FORMATS`:
+    - "png": PNG files as in `save_masks_to_dir`;
+    - "rle_jsonl": a `masks.jsonl` file in the output directory of the video, with
+      a JSON line {"frame": frame_name, "masks": {object_id: rle}} per frame, where
+      the masks are uncompressed RLEs (as in `sam2.utils.amg.mask_to_rle_pytorch`);
+    - "npz": `masks_{chunk_idx:05d}.npz` files with chunks of `npz_chunk_size`
+      frames, each with the "frame_names", "object_ids" and "size" of its masks, and
+      the "masks" of each frame and object as flattened bits (with `np.packbits`).
+    Both compact formats can be read by `sav_dataset/utils/sav_benchmark.py`. At
+    most `max_pending` frames (or a single chunk, if `npz_chunk_size` is larger) are
+    queued for writing, besides the npz chunk being filled (otherwise, `write` waits).
+    """
+
+    def __init__(
+        self,
+        output_mask_dir,
+        video_name,
+        height,
+        width,
+        per_obj_png_file,
+        output_palette,
+        output_format="png",
+        num_threads=4,
+        max_pending=16,
+        npz_chunk_size=64,
+    ):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(
+                f"Unknown output format {output_format}, expected one of "
+                f"{OUTPUT_FORMATS}"
+            )
+        self.output_mask_dir = output_mask_dir
+        self.video_name = video_name
+        self.height = height
+        self.width = width
+        self.per_obj_png_file = per_obj_png_file
+        self.output_palette = output_palette
+        self.output_format = output_format
+        self.max_pending = max_pending
+        self.npz_chunk_size = npz_chunk_size
+        self.executor = ThreadPoolExecutor(max_workers=num_threads)
+        self.pending = []  # (future, number of frames) pairs
+        self.num_pending_frames = 0
+        self.video_dir = os.path.join(output_mask_dir, video_name)
+        os.makedirs(self.video_dir, exist_ok=True)
+        if output_format == "rle_jsonl":
+            self.jsonl_file = open(os.path.join(self.video_dir, "masks.jsonl"), "w")
+            self.jsonl_lock = threading.Lock()
+        elif output_format == "npz":
+            # remove the chunks of a previous (e.g. interrupted) run
+            for path in glob.glob(os.path.join(self.video_dir, "masks_*.npz")):
+                os.remove(path)
+            self.npz_chunk = []
+            self.npz_chunk_idx = 0
+
+    def write(self, frame_name, per_obj_output_mask):
+        """Queue the output masks (a dict of per-object masks) of a frame."""
+        if self.output_format == "png":
+            self._submit(
+                1,
+                save_masks_to_dir,
+                output_mask_dir=self.output_mask_dir,
+                video_name=self.video_name,
+                frame_name=frame_name,
+                per_obj_output_mask=per_obj_output_mask,
+                height=self.height,
+                width=self.width,
+                per_obj_png_file=self.per_obj_png_file,
+                output_palette=self.output_palette,
+            )
+        elif self.output_format == "rle_jsonl":
+            self._submit(1, self._write_jsonl_line, frame_name, per_obj_output_mask)
+        else:
+            self.npz_chunk.append((frame_name, per_obj_output_mask))
+            if len(self.npz_chunk) == self.npz_chunk_size:
+                self._submit_npz_chunk()
+
+    def close(self):
+        """Wait for all the masks to be written (raising any error while writing)."""
+        try:
+            if self.output_format == "npz" and len(self.npz_chunk) > 0:
+                self._submit_npz_chunk()
+            for future, _ in self.pending:
+                future.result()
+        finally:
+            self.executor.shutdown()
+            if self.output_format == "rle_jsonl":
+                self.jsonl_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _submit(self, num_frames, fn, *args, **kwargs):
+        # wait for the oldest frames to be written if too many of them are queued
+        while (
+            len(self.pending) > 0
+            and self.num_pending_frames + num_frames > self.max_pending
+        ):
+            future, future_num_frames = self.pending.pop(0)
+            future.result()
+            self.num_pending_frames -= future_num_frames
+        self.pending.append((self.executor.submit(fn, *args, **kwargs), num_frames))
+        self.num_pending_frames += num_frames
+
+    def _get_masks(self, per_obj_output_mask):
+        object_ids = sorted(per_obj_output_mask)
+        masks = np.stack(
+            [
+                per_obj_output_mask[object_id].reshape(self.height, self.width)
+                for object_id in object_ids
+            ]
+        )
+        return object_ids, masks
+
+    def _write_jsonl_line(self, frame_name, per_obj_output_mask):
+        object_ids, masks = self._get_masks(per_obj_output_mask)
+        rles = mask_to_rle_pytorch(torch.from_numpy(masks))
+        line = json.dumps(
+            {
+                "frame": frame_name,
+                "masks": {
+                    str(object_id): rle for object_id, rle in zip(object_ids, rles)
+                },
+            }
+        )
+        with self.jsonl_lock:
+            self.jsonl_file.write(line + "\n")
+
+    def _submit_npz_chunk(self):
+        chunk_path = os.path.join(
+            self.video_dir, f"masks_{self.npz_chunk_idx:05d}.npz"
+        )
+        self._submit(
+            len(self.npz_chunk), self._write_npz_chunk, chunk_path, self.npz_chunk
+        )
+        self.npz_chunk = []
+        self.npz_chunk_idx += 1
+
+    def _write_npz_chunk(self, chunk_path, chunk):
+        # (the objects are the same on all the frames)
+        object_ids = sorted(chunk[0][1])
+        masks = np.stack([self._get_masks(frame_masks)[1] for _, frame_masks in chunk])
+        np.savez_compressed(
+            chunk_path,
+            frame_names=np.array([frame_name for frame_name, _ in chunk]),
+            object_ids=np.array(object_ids, dtype=np.int64),
+            size=np.array([self.height, self.width], dtype=np.int64),
+            masks=np.packbits(masks.reshape(len(chunk), len(object_ids), -1), axis=-1),
+        )
+
+
+def get_num_frames(base_video_dir, video_name):
+    """Get the number of JPEG frames of a video."""
+    video_dir = os.path.join(base_video_dir, video_name)
+    return sum(
+        os.path.splitext(p)[-1] in [".jpg", ".jpeg", ".JPG", ".JPEG"]
+        for p in os.listdir(video_dir)
+    )
+
+
+def is_video_completed(output_mask_dir, video_name):
+    """Check whether all the output masks of a video have been saved."""
+    return os.path.exists(
+        os.path.join(output_mask_dir, video_name, COMPLETED_MARKER_FILE)
+    )
+
+
+def mark_video_completed(output_mask_dir, video_name):
+    """Mark the output masks of a video as complete (after saving all of them)."""
+    marker_path = os.path.join(output_mask_dir, video_name, COMPLETED_MARKER_FILE)
+    with open(marker_path, "w"):
+        pass
+
+
 @torch.inference_mode()
 @torch.autocast(device_type="cuda", dtype=torch.bfloat16)
 def vos_inference(
@@ -124,6 +318,8 @@ def vos_inference(
     score_thresh=0.0,
     use_all_masks=False,
     per_obj_png_file=False,
+    output_format="png",
+    num_writer_threads=4,
 ):
     """Run VOS inference on a single video with the given predictor."""
     # load the video frames and initialize the inference state on this video
@@ -217,31 +413,27 @@ def vos_inference(
             "for VOS datasets that don't have all objects to track appearing "
             "in the first frame (such as LVOS or YouTube-VOS)."
         )
-    # run propagation throughout the video and collect the results in a dict
-    os.makedirs(os.path.join(output_mask_dir, video_name), exist_ok=True)
+    # run propagation throughout the video and write the output masks to
+    # output_mask_dir in the background as they are predicted
     output_palette = input_palette or DAVIS_PALETTE
-    video_segments = {}  # video_segments contains the per-frame segmentation results
-    for out_frame_idx, out_obj_ids, out_mask_logits in predictor.propagate_in_video(
-        inference_state
-    ):
-        per_obj_output_mask = {
-            out_obj_id: (out_mask_logits[i] > score_thresh).cpu().numpy()
-            for i, out_obj_id in enumerate(out_obj_ids)
-        }
-        video_segments[out_frame_idx] = per_obj_output_mask
-
-    # write the output masks as palette PNG files to output_mask_dir
-    for out_frame_idx, per_obj_output_mask in video_segments.items():
-        save_masks_to_dir(
-            output_mask_dir=output_mask_dir,
-            video_name=video_name,
-            frame_name=frame_names[out_frame_idx],
-            per_obj_output_mask=per_obj_output_mask,
-            height=height,
-            width=width,
-            per_obj_png_file=per_obj_png_file,
-            output_palette=output_palette,
-        )
+    with MaskWriter(
+        output_mask_dir=output_mask_dir,
+        video_name=video_name,
+        height=height,
+        width=width,
+        per_obj_png_file=per_obj_png_file,
+        output_palette=output_palette,
+        output_format=output_format,
+        num_threads=num_writer_threads,
+    ) as mask_writer:
+        for out_frame_idx, out_obj_ids, out_mask_logits in predictor.propagate_in_video(
+            inference_state
+        ):
+            per_obj_output_mask = {
+                out_obj_id: (out_mask_logits[i] > score_thresh).cpu().numpy()
+                for i, out_obj_id in enumerate(out_obj_ids)
+            }
+            mask_writer.write(frame_names[out_frame_idx], per_obj_output_mask)
 
 
 @torch.inference_mode()
@@ -255,6 +447,8 @@ def vos_separate_inference_per_object(
     score_thresh=0.0,
     use_all_masks=False,
     per_obj_png_file=False,
+    output_format="png",
+    num_writer_threads=4,
 ):
     """
     Run VOS inference on a single video with the given predictor.
@@ -326,42 +520,128 @@ def vos_separate_inference_per_object(
             obj_scores = out_mask_logits.cpu().numpy()
             output_scores_per_object[object_id][out_frame_idx] = obj_scores
 
-    # post-processing: consolidate the per-object scores into per-frame masks
-    os.makedirs(os.path.join(output_mask_dir, video_name), exist_ok=True)
+    # post-processing: consolidate the per-object scores into per-frame masks and
+    # write them to output_mask_dir in the background
     output_palette = input_palette or DAVIS_PALETTE
-    video_segments = {}  # video_segments contains the per-frame segmentation results
-    for frame_idx in range(len(frame_names)):
-        scores = torch.full(
-            size=(len(object_ids), 1, height, width),
-            fill_value=-1024.0,
-            dtype=torch.float32,
-        )
-        for i, object_id in enumerate(object_ids):
-            if frame_idx in output_scores_per_object[object_id]:
-                scores[i] = torch.from_numpy(
-                    output_scores_per_object[object_id][frame_idx]
-                )
+    with MaskWriter(
+        output_mask_dir=output_mask_dir,
+        video_name=video_name,
+        height=height,
+        width=width,
+        per_obj_png_file=per_obj_png_file,
+        output_palette=output_palette,
+        output_format=output_format,
+        num_threads=num_writer_threads,
+    ) as mask_writer:
+        for frame_idx in range(len(frame_names)):
+            scores = torch.full(
+                size=(len(object_ids), 1, height, width),
+                fill_value=-1024.0,
+                dtype=torch.float32,
+            )
+            for i, object_id in enumerate(object_ids):
+                if frame_idx in output_scores_per_object[object_id]:
+                    scores[i] = torch.from_numpy(
+                        output_scores_per_object[object_id][frame_idx]
+                    )
+
+            if not per_obj_png_file:
+                scores = predictor._apply_non_overlapping_constraints(scores)
+            per_obj_output_mask = {
+                object_id: (scores[i] > score_thresh).cpu().numpy()
+                for i, object_id in enumerate(object_ids)
+            }
+            mask_writer.write(frame_names[frame_idx], per_obj_output_mask)
+
+
+def build_predictor(args, device="cuda"):
+    """Build the video predictor for VOS inference on a device."""
+    # if we use per-object PNG files, they could possibly overlap in inputs and outputs
+    hydra_overrides_extra = [
+        "++model.non_overlap_masks=" + ("false" if args.per_obj_png_file else "true")
+    ]
+    predictor = build_sam2_video_predictor(
+        config_file=args.sam2_cfg,
+        ckpt_path=args.sam2_checkpoint,
+        device=device,
+        apply_postprocessing=args.apply_postprocessing,
+        hydra_overrides_extra=hydra_overrides_extra,
+        vos_optimized=args.use_vos_optimized_video_predictor,
+        compile_cache_dir=args.compile_cache_dir,
+        shared_weights_dir=args.shared_weights_dir,
+    )
+    if torch.device(device).type == "cpu":
+        # the inference runs in bfloat16 autocast on GPU only
+        predictor.maskmem_dtype = torch.float32
+    return predictor
 
-        if not per_obj_png_file:
-            scores = predictor._apply_non_overlapping_constraints(scores)
-        per_obj_output_mask = {
-            object_id: (scores[i] > score_thresh).cpu().numpy()
-            for i, object_id in enumerate(object_ids)
-        }
-        video_segments[frame_idx] = per_obj_output_mask
-
-    # write the output masks as palette PNG files to output_mask_dir
-    for frame_idx, per_obj_output_mask in video_segments.items():
-        save_masks_to_dir(
-            output_mask_dir=output_mask_dir,
+
+def run_video(predictor, args, video_name):
+    """
+    Run VOS inference on a video and mark its output masks as complete. Returns the
+    inference time.
+    """
+    start = time.perf_counter()
+    if not args.track_object_appearing_later_in_video:
+        vos_inference(
+            predictor=predictor,
+            base_video_dir=args.base_video_dir,
+            input_mask_dir=args.input_mask_dir,
+            output_mask_dir=args.output_mask_dir,
             video_name=video_name,
-            frame_name=frame_names[frame_idx],
-            per_obj_output_mask=per_obj_output_mask,
-            height=height,
-            width=width,
-            per_obj_png_file=per_obj_png_file,
-            output_palette=output_palette,
+            score_thresh=args.score_thresh,
+            use_all_masks=args.use_all_masks,
+            per_obj_png_file=args.per_obj_png_file,
+            output_format=args.output_format,
+            num_writer_threads=args.num_writer_threads,
         )
+    else:
+        vos_separate_inference_per_object(
+            predictor=predictor,
+            base_video_dir=args.base_video_dir,
+            input_mask_dir=args.input_mask_dir,
+            output_mask_dir=args.output_mask_dir,
+            video_name=video_name,
+            score_thresh=args.score_thresh,
+            use_all_masks=args.use_all_masks,
+            per_obj_png_file=args.per_obj_png_file,
+            output_format=args.output_format,
+            num_writer_threads=args.num_writer_threads,
+        )
+    mark_video_completed(args.output_mask_dir, video_name)
+    return time.perf_counter() - start
+
+
+# the predictor and arguments of a worker process of the parallel inference
+_worker_predictor = None
+_worker_args = None
+_worker_device = None
+
+
+def _init_worker(args, devices, num_workers, worker_counter):
+    global _worker_predictor, _worker_args, _worker_device
+    # assign the devices to the workers in a round-robin way
+    with worker_counter.get_lock():
+        worker_idx = worker_counter.value
+        worker_counter.value += 1
+    _worker_device = devices[worker_idx % len(devices)]
+    if torch.device(_worker_device).type == "cuda":
+        torch.cuda.set_device(_worker_device)
+    elif torch.device(_worker_device).type == "cpu":
+        # split the CPU cores between the workers running on the CPU, rather than
+        # each of them using threads for all the cores
+        num_cpu_workers = sum(
+            torch.device(devices[idx % len(devices)]).type == "cpu"
+            for idx in range(num_workers)
+        )
+        configure_cpu_threads(max(1, get_num_cpu_cores() // num_cpu_workers))
+    _worker_args = args
+    _worker_predictor = build_predictor(args, _worker_device)
+
+
+def _run_video_in_worker(video_name):
+    inference_time = run_video(_worker_predictor, _worker_args, video_name)
+    return video_name, _worker_device, inference_time
 
 
 def main():
@@ -439,19 +719,58 @@ def main():
         action="store_true",
         help="whether to use vos optimized video predictor with all modules compiled",
     )
-    args = parser.parse_args()
-
-    # if we use per-object PNG files, they could possibly overlap in inputs and outputs
-    hydra_overrides_extra = [
-        "++model.non_overlap_masks=" + ("false" if args.per_obj_png_file else "true")
-    ]
-    predictor = build_sam2_video_predictor(
-        config_file=args.sam2_cfg,
-        ckpt_path=args.sam2_checkpoint,
-        apply_postprocessing=args.apply_postprocessing,
-        hydra_overrides_extra=hydra_overrides_extra,
-        vos_optimized=args.use_vos_optimized_video_predictor,
+    parser.add_argument(
+        "--compile_cache_dir",
+        type=str,
+        default=None,
+        help="directory of the compilation caches prebuilt by build_compile_cache.py "
+        "for the vos optimized video predictor (to skip compiling it from scratch)",
+    )
+    parser.add_argument(
+        "--devices",
+        type=str,
+        nargs="+",
+        default=["cuda"],
+        help="devices to run VOS prediction on, e.g. `cuda:0 cuda:1` (the worker "
+        "processes are assigned to them in a round-robin way)",
     )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=None,
+        help="number of worker processes, each with its own model, that run VOS "
+        "prediction on the videos in parallel, the longest videos first "
+        "(default: one per device, or no worker process for a single device)",
+    )
+    parser.add_argument(
+        "--shared_weights_dir",
+        type=str,
+        default=None,
+        help="directory (e.g. /dev/shm/sam2) to share the model weights in between "
+        "the worker processes on CPU, see build_sam2_video_predictor",
+    )
+    parser.add_argument(
+        "--output_format",
+        type=str,
+        choices=OUTPUT_FORMATS,
+        default="png",
+        help="format of the output masks: PNG files, or per video, RLEs in a JSON "
+        "lines file or bit-packed masks in compressed NPZ files (which can all be "
+        "read by sav_dataset/utils/sav_benchmark.py)",
+    )
+    parser.add_argument(
+        "--num_writer_threads",
+        type=int,
+        default=4,
+        help="number of threads writing the output masks in the background",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip the videos whose output masks were all saved by a previous run "
+        "(e.g. to resume VOS prediction after a crash)",
+    )
+    args = parser.parse_args()
 
     if args.use_all_masks:
         print("using all available masks in input_mask_dir as input to the SAM 2 model")
@@ -470,37 +789,62 @@ def main():
             for p in os.listdir(args.base_video_dir)
             if os.path.isdir(os.path.join(args.base_video_dir, p))
         ]
+    if args.resume:
+        num_videos = len(video_names)
+        video_names = [
+            video_name
+            for video_name in video_names
+            if not is_video_completed(args.output_mask_dir, video_name)
+        ]
+        print(f"skipping {num_videos - len(video_names)} already completed videos")
     print(f"running VOS prediction on {len(video_names)} videos:\n{video_names}")
 
-    for n_video, video_name in enumerate(video_names):
-        print(f"\n{n_video + 1}/{len(video_names)} - running on {video_name}")
-        if not args.track_object_appearing_later_in_video:
-            vos_inference(
-                predictor=predictor,
-                base_video_dir=args.base_video_dir,
-                input_mask_dir=args.input_mask_dir,
-                output_mask_dir=args.output_mask_dir,
-                video_name=video_name,
-                score_thresh=args.score_thresh,
-                use_all_masks=args.use_all_masks,
-                per_obj_png_file=args.per_obj_png_file,
-            )
-        else:
-            vos_separate_inference_per_object(
-                predictor=predictor,
-                base_video_dir=args.base_video_dir,
-                input_mask_dir=args.input_mask_dir,
-                output_mask_dir=args.output_mask_dir,
-                video_name=video_name,
-                score_thresh=args.score_thresh,
-                use_all_masks=args.use_all_masks,
-                per_obj_png_file=args.per_obj_png_file,
-            )
+    num_frames = {
+        video_name: get_num_frames(args.base_video_dir, video_name)
+        for video_name in video_names
+    }
+    if len(video_names) == 0:
+        return
+    num_workers = min(args.num_workers or len(args.devices), len(video_names))
+    start = time.perf_counter()
+    if num_workers <= 1:
+        predictor = build_predictor(args, args.devices[0])
+        for n_video, video_name in enumerate(video_names):
+            print(f"\n{n_video + 1}/{len(video_names)} - running on {video_name}")
+            run_video(predictor, args, video_name)
+    else:
+        # each worker builds its model once, then takes the videos from a queue,
+        # the longest first so that the workers finish at about the same time
+        video_names = sorted(video_names, key=num_frames.get, reverse=True)
+        # (CUDA can't be used in forked processes)
+        context = multiprocessing.get_context("spawn")
+        worker_counter = context.Value("i", 0)
+        with context.Pool(
+            num_workers,
+            initializer=_init_worker,
+            initargs=(args, args.devices, num_workers, worker_counter),
+        ) as pool:
+            for n_video, (video_name, device, inference_time) in enumerate(
+                pool.imap_unordered(_run_video_in_worker, video_names)
+            ):
+                print(
+                    f"\n{n_video + 1}/{len(video_names)} - completed {video_name} on "
+                    f"{device} ({num_frames[video_name] / inference_time:.1f} fps)"
+                )
+            pool.close()
+            pool.join()
+    total_time = time.perf_counter() - start
 
+    total_frames = sum(num_frames.values())
     print(
         f"completed VOS prediction on {len(video_names)} videos -- "
         f"output masks saved to {args.output_mask_dir}"
     )
+    print(
+        f"processed {total_frames} frames in {total_time:.1f}s with {num_workers} "
+        f"worker(s) ({total_frames / max(total_time, 1e-6):.1f} fps, "
+        f"{len(video_names) / max(total_time, 1e-6) * 3600:.0f} videos/hour)"
+    )
 
 
 if __name__ == "__main__":